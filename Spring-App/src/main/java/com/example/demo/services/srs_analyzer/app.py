@@ -1,13 +1,16 @@
 from config import create_app, Config
 from text_processing import TextProcessor
 from srs_validator import DocumentValidator
-from similarity_analyzer import SimilarityAnalyzer
+from similarity_analyzer import SimilarityAnalyzer, SIMILARITY_SPARSE, EMBEDDING_DIMENSIONS
 from business_value_evaluator import BusinessValueEvaluator
-from flask import request, jsonify, session, Flask, send_file
+from flask import request, jsonify, session, Flask, send_file, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from functools import wraps
 import time
+import math
+import tempfile
+import asyncio
 import os
 from werkzeug.utils import secure_filename
 import logging
@@ -19,16 +22,26 @@ from google.oauth2 import id_token
 from google.auth.transport import requests
 from flask_cors import CORS
 from simple_references_validator import SimpleReferencesValidator
+from plagiarism_checker import check_plagiarism
+from submission_fingerprints import SubmissionFingerprintIndex
+from section_index import SectionIndex
+from llm_gateway import LLM_GATEWAY
+from diagram_cache import DIAGRAM_CACHE
+from image_encoding import IMAGE_ENCODER
+from diagram_extraction import DIAGRAM_EXTRACTION
+from llm_scheduler import LLM_SCHEDULER
+from rate_limit_storage import limiter_storage_uri, RATE_LIMIT_STORAGE
+from rate_limiter import RateLimiter, RateLimitExceeded
+from llm_clients import is_rate_limit, no_wait, retry_after_seconds
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict
+from typing import Dict
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import openai
 import PyPDF2
 import docx
 import nltk
 from nltk.tokenize import sent_tokenize
-from bs4 import BeautifulSoup
 import requests
 import random
 import re
@@ -110,38 +123,97 @@ GOOGLE_CLIENT_ID = Config.GOOGLE_CLIENT_ID
 
 text_processor = TextProcessor()
 similarity_analyzer = SimilarityAnalyzer()
+submission_index = SubmissionFingerprintIndex()
+section_index = SectionIndex()
 
+# Prefix of the limiter's keys and of the flask.g attributes it sets per request
+LIMITER_KEY_PREFIX = "srs"
+# Limits are shared by all workers when RATE_LIMIT_STORAGE_URI points to a store;
+# if the store goes down each worker falls back to in-memory limits
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"]
+    default_limits=["200 per day", "50 per hour"],
+    key_prefix=LIMITER_KEY_PREFIX,
+    storage_uri=limiter_storage_uri(),
+    in_memory_fallback_enabled=True
 )
 
+# Retry-After sent when a provider rate limit gives no hint of its own
+UPSTREAM_RETRY_AFTER = 30
+
 # Create a thread pool for CPU-bound tasks
 thread_pool = ThreadPoolExecutor(max_workers=4)
 
-def handle_rate_limit(max_retries=3, initial_backoff=1):
+def rate_limited_response(message, retry_after):
+    """429 response telling the client when to retry."""
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({
+        'status': 'error',
+        'message': message,
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def is_upstream_limit(e):
+    """True for the rate limit errors of our own limiters and of the LLM providers."""
+    return isinstance(e, RateLimitExceeded) or is_rate_limit(e) or "RATE_LIMIT_EXCEEDED" in str(e)
+
+def handle_rate_limit(requests_per_minute=5, burst=5):
+    """
+    Limit a route per client with a token bucket, without ever sleeping in the worker.
+
+    Requests over the limit, and requests that hit a provider rate limit, get an
+    immediate 429 whose Retry-After is the bucket's refill time (or the provider's
+    hint), so the worker is free for requests that can make progress. LLM calls made
+    by the view run under llm_clients.no_wait(), so a full quota also answers 429
+    instead of sleeping. Coroutine views are supported. Views that catch exceptions themselves must re-raise those for
+    which is_upstream_limit() is true.
+    """
+    route_limiter = RateLimiter(storage=RATE_LIMIT_STORAGE, tokens_per_second=requests_per_minute / 60,
+                                max_tokens=burst)
+
+    def upstream_retry_after(e):
+        return getattr(e, 'retry_after', None) or retry_after_seconds(e) or UPSTREAM_RETRY_AFTER
+
     def decorator(f):
+        def check(name):
+            allowed, retry_after = route_limiter.check(f"{name}:{get_remote_address()}")
+            if not allowed:
+                logger.warning(f"Rate limit reached for {name}; retry in {retry_after:.1f}s")
+                return rate_limited_response('Rate limit exceeded. Please try again later.', retry_after)
+            return None
+
+        if asyncio.iscoroutinefunction(f):
+            @wraps(f)
+            async def async_wrapped(*args, **kwargs):
+                rejected = check(f.__name__)
+                if rejected:
+                    return rejected
+                try:
+                    with no_wait():
+                        return await f(*args, **kwargs)
+                except Exception as e:
+                    if is_upstream_limit(e):
+                        return rate_limited_response('Upstream rate limit exceeded. Please try again later.',
+                                                     upstream_retry_after(e))
+                    raise
+            return async_wrapped
+
         @wraps(f)
         def wrapped(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
-                try:
+            rejected = check(f.__name__)
+            if rejected:
+                return rejected
+            try:
+                with no_wait():
                     return f(*args, **kwargs)
-                except Exception as e:
-                    if "RATE_LIMIT_EXCEEDED" in str(e):
-                        wait_time = initial_backoff * (2 ** retries)
-                        logger.warning(f"Rate limit exceeded. Retrying in {wait_time} seconds. Attempt {retries + 1}/{max_retries}")
-                        time.sleep(wait_time)
-                        retries += 1
-                    else:
-                        raise e
-            
-            # If we've exhausted all retries
-            return jsonify({
-                'status': 'error',
-                'message': 'Rate limit exceeded after maximum retries'
-            }), 429
+            except Exception as e:
+                if is_upstream_limit(e):
+                    return rate_limited_response('Upstream rate limit exceeded. Please try again later.',
+                                                 upstream_retry_after(e))
+                raise
         return wrapped
     return decorator
 
@@ -289,8 +361,42 @@ def setup_content_analysis_logger():
 # Create the content analysis logger
 content_analysis_logger = setup_content_analysis_logger()
 
-def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
-    """Analyze a single document."""
+def index_submission_sections(submission: Dict, file_path: str, all_scopes: Dict, diagram_scopes: Dict,
+                              similarity_coo: Dict = None) -> int:
+    """
+    Store the scope embeddings of a submission in the course section index.
+
+    Embeddings computed for the similarity matrix are reused; scopes that were not
+    embedded there are embedded now.
+    """
+    if not section_index.available:
+        return 0
+    titles = list(all_scopes.keys())
+    embeddings = similarity_coo.get("embeddings") if similarity_coo else None
+    if embeddings is None or len(embeddings) != len(titles):
+        embeddings = np.zeros((len(titles), EMBEDDING_DIMENSIONS))
+    missing = [i for i in range(len(titles)) if not embeddings[i].any() and all_scopes[titles[i]]]
+    if missing:
+        embeddings[missing] = similarity_analyzer.embed_scopes([all_scopes[titles[i]] for i in missing])
+    return section_index.add_submission(
+        submission['course_id'],
+        submission.get('submission_id') or os.path.basename(file_path),
+        [{
+            "title": title,
+            "type": similarity_analyzer.determine_section_type(title),
+            "kind": "diagram" if diagram_scopes and title in diagram_scopes else "section",
+            "embedding": embeddings[i]
+        } for i, title in enumerate(titles)],
+        document_name=submission.get('document_name')
+    )
+
+def analyze_document(file_path: str, analyses: Dict,document_type: str, submission: Dict = None) -> Dict:
+    """
+    Analyze a single document.
+
+    When submission carries a course_id (and optionally submission_id and document_name),
+    the document is also compared with the earlier submissions of that course.
+    """
     print("\n" + "="*50)
     print("ANALYZE DOCUMENT FUNCTION")
     print("="*50)
@@ -314,7 +420,8 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                 analyses.get('ContentAnalysis'),
                 analyses.get('BusinessValueAnalysis'),
                 analyses.get('SpellCheck'),
-                analyses.get('PlagiarismCheck')]):
+                analyses.get('PlagiarismCheck'),
+                submission and submission.get('course_id')]):
             print("\nExtracting text for analyses...")
             pdf_text = text_processor.extract_text_from_pdf(file_path)
             print(f"Extracted text length: {len(pdf_text)}")
@@ -326,7 +433,9 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
             
             try:
                 # Run plagiarism check
-                plagiarism_results = check_plagiarism(pdf_text)
+                plagiarism_results = check_plagiarism(
+                    pdf_text, course_id=submission.get('course_id') if submission else None
+                )
                 print("\nPlagiarism check results:")
                 print(json.dumps(plagiarism_results, indent=2))
                 
@@ -347,6 +456,26 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                     'message': str(e)
                 }
 
+        # Compare with earlier submissions of the same course, then index this one
+        if submission and submission.get('course_id'):
+            print("\nSTARTING COURSE SIMILARITY CHECK")
+            print("-"*30)
+            
+            try:
+                response['course_similarity'] = submission_index.check_submission(
+                    submission.get('submission_id') or os.path.basename(file_path),
+                    submission['course_id'],
+                    pdf_text,
+                    document_name=submission.get('document_name')
+                )
+                print(f"Similar submissions found: {len(response['course_similarity']['matches'])}")
+            except Exception as e:
+                print(f"Error in course similarity check: {str(e)}")
+                response['course_similarity'] = {
+                    'status': 'error',
+                    'message': str(e)
+                }
+
         # Check if reference validation is selected
         if analyses.get('ReferencesValidation'):
             print("\nSTARTING REFERENCE VALIDATION")
@@ -371,6 +500,7 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                             "citation_count": ref.get("citation_count", 0),
                             "online_verification": {
                                 "verified": ref.get("is_verified", False),
+                                "confidence": ref.get("verification", {}).get("confidence", 0.0),
                                 "source": ref.get("verification", {}).get("source", ""),
                                 "url": ref.get("verification", {}).get("url", ""),
                                 "title": ref.get("verification", {}).get("title", "")
@@ -532,10 +662,8 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                             continue
 
                 content_analysis_logger.info("Processing diagrams...")
-                sections_dict = {section.split('\n', 1)[0]: section.split('\n', 1)[1] for section in sections}
-                figures = text_processor._find_figures_in_sections(sections_dict)
-                
-                diagram_scopes = text_processor.extract_diagrams_from_pdf_cotentanalysis(file_path)
+                # Shared with DiagramConvention: the diagrams are extracted and analysed once per document
+                diagram_scopes = text_processor.extract_diagrams(file_path).vision_scopes()
                 if diagram_scopes:
                     content_analysis["figures_included"] = True
                     content_analysis["figure_count"] = len(diagram_scopes)
@@ -549,7 +677,15 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                         section_titles.extend(diagram_scopes.keys())
                     
                     # Use the filtered similarity matrix function
-                    filtered_matrix, filtered_section_titles, relationship_analyses = similarity_analyzer.create_filtered_similarity_matrix(all_scopes)
+                    if SIMILARITY_SPARSE:
+                        # Only type-compatible pairs are scored; the COO form is returned next to the dense matrix
+                        similarity_coo, filtered_section_titles, relationship_analyses = similarity_analyzer.create_sparse_similarity_matrix(all_scopes)
+                        filtered_matrix = similarity_analyzer.coo_to_dense(similarity_coo)
+                        content_analysis["similarity_coo"] = {
+                            key: similarity_coo[key] for key in ("shape", "rows", "cols", "values")
+                        }
+                    else:
+                        filtered_matrix, filtered_section_titles, relationship_analyses = similarity_analyzer.create_filtered_similarity_matrix(all_scopes)
                     
                     content_analysis["scope_sources"] = filtered_section_titles
                     content_analysis["similarity_matrix"] = filtered_matrix
@@ -558,6 +694,17 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                     content_analysis_logger.info(f"Created filtered similarity matrix with {len(filtered_section_titles)} scopes")
                     content_analysis_logger.info(f"Generated {len(relationship_analyses)} relationship analyses")
 
+                    # Add the scopes to the course section index as soon as they are analysed
+                    if submission and submission.get('course_id'):
+                        try:
+                            indexed = index_submission_sections(
+                                submission, file_path, all_scopes, diagram_scopes,
+                                similarity_coo if SIMILARITY_SPARSE else None
+                            )
+                            content_analysis_logger.info(f"Indexed {indexed} scopes for course {submission['course_id']}")
+                        except Exception as e:
+                            content_analysis_logger.error(f"Error indexing scopes: {str(e)}")
+
                 # Process diagram relationships
                 diagram_relationships = similarity_analyzer.analyze_diagram_relationships(
                     content_analysis["similarity_matrix"], 
@@ -651,6 +798,7 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                 
                 response["content_analysis"] = {
                     "similarity_matrix": content_analysis["similarity_matrix"],
+                    "similarity_coo": content_analysis.get("similarity_coo"),
                     "scope_sources": content_analysis["scope_sources"],
                     "figures_included": content_analysis["figures_included"], 
                     "figure_count": content_analysis["figure_count"],
@@ -694,48 +842,25 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
                 }
         if analyses.get('DiagramConvention'):
             try:
-                upload_folder = app.config['UPLOAD_FOLDER']# Outside uploads
-                os.makedirs(upload_folder, exist_ok=True)
-                
-                # Extract diagrams from PDF
-                diagram_scopes = text_processor.extract_diagrams_from_pdf(file_path)
-                if diagram_scopes:
-                    if document_type == "SRS":
-                        use_case_folder = os.path.join(upload_folder, "System Functions")
-                        class_folder = os.path.join(upload_folder, "Preliminary Object-Oriented Domain Analysis")
-                        os.makedirs(use_case_folder, exist_ok=True)
-                        os.makedirs(class_folder, exist_ok=True)
-                    elif document_type == "SDD":
-                        interaction_folder = os.path.join(upload_folder, "Interaction Viewpoint")
-                        logical_folder = os.path.join(upload_folder, "Logical Viewpoint")
-                        os.makedirs(interaction_folder, exist_ok=True)
-                        os.makedirs(logical_folder, exist_ok=True)
-                    
-                    for diagram_name, diagram_data in diagram_scopes.items():
-                        if document_type == "SRS":
-                            if "use case" in diagram_name.lower():
-                                diagram_path = os.path.join(use_case_folder, f"{diagram_name}.png")
-                            
-                            else:  # Default to class diagram
-                                diagram_path = os.path.join(class_folder, f"{diagram_name}.png")
-                        elif document_type == "SDD":
-                            if "sequence" in diagram_name.lower() or "interaction" in diagram_name.lower():
-                                diagram_path = os.path.join(interaction_folder, f"{diagram_name}.png")
-                            else:  # Default to logical (e.g., class diagrams)
-                                diagram_path = os.path.join(logical_folder, f"{diagram_name}.png")
-                        with open(diagram_path, 'wb') as f:
-                            f.write(diagram_data.get('image', b''))
+                # Extract diagrams from PDF (shared with ContentAnalysis); they stay in memory,
+                # so concurrent requests never see each other's images
+                diagram_images = text_processor.extract_diagrams(file_path).convention_images(document_type)
+
+                # The annotated outputs of this request get their own folder, served
+                # under /output_results/<folder>/, so validation only reads this document's
+                request_output_dir = tempfile.mkdtemp(prefix="diagrams_", dir=OUTPUT_RESULTS_DIR)
                 
                 # Process all diagrams
                 diagram_results = process_diagrams(
-                    upload_base=upload_folder,
-                    output_base=OUTPUT_RESULTS_DIR,
+                    output_base=request_output_dir,
                     model_path=os.path.join(YOLO_PATH, "runs/detect/train/weights/best.pt"),
-                    document_type=document_type
+                    document_type=document_type,
+                    images=diagram_images,
+                    url_prefix=f"output_results/{os.path.basename(request_output_dir)}"
                 )
                 print("\nDebug: process_diagrams results:", json.dumps(diagram_results, indent=2) if isinstance(diagram_results, dict) else str(diagram_results))
                 # Validate diagram conventions using Gemini
-                validation_results = validate_diagrams(output_base=OUTPUT_RESULTS_DIR,document_type=document_type)
+                validation_results = validate_diagrams(output_base=request_output_dir, document_type=document_type)
                 
                 logger.debug("Diagram Convention Resultssssssssssss: %s", {
                 'processing_results': diagram_results,
@@ -784,86 +909,6 @@ def analyze_document(file_path: str, analyses: Dict,document_type: str) -> Dict:
             'message': str(e)
         }
 
-def extract_random_phrases(text: str, num_phrases: int = 5, min_length: int = 20) -> List[str]:
-    """Extract random phrases from the text."""
-    # Split text into sentences
-    sentences = text.split('.')
-    # Filter out short sentences
-    sentences = [s.strip() for s in sentences if len(s.strip()) >= min_length]
-    # Randomly select phrases
-    import random
-    return random.sample(sentences, min(num_phrases, len(sentences)))
-
-def search_google(query):
-    """Search Google using requests and BeautifulSoup."""
-    try:
-        print(f"\nSearching Google for phrase: '{query}'")
-        
-        # Create a search URL
-        search_url = f"https://www.google.com/search?q={query}"
-        
-        # Set headers to mimic a browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        # Make the request
-        print(f"Making request to: {search_url}")
-        response = requests.get(search_url, headers=headers, timeout=10)
-        print(f"Response status code: {response.status_code}")
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Extract search results
-        results = []
-        for result in soup.find_all('div', class_='g'):
-            try:
-                # Get the title and link
-                title_elem = result.find('h3')
-                link_elem = result.find('a')
-                
-                if title_elem and link_elem:
-                    title = title_elem.get_text()
-                    link = link_elem.get('href')
-                    
-                    # Skip Google's own links
-                    if link and not link.startswith('/search?') and not link.startswith('https://www.google.com/'):
-                        print(f"Found result: {title} - {link}")
-                        results.append({
-                            'title': title,
-                            'link': link
-                        })
-                        
-                        # Limit to top 5 results
-                        if len(results) >= 5:
-                            print("Reached maximum results limit (5)")
-                            break
-            except Exception as e:
-                print(f"Error parsing search result: {str(e)}")
-                continue
-        
-        print(f"Total results found: {len(results)}")
-        return results
-    except Exception as e:
-        print(f"Error searching Google: {str(e)}")
-        return []
-
-def calculate_similarity(text1: str, text2: str) -> float:
-    """Calculate similarity between two texts using TF-IDF and cosine similarity."""
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
-    
-    # Create TF-IDF vectors
-    vectorizer = TfidfVectorizer()
-    try:
-        tfidf_matrix = vectorizer.fit_transform([text1, text2])
-        # Calculate cosine similarity
-        similarity = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
-        return float(similarity)
-    except Exception as e:
-        print(f"Error calculating similarity: {str(e)}")
-        return 0.0
-
 @app.route('/analyze_document', methods=['POST'])
 def analyze_document_route():
     print("\n" + "="*50)
@@ -899,6 +944,15 @@ def analyze_document_route():
             print(f"Invalid or missing documentType: {document_type}")
             return jsonify({'error': 'Invalid or missing documentType: must be SRS or SDD'}), 400
 
+        # Optional course context for the course-wide similarity check
+        submission = None
+        if request.form.get('courseId'):
+            submission = {
+                'course_id': request.form.get('courseId'),
+                'submission_id': request.form.get('submissionId'),
+                'document_name': pdf_file.filename
+            }
+
         # Save the file temporarily
         filename = secure_filename(pdf_file.filename)
         unique_filename = f"{int(time.time())}_{filename}"
@@ -915,7 +969,10 @@ def analyze_document_route():
         try:
             # Start analysis
             print("\nStarting analysis...")
-            results = analyze_document(save_path, analyses,document_type)
+            # LLM calls of concurrent documents are queued fairly by the scheduler
+            with LLM_SCHEDULER.document(submission['submission_id'] if submission and submission.get('submission_id')
+                                        else unique_filename):
+                results = analyze_document(save_path, analyses,document_type, submission)
             print("\nAnalysis completed successfully")
             print(f"Final response: {json.dumps(results, indent=2)}")
             print("\n" + "="*50)
@@ -997,8 +1054,7 @@ def analyze_document_route():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/generate_recommendations', methods=['POST'])
-@limiter.limit("5 per minute")
-@handle_rate_limit(max_retries=3, initial_backoff=2)
+@handle_rate_limit(requests_per_minute=5, burst=5)
 def generate_recommendations():
     try:
         data = request.json
@@ -1077,29 +1133,17 @@ def generate_recommendations():
         Use markdown bullet points (*) for each recommendation.
         """
 
-        def call_openai_with_retry(prompt, max_attempts=3):
-            for attempt in range(max_attempts):
-                try:
-                    response = openai.ChatCompletion.create(
-                        model="gpt-4",
-                        messages=[
-                            {"role": "system", "content": "You are an expert SRS document analyzer. Provide clear, actionable recommendations."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        temperature=0.7,
-                        max_tokens=1000
-                    )
-                    return response.choices[0].message.content
-                except Exception as e:
-                    if "rate_limit" in str(e).lower():
-                        if attempt < max_attempts - 1:
-                            wait_time = 2 ** attempt
-                            logger.warning(f"OpenAI API rate limit hit. Waiting {wait_time} seconds...")
-                            time.sleep(wait_time)
-                            continue
-                    raise e
-
-        recommendations = call_openai_with_retry(prompt)
+        # Rate limits and transient errors are retried by the LLM client layer
+        recommendations = LLM_GATEWAY.chat(
+            "recommendations",
+            messages=[
+                {"role": "system", "content": "You are an expert SRS document analyzer. Provide clear, actionable recommendations."},
+                {"role": "user", "content": prompt}
+            ],
+            model="gpt-4",
+            temperature=0.7,
+            max_tokens=1000
+        )
 
         return jsonify({
             'status': 'success',
@@ -1107,139 +1151,115 @@ def generate_recommendations():
         })
 
     except Exception as e:
+        if is_upstream_limit(e):
+            raise  # handle_rate_limit answers with 429 and Retry-After
         logger.error(f"Error generating recommendations: {str(e)}")
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
     
+@app.route('/llm_cache_stats', methods=['GET'])
+def llm_cache_stats():
+    """Report LLM response cache hit ratios per call site."""
+    try:
+        return jsonify({
+            'status': 'success',
+            'llm_cache': LLM_GATEWAY.stats(),
+            'diagram_cache': DIAGRAM_CACHE.stats(),
+            'image_encoding': IMAGE_ENCODER.stats(),
+            'diagram_extraction': DIAGRAM_EXTRACTION.stats()
+        })
+    except Exception as e:
+        logger.error(f"Error reading LLM cache statistics: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/section_index/search', methods=['POST'])
+def section_index_search():
+    """
+    Top-k sections of a course most similar to a section of a submission or to a text.
+
+    JSON body: courseId, k, optional kind ("section" or "diagram") and sectionType,
+    and either submissionId with sectionTitle or query.
+    """
+    try:
+        if not section_index.available:
+            return jsonify({'status': 'error', 'message': 'Section index unavailable'}), 503
+        data = request.get_json() or {}
+        course_id = data.get('courseId')
+        if not course_id:
+            return jsonify({'status': 'error', 'message': 'courseId is required'}), 400
+        submission_id = data.get('submissionId')
+        if submission_id and data.get('sectionTitle'):
+            vector = section_index.section_vector(course_id, submission_id, data['sectionTitle'])
+            if vector is None:
+                return jsonify({'status': 'error', 'message': 'Section not found in the course index'}), 404
+        elif data.get('query'):
+            vector = similarity_analyzer.embed_scopes([data['query']])[0]
+        else:
+            return jsonify({'status': 'error', 'message': 'submissionId and sectionTitle, or query, are required'}), 400
+        start = time.perf_counter()
+        results = section_index.search(
+            course_id, vector, k=int(data.get('k', 10)), kind=data.get('kind'),
+            section_type=data.get('sectionType'), exclude_submission=submission_id
+        )
+        return jsonify({
+            'status': 'success',
+            'results': results,
+            'query_ms': round(1000 * (time.perf_counter() - start), 2)
+        })
+    except Exception as e:
+        logger.error(f"Error searching the section index: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/section_index/similar_submissions', methods=['GET'])
+def section_index_similar_submissions():
+    """Submissions of a course that describe the most similar system to a given submission."""
+    try:
+        if not section_index.available:
+            return jsonify({'status': 'error', 'message': 'Section index unavailable'}), 503
+        course_id = request.args.get('courseId')
+        submission_id = request.args.get('submissionId')
+        if not course_id or not submission_id:
+            return jsonify({'status': 'error', 'message': 'courseId and submissionId are required'}), 400
+        return jsonify({
+            'status': 'success',
+            'results': section_index.similar_submissions(course_id, submission_id, k=int(request.args.get('k', 5)))
+        })
+    except Exception as e:
+        logger.error(f"Error finding similar submissions: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
 @app.errorhandler(429)
 def ratelimit_handler(e):
-    return jsonify({
+    response = jsonify({
         'status': 'error',
         'message': 'Rate limit exceeded. Please try again later.',
         'retry_after': e.description
-    }), 429
-
-def check_plagiarism(text):
-    """Check for plagiarism in the given text."""
-    try:
-        print("\n=== Starting Plagiarism Check ===")
-        
-        # Extract random phrases
-        phrases = extract_random_phrases(text)
-        print(f"\nExtracted {len(phrases)} random phrases to check:")
-        for i, phrase in enumerate(phrases, 1):
-            print(f"{i}. {phrase}")
-        
-        matches = []
-        search_results = []
-        
-        for phrase in phrases:
-            print(f"\n=== Checking phrase: '{phrase}' ===")
-            
-            # Create search URL
-            search_url = f"https://www.google.com/search?q={requests.utils.quote(phrase)}"
-            print(f"Search URL: {search_url}")
-            
-            # Search Google for the phrase
-            results = search_google(phrase)
-            
-            if not results:
-                print("No search results found for this phrase")
-                continue
-                
-            for result in results:
-                try:
-                    print(f"\nAnalyzing result: {result['title']}")
-                    print(f"URL: {result['link']}")
-                    
-                    # Get the content from the URL
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                    }
-                    print("Fetching page content...")
-                    response = requests.get(result["link"], headers=headers, timeout=10)
-                    print(f"Response status code: {response.status_code}")
-                    
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # Remove unwanted elements
-                    for element in soup(['script', 'style', 'header', 'footer', 'nav', 'iframe']):
-                        element.decompose()
-                    
-                    # Get the main content
-                    content = soup.get_text()
-                    content = ' '.join(content.split())  # Clean up whitespace
-                    
-                    if not content:
-                        print("No content found on the page")
-                        continue
-                        
-                    print("Calculating similarity...")
-                    # Calculate similarity
-                    similarity = calculate_similarity(phrase, content)
-                    print(f"Similarity score: {similarity:.2%}")
-                    
-                    # Add to search results regardless of similarity
-                    search_result = {
-                        "query": phrase,
-                        "search_url": search_url,
-                        "url": result["link"],
-                        "title": result["title"],
-                        "similarity": float(similarity),
-                        "matched_content": content[:500] + "..."  # First 500 chars
-                    }
-                    search_results.append(search_result)
-                    
-                    if similarity > 0.3:  # 30% similarity threshold
-                        print("Match found! Adding to results")
-                        match_data = {
-                            "phrase": phrase,
-                            "similarity": float(similarity),
-                            "url": result["link"],
-                            "title": result["title"],
-                            "matched_content": content[:500] + "..."  # First 500 chars
-                        }
-                        print(f"Match data: {json.dumps(match_data, indent=2)}")
-                        matches.append(match_data)
-                    else:
-                        print("Similarity below threshold (30%)")
-                        
-                except Exception as e:
-                    print(f"Error processing result: {str(e)}")
-                    continue
-                
-            # Add a delay to avoid rate limiting
-            print("Waiting 2 seconds before next search...")
-            time.sleep(2)
-        
-        print("\n=== Plagiarism Check Complete ===")
-        print(f"Total phrases checked: {len(phrases)}")
-        print(f"Similar matches found: {len(matches)}")
-        
-        result_data = {
-            "status": "success",
-            "total_phrases_checked": len(phrases),
-            "similar_matches_found": len(matches),
-            "phrases_checked": phrases,
-            "search_results": search_results,
-            "results": matches
-        }
-        
-        print(f"Returning data: {json.dumps(result_data, indent=2)}")
-        return result_data
-        
-    except Exception as e:
-        print(f"Error in plagiarism check: {str(e)}")
-        return {
-            "status": "error",
-            "message": str(e)
-        }
+    })
+    # Only the 429s of the default limits carry the window reset; the route limits
+    # of handle_rate_limit set their own Retry-After
+    # (flask-limiter 2.0 records the exceeded limit and its keys on flask.g)
+    current_limit = getattr(g, f"{LIMITER_KEY_PREFIX}_view_rate_limit", None)
+    if current_limit:
+        try:
+            reset_at, _ = limiter.limiter.get_window_stats(*current_limit)
+            response.headers['Retry-After'] = str(max(1, math.ceil(reset_at - time.time())))
+        except Exception as window_error:
+            logger.warning(f"Could not read the rate limit window: {str(window_error)}")
+    return response, 429
 
 @app.route('/check_plagiarism', methods=['POST'])
-@limiter.limit("5 per minute")
-@handle_rate_limit(max_retries=3, initial_backoff=2)
+@handle_rate_limit(requests_per_minute=5, burst=5)
 def check_plagiarism_route():
     try:
         if 'pdfFile' not in request.files:
@@ -1260,7 +1280,7 @@ def check_plagiarism_route():
             pdf_text = text_processor.extract_text_from_pdf(pdf_path)
             
             # Check plagiarism
-            result = check_plagiarism(pdf_text)
+            result = check_plagiarism(pdf_text, course_id=request.form.get('courseId'))
             
             return jsonify(result)
             
@@ -1272,6 +1292,8 @@ def check_plagiarism_route():
                 logger.warning(f"Could not remove temporary file {pdf_path}: {str(e)}")
 
     except Exception as e:
+        if is_upstream_limit(e):
+            raise  # handle_rate_limit answers with 429 and Retry-After
         logger.error(f"Error during plagiarism check: {str(e)}")
         return jsonify({
             'error': str(e),
@@ -1,6 +1,6 @@
 import json
-import google.generativeai as genai
 import logging
+from llm_gateway import LLM_GATEWAY
 
 logger = logging.getLogger(__name__)
 
@@ -110,11 +110,9 @@ class BusinessValueEvaluator:
 
         try:
             # Send the prompt to the LLM
-            model = genai.GenerativeModel("gemini-2.0-flash") 
-            response = model.generate_content(prompt)
-
-            # Extract and print LLM response
-            evaluation_result = response.text
+            evaluation_result = LLM_GATEWAY.generate(
+                "business_value.evaluation", prompt, model="gemini-2.0-flash"
+            )
             logger.info("Business value evaluation completed successfully")
             return {
                 "status": "success",
@@ -0,0 +1,272 @@
+import re
+import string
+import logging
+from bisect import bisect_right
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Figure types that are extracted and analysed, in order of precedence
+IMPORTANT_FIGURES = [
+    "system overview",
+    "system context",
+    "use case",
+    "eerd",
+    "entity relationship",
+    "class diagram",
+    "gantt chart"
+]
+
+# Display names of the figure types
+FIGURE_DISPLAY_NAMES = {
+    "system overview": "System Overview",
+    "system context": "System Context Diagram",
+    "use case": "Use Case Diagram",
+    "eerd": "EERD",
+    "entity relationship": "Entity Relationship Diagram",
+    "class diagram": "Class Diagram",
+    "gantt chart": "Gantt Chart"
+}
+
+# Figure terms recorded wherever they appear as whole words, under these names
+FIGURE_TERMS = {
+    "eerd": "EERD",
+    "entity relationship": "Entity Relationship",
+    "use case": "Use Case",
+    "class diagram": "Class Diagram",
+    "gantt chart": "Gantt Chart",
+    "system overview": "System Overview",
+    "system context": "System Context",
+}
+
+# Caption patterns; every one of them starts with "fig" (in any case), so they are
+# only tried where the automaton found that anchor
+CAPTION_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'Figure\s+\d+[\.:]?\s*([^\.]+)',  # Figure 1: Title
+    r'Fig\.\s*\d+[\.:]?\s*([^\.]+)',    # Fig. 1: Title
+    r'Figure\s+\d+[^a-zA-Z0-9]*([a-zA-Z].+?)\s*(?:\n|$)',  # Figure 1 Title
+    r'(?:FIGURE|Fig)[^a-zA-Z0-9]*\d+[^a-zA-Z0-9]*([a-zA-Z].+?)\s*(?:\n|$)',  # FIGURE 1 Title
+)]
+CAPTION_ANCHOR = "fig"
+# A text block of the page layout is a caption when it starts like one
+CAPTION_BLOCK_PATTERN = re.compile(r'^\s*(?:figure|fig\.?)\s*\d+', re.IGNORECASE)
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# Lower-cases letters one character for one, like the IGNORECASE caption patterns
+# match them (str.lower turns "İ" into two characters and would shift the offsets)
+CASE_FOLD = str.maketrans(dict(zip(string.ascii_uppercase, string.ascii_lowercase),
+                               **{"\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k"}))
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton finding every occurrence of a set of strings in one pass.
+
+    Matching is exact; callers lower-case or normalize the patterns and the text
+    alike.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern))
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append(index)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+        # Fold the failure links into full transition tables (breadth-first, so the
+        # table of a state's failure target is always complete first)
+        self._delta = [None] * len(self._goto)
+        self._delta[0] = dict(self._goto[0])
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self._delta[state] = dict(self._delta[self._fail[state]], **self._goto[state])
+            queue.extend(self._goto[state].values())
+
+    def finditer(self, text):
+        """Yield (start, end, pattern) for every occurrence, overlapping ones included."""
+        delta, out, patterns = self._delta, self._out, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            state = delta[state].get(char, 0)
+            if out[state]:
+                for index in out[state]:
+                    pattern = patterns[index]
+                    yield position + 1 - len(pattern), position + 1, pattern
+
+    def first_in(self, text, priority):
+        """The pattern found in text that comes first in priority, or None."""
+        found = {pattern for _, _, pattern in self.finditer(text)}
+        return next((pattern for pattern in priority if pattern in found), None)
+
+
+def normalize(text):
+    """
+    Lower-case text with whitespace runs collapsed to one space.
+
+    Only the letters of the patterns are lower-cased (see CASE_FOLD), so the
+    normalized text has one character per character of the collapsed text.
+
+    Returns:
+        (normalized text, function mapping a normalized position to the original one)
+    """
+    positions, shifts, removed = [], [], 0
+    for match in WHITESPACE_PATTERN.finditer(text):
+        if match.end() - match.start() > 1:
+            removed += match.end() - match.start() - 1
+            positions.append(match.start() + 1 - (removed - (match.end() - match.start() - 1)))
+            shifts.append(removed)
+
+    def original(position):
+        index = bisect_right(positions, position)
+        return position + (shifts[index - 1] if index else 0)
+
+    return WHITESPACE_PATTERN.sub(" ", text).translate(CASE_FOLD), original
+
+
+def _is_word(char):
+    return char.isalnum() or char == "_"
+
+
+_TERM_AUTOMATON = AhoCorasick(list(FIGURE_TERMS) + [CAPTION_ANCHOR])
+_IMPORTANT_AUTOMATON = AhoCorasick(IMPORTANT_FIGURES)
+_important_terms = {}
+
+
+def important_term(name):
+    """The first IMPORTANT_FIGURES term contained in a figure name (memoized), or None."""
+    term = _important_terms.get(name)
+    if term is None and name not in _important_terms:
+        term = _IMPORTANT_AUTOMATON.first_in(name.lower(), IMPORTANT_FIGURES)
+        _important_terms[name] = term
+    return term
+
+
+def figure_display_name(name):
+    """Display name of the figure type of a figure name, or None."""
+    term = _IMPORTANT_AUTOMATON.first_in(name.lower(), FIGURE_DISPLAY_NAMES)
+    return FIGURE_DISPLAY_NAMES.get(term)
+
+
+def is_caption_block(text):
+    """True when a text block of the page layout is a figure caption."""
+    return bool(CAPTION_BLOCK_PATTERN.match(text))
+
+
+class FigureCaptionIndex:
+    """
+    Figure captions and figure terms of a document, located in one pass per section.
+
+    Each section is scanned once by an Aho-Corasick automaton holding the figure
+    terms and the "fig" anchor that every caption pattern starts with; the compiled
+    caption patterns are then only tried at those anchors. The result maps every
+    caption and term to the sections and offsets it was found at, and `figures`
+    holds the same summary as before ({name: {"sections", "mentions"}}).
+    """
+
+    def __init__(self):
+        self.figures = {}
+        self.locations = defaultdict(list)
+
+    @classmethod
+    def from_sections(cls, sections_dict, strip_numbering=None):
+        """Index a {section title: content} dictionary."""
+        index = cls()
+        for section_title, content in sections_dict.items():
+            index.add_section(section_title, content, strip_numbering)
+        return index
+
+    def _add(self, name, section_title, offset, **flags):
+        figure = self.figures.get(name)
+        if figure is None:
+            self.figures[name] = dict({'sections': [section_title], 'mentions': 1}, **flags)
+        else:
+            figure['mentions'] += 1
+            if section_title not in figure['sections']:
+                figure['sections'].append(section_title)
+        if offset is not None:
+            self.locations[name].append({"section": section_title, "offset": offset})
+
+    def add_section(self, section_title, content, strip_numbering=None):
+        """Record the captions and terms of one section."""
+        # The section itself is a diagram section when its title names a figure type
+        if important_term(section_title):
+            clean_title = strip_numbering(section_title) if strip_numbering else section_title
+            if clean_title not in self.figures:
+                self.figures[clean_title] = {'sections': [section_title], 'mentions': 1, 'is_section_title': True}
+
+        normalized, original = normalize(content)
+        anchors = []
+        terms = {}
+        for start, end, pattern in _TERM_AUTOMATON.finditer(normalized):
+            if pattern == CAPTION_ANCHOR:
+                anchors.append(original(start))
+            elif ((start == 0 or not _is_word(normalized[start - 1])) and
+                  (end == len(normalized) or not _is_word(normalized[end]))):
+                terms.setdefault(pattern, original(start))
+
+        # Non-overlapping matches of each caption pattern, as finditer would find them
+        for pattern in CAPTION_PATTERNS:
+            last_end = 0
+            for anchor in anchors:
+                if anchor < last_end:
+                    continue
+                match = pattern.match(content, anchor)
+                if match:
+                    self._add(match.group(1).strip(), section_title, match.start())
+                    last_end = match.end()
+
+        # Terms count once per section
+        for term, name in FIGURE_TERMS.items():
+            if term in terms:
+                self._add(name, section_title, terms[term])
+
+    def sections_of(self, name):
+        """Sections a caption or term was found in."""
+        figure = self.figures.get(name)
+        return figure['sections'] if figure else []
+
+
+if __name__ == "__main__":
+    import time
+
+    sections = {
+        f"{n}.1 Section {n}": ("Some requirement text. " * 40 +
+                               f"Figure {n}: Use case diagram of module {n}\n" +
+                               "The class diagram and the system   context are shown. " * 5)
+        for n in range(200)
+    }
+    start = time.perf_counter()
+    index = FigureCaptionIndex.from_sections(sections)
+    print(f"Indexed {len(sections)} sections in {1000 * (time.perf_counter() - start):.1f} ms; "
+          f"{len(index.figures)} figures")
+    print({name: index.figures[name]['mentions'] for name in list(index.figures)[:3]},
+          index.figures["System Context"]['mentions'])
+
+    # Characters that str.lower lengthens must not shift the caption offsets
+    for content in ("\u0130 Figure 3 - Login page\n", "\u0130\u0130\u0130 see FIGURE 4: Use case diagram\n",
+                    "Fi\u0307gure 5: Use case diagram\nFIGURE 6 - Class diagram\n"):
+        expected = {match.group(1).strip() for pattern in CAPTION_PATTERNS for match in pattern.finditer(content)}
+        found = set(FigureCaptionIndex.from_sections({"1 Section": content}).figures) - set(FIGURE_TERMS.values())
+        assert found == expected, (content, found, expected)
+    print("Caption offsets survive case folding")
@@ -0,0 +1,170 @@
+import re
+import time
+import random
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Matches every bracket citation group in one scan: [3], [1, 4, 7], [2-5], [2–5, 9]
+CITATION_GROUP_PATTERN = re.compile(r'\[(\d+(?:\s*[-–,]\s*\d+)*)\]')
+RANGE_SEPARATOR_PATTERN = re.compile(r'\s*[-–]\s*')
+REFERENCES_HEADER_PATTERN = re.compile(r'(?:References|Bibliography|Works Cited)', re.IGNORECASE)
+REFERENCE_ENTRY_PATTERN = re.compile(r'\[\d+\]')
+
+# Characters of context kept on each side of a citation
+CONTEXT_WINDOW = 100
+# Ranges wider than this are treated as noise (e.g. "[1-2019]") and only their endpoints are indexed
+MAX_RANGE_SPAN = 100
+
+
+class CitationIndex:
+    """
+    Single-pass index of the bracket citations in a document.
+
+    The text is scanned once; every citation group is expanded into the reference
+    numbers it covers, so looking up the citations of a reference is a dictionary hit
+    instead of a fresh regex scan over the whole document.
+    """
+
+    def __init__(self, text):
+        self.text = text or ""
+        self._positions = defaultdict(list)  # reference number -> [(start, end), ...]
+        self._citations = {}  # reference number -> formatted citations (built lazily)
+        self._build()
+
+    def _build(self):
+        group_count = 0
+        for match in CITATION_GROUP_PATTERN.finditer(self.text):
+            group_count += 1
+            span = (match.start(), match.end())
+            for ref_number in self.expand_group(match.group(1)):
+                self._positions[ref_number].append(span)
+        logger.info(f"Indexed {group_count} citation groups covering {len(self._positions)} references")
+
+    @staticmethod
+    def expand_group(group):
+        """
+        Expand the inside of a citation group into reference numbers.
+
+        Args:
+            group: Text between the brackets, e.g. "1, 3-5"
+
+        Returns:
+            Ordered list of unique reference numbers, e.g. [1, 3, 4, 5]
+        """
+        numbers = []
+        for part in group.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            bounds = RANGE_SEPARATOR_PATTERN.split(part)
+            if len(bounds) == 2 and bounds[0].isdigit() and bounds[1].isdigit():
+                start, end = int(bounds[0]), int(bounds[1])
+                if start <= end and end - start <= MAX_RANGE_SPAN:
+                    numbers.extend(range(start, end + 1))
+                else:
+                    numbers.extend([start, end])
+            elif part.isdigit():
+                numbers.append(int(part))
+        return list(dict.fromkeys(numbers))
+
+    @staticmethod
+    def _normalize_ref_number(ref_number):
+        try:
+            return int(str(ref_number).strip())
+        except ValueError:
+            return None
+
+    def cited_references(self):
+        """Return the sorted reference numbers that are cited at least once."""
+        return sorted(self._positions)
+
+    def find_citations(self, ref_number):
+        """
+        Return the citations of a reference.
+
+        Args:
+            ref_number: Reference number as an int or a string (e.g. "12")
+
+        Returns:
+            List of {"context": str, "position": int} dictionaries, one per citation
+            group that covers the reference, in document order
+        """
+        key = self._normalize_ref_number(ref_number)
+        if key is None:
+            return []
+        if key in self._citations:
+            return self._citations[key]
+
+        citations = []
+        for start, end in self._positions.get(key, []):
+            context = self.text[max(0, start - CONTEXT_WINDOW):min(len(self.text), end + CONTEXT_WINDOW)]
+
+            # Skip the entries of the References section itself
+            if REFERENCES_HEADER_PATTERN.search(context) and REFERENCE_ENTRY_PATTERN.match(context):
+                continue
+
+            marker = self.text[start:end]
+            citations.append({
+                "context": context.replace(marker, f"**{marker}**"),
+                "position": start
+            })
+
+        self._citations[key] = citations
+        return citations
+
+
+def _legacy_find_citations(text, ref_number):
+    """Per-reference scan used before the index existed (kept for benchmarking only)."""
+    patterns = [
+        rf'\[{ref_number}\]',
+        rf'\[(?:\d+,\s*)*{ref_number}(?:,\s*\d+)*\]',
+        rf'\[\d+-{ref_number}\]',
+        rf'\[{ref_number}-\d+\]'
+    ]
+    positions = set()
+    for pattern in patterns:
+        for match in re.finditer(pattern, text):
+            positions.add(match.start())
+    return positions
+
+
+def benchmark(reference_count=200, paragraph_count=1500, seed=7):
+    """Compare per-reference scanning with the single-pass index on a synthetic thesis."""
+    rng = random.Random(seed)
+    filler = ("The proposed system stores submissions and evaluates them against the "
+              "course rubric while keeping the response time within acceptable limits ")
+    paragraphs = []
+    for _ in range(paragraph_count):
+        first = rng.randint(1, reference_count)
+        style = rng.random()
+        if style < 0.6:
+            citation = f"[{first}]"
+        elif style < 0.8:
+            citation = f"[{first}, {rng.randint(1, reference_count)}, {rng.randint(1, reference_count)}]"
+        else:
+            citation = f"[{first}-{min(reference_count, first + rng.randint(1, 4))}]"
+        paragraphs.append(f"{filler}{citation}. {filler}")
+    references = "\n".join(f"[{n}] A. Author, \"Title {n},\" Journal, 2020." for n in range(1, reference_count + 1))
+    text = "\n".join(paragraphs) + "\nReferences\n" + references
+
+    start = time.perf_counter()
+    for ref_number in range(1, reference_count + 1):
+        _legacy_find_citations(text, ref_number)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = CitationIndex(text)
+    for ref_number in range(1, reference_count + 1):
+        index.find_citations(ref_number)
+    index_seconds = time.perf_counter() - start
+
+    print(f"Document: {len(text)} characters, {reference_count} references")
+    print(f"Per-reference scan: {legacy_seconds * 1000:.1f} ms")
+    print(f"Citation index:     {index_seconds * 1000:.1f} ms")
+    print(f"Speed-up:           {legacy_seconds / index_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
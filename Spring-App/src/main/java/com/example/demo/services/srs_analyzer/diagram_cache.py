@@ -0,0 +1,239 @@
+import io
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import defaultdict
+import numpy as np
+from PIL import Image
+from llm_gateway import LLM_CACHE_ENABLED, LLM_CACHE_TTL, cache_key
+
+logger = logging.getLogger(__name__)
+
+DIAGRAM_CACHE_PATH = os.getenv(
+    "DIAGRAM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "diagram_analyses.sqlite3")
+)
+# Largest pHash Hamming distance (of 64 bits) at which two diagrams count as the same;
+# the dHash distance may be up to twice this. 0 only matches visually identical images.
+DIAGRAM_HASH_THRESHOLD = int(os.getenv("DIAGRAM_HASH_THRESHOLD", "4"))
+# Diagrams whose aspect ratios differ by more than this share never match
+MAX_ASPECT_DIFFERENCE = 0.1
+
+# pHash: 32 x 32 grayscale image, low-frequency 8 x 8 block of its DCT
+PHASH_IMAGE_SIZE = 32
+PHASH_SIZE = 8
+_DCT = np.array([
+    [np.cos(np.pi * (2 * x + 1) * u / (2 * PHASH_IMAGE_SIZE)) for x in range(PHASH_IMAGE_SIZE)]
+    for u in range(PHASH_IMAGE_SIZE)
+])
+_BIT_WEIGHTS = np.uint64(1) << np.arange(63, -1, -1, dtype=np.uint64)
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _pack_bits(bits):
+    return int(np.bitwise_or.reduce(_BIT_WEIGHTS[bits.ravel()]))
+
+
+def _grayscale(image, size):
+    # Transparent diagrams are flattened on white, as they are rendered in the document
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return np.asarray(image.convert("L").resize(size, Image.LANCZOS), dtype=np.float64)
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a PIL image."""
+    pixels = _grayscale(image, (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE))
+    low = (_DCT @ pixels @ _DCT.T)[:PHASH_SIZE, :PHASH_SIZE]
+    # The DC term is the mean brightness and is left out of the median
+    median = np.median(low.ravel()[1:])
+    return _pack_bits(low > median)
+
+
+def dhash(image):
+    """64-bit difference hash (horizontal gradients) of a PIL image."""
+    pixels = _grayscale(image, (PHASH_SIZE + 1, PHASH_SIZE))
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming_distances(value, values):
+    """Hamming distances between a 64-bit hash and an array of them."""
+    differences = (np.asarray(values, dtype=np.uint64) ^ np.uint64(value)).view(np.uint8)
+    return _POPCOUNT[differences].reshape(-1, 8).sum(axis=1)
+
+
+def image_hashes(image_bytes):
+    """
+    Perceptual hashes of an encoded image.
+
+    Returns:
+        (pHash, dHash, aspect ratio)
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.load()
+        return phash(image), dhash(image), image.width / max(1, image.height)
+
+
+def _signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class DiagramAnalysisCache:
+    """
+    Vision-model analyses of diagrams, keyed by perceptual hash.
+
+    Students reuse the figures of the course template and resubmissions re-send the
+    same diagrams, usually re-exported at another resolution or compression, so an
+    exact content hash rarely matches. Each analysed image is stored with its pHash,
+    dHash and aspect ratio under the prompt it was analysed with; a later image reuses
+    the analysis when both hashes are within the Hamming threshold and the shapes
+    agree. Lookups scan the hashes of one prompt in memory.
+    """
+
+    def __init__(self, path=DIAGRAM_CACHE_PATH, threshold=DIAGRAM_HASH_THRESHOLD, ttl=LLM_CACHE_TTL):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = defaultdict(int)
+        self._available = True
+        try:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS diagram_analyses ("
+                "id INTEGER PRIMARY KEY, prompt_key TEXT NOT NULL, phash INTEGER NOT NULL, "
+                "dhash INTEGER NOT NULL, aspect REAL NOT NULL, analysis TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS diagram_analyses_prompt ON diagram_analyses(prompt_key)")
+            self._conn.execute("DELETE FROM diagram_analyses WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Diagram analysis cache unavailable: {str(e)}")
+            self._available = False
+
+    def _load(self, prompt_key):
+        entries = self._entries.get(prompt_key)
+        if entries is None:
+            rows = self._conn.execute(
+                "SELECT id, phash, dhash, aspect FROM diagram_analyses WHERE prompt_key = ? AND expires_at > ?",
+                (prompt_key, time.time())
+            ).fetchall()
+            entries = {
+                "ids": np.array([row[0] for row in rows], dtype=np.int64),
+                "phash": np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64),
+                "dhash": np.array([row[2] for row in rows], dtype=np.int64).view(np.uint64),
+                "aspect": np.array([row[3] for row in rows], dtype=np.float64),
+            }
+            self._entries[prompt_key] = entries
+        return entries
+
+    def lookup(self, prompt_key, hashes):
+        """
+        Stored analysis of the closest matching diagram, or None.
+
+        Args:
+            prompt_key: Key of the prompt and model the analysis was made with
+            hashes: (pHash, dHash, aspect ratio) from image_hashes()
+        """
+        if not self._available:
+            return None
+        image_phash, image_dhash, aspect = hashes
+        with self._lock:
+            entries = self._load(prompt_key)
+            if not len(entries["ids"]):
+                return None
+            phash_distances = hamming_distances(image_phash, entries["phash"])
+            matches = (
+                (phash_distances <= self.threshold) &
+                (hamming_distances(image_dhash, entries["dhash"]) <= 2 * self.threshold) &
+                (np.abs(entries["aspect"] / aspect - 1) <= MAX_ASPECT_DIFFERENCE)
+            )
+            if not matches.any():
+                return None
+            best = np.flatnonzero(matches)[np.argmin(phash_distances[matches])]
+            row = self._conn.execute(
+                "SELECT analysis FROM diagram_analyses WHERE id = ? AND expires_at > ?",
+                (int(entries["ids"][best]), time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def store(self, prompt_key, hashes, analysis):
+        """Store the analysis of a diagram."""
+        if not self._available:
+            return
+        image_phash, image_dhash, aspect = hashes
+        now = time.time()
+        with self._lock:
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO diagram_analyses (prompt_key, phash, dhash, aspect, analysis, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (prompt_key, _signed(image_phash), _signed(image_dhash), aspect, analysis, now, now + self.ttl)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing diagram analysis cache: {str(e)}")
+                return
+            entries = self._load(prompt_key)
+            entries["ids"] = np.append(entries["ids"], cursor.lastrowid)
+            entries["phash"] = np.append(entries["phash"], np.uint64(image_phash))
+            entries["dhash"] = np.append(entries["dhash"], np.uint64(image_dhash))
+            entries["aspect"] = np.append(entries["aspect"], aspect)
+
+    def analyze(self, image_bytes, prompt, model, analyze):
+        """
+        Analysis of a diagram, reused from a near-identical diagram when there is one.
+
+        Args:
+            image_bytes: Encoded image
+            prompt: Prompt the image is analysed with
+            model: Vision model name
+            analyze: Function without arguments calling the vision model
+
+        Returns:
+            The analysis text
+        """
+        if not LLM_CACHE_ENABLED:
+            return analyze()
+        prompt_key = cache_key("openai", model, prompt, None)
+        try:
+            hashes = image_hashes(image_bytes)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot hash diagram image ({str(e)}); analysing without the cache")
+            return analyze()
+        cached = self.lookup(prompt_key, hashes)
+        if cached is not None:
+            self._count("hits")
+            logger.info("Reusing the analysis of a near-identical diagram")
+            return cached
+        self._count("misses")
+        analysis = analyze()
+        if analysis:
+            self.store(prompt_key, hashes, analysis)
+        return analysis
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self):
+        """Hits, misses and hit ratio since start-up."""
+        with self._lock:
+            hits, misses = self._stats["hits"], self._stats["misses"]
+        lookups = hits + misses
+        return {"hits": hits, "misses": misses, "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+                "threshold": self.threshold}
+
+
+# Shared so every diagram analysis of the process uses the same cache
+DIAGRAM_CACHE = DiagramAnalysisCache()
@@ -0,0 +1,316 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import PyPDF2
+from caption_index import IMPORTANT_FIGURES, important_term, figure_display_name
+from diagram_cache import DIAGRAM_CACHE
+from image_encoding import IMAGE_ENCODER
+from llm_gateway import LLM_GATEWAY
+
+logger = logging.getLogger(__name__)
+
+# Documents whose extracted diagrams (images included) are kept in memory
+DIAGRAM_EXTRACTION_CACHE_SIZE = int(os.getenv("DIAGRAM_EXTRACTION_CACHE_SIZE", "8"))
+# Images kept per figure
+MAX_IMAGES_PER_FIGURE = 2
+
+DIAGRAM_SCOPE_PROMPT = """Analyze this diagram and create a system scope that includes:
+1. Main system components and their roles
+2. Key relationships between components
+3. System boundaries and interfaces
+4. Critical interactions
+
+Format the scope as:
+System: [Main system name/description]
+Components: [List of main components and their roles]
+Relationships: [List of key relationships]
+Boundaries: [System boundaries and interfaces]"""
+
+SECTION_HEADER_PATTERN = re.compile(r'^\d+(\.\d+)*\s+[A-Z]')
+
+
+def pdf_sections(pdf_path):
+    """Split the text of a PDF into {numbered section header: content}."""
+    sections_dict = {}
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page in pdf_reader.pages:
+            text = page.extract_text()
+            if text.strip():
+                current_section = None
+                current_content = []
+                for line in text.splitlines():
+                    if SECTION_HEADER_PATTERN.match(line):
+                        if current_section and current_content:
+                            sections_dict[current_section] = '\n'.join(current_content)
+                        current_section = line.strip()
+                        current_content = []
+                    elif current_section:
+                        current_content.append(line)
+                if current_section and current_content:
+                    sections_dict[current_section] = '\n'.join(current_content)
+    return sections_dict
+
+
+def classify_diagram(name, document_type="SRS"):
+    """Diagram convention kind ("use_case", "class" or "sequence") of a diagram name."""
+    name = name.lower()
+    if document_type == "SRS":
+        return "use_case" if "use case" in name else "class"  # Default to class diagram
+    # Default to logical (e.g., class diagrams)
+    return "sequence" if "sequence" in name or "interaction" in name else "class"
+
+
+class ExtractedDiagrams:
+    """
+    The diagrams of one document, and what the analyses derive from them.
+
+    `diagrams` maps a unique display name to {"figure", "image", "section", "sections",
+    "pages", "occurrences"}, one entry per distinct image; "section" is the first of the
+    sections the image appears in and "occurrences" lists its every placement. The
+    vision scopes (ContentAnalysis) and the OCR figure texts are computed on first use
+    and then reused by every analysis of the document; only successful results are
+    kept, so a diagram whose analysis failed is retried by the next call. Each kind of result has its own lock, so a slow vision analysis does not
+    hold up the OCR texts.
+    """
+
+    def __init__(self, figures, figure_images):
+        self.figures = figures
+        self.diagrams = OrderedDict()
+        self._vision_lock = threading.Lock()
+        self._text_lock = threading.Lock()
+        self._vision_scopes = {}  # display name -> scope
+        self._image_texts = {}  # display name -> OCR text
+        self._figure_texts = {}  # figure name -> scope, or None when its images hold no text
+
+        seen = set()
+        for figure_name, images in figure_images.items():
+            for image in images:
+                if id(image) in seen:
+                    continue
+                seen.add(id(image))
+                # Get a cleaner display name for this figure type
+                display_name = figure_display_name(figure_name) or f"Diagram_{len(self.diagrams) + 1}"
+                if display_name in self.diagrams:
+                    display_name = f"{display_name} {len(self.diagrams) + 1}"
+                self.diagrams[display_name] = {
+                    "figure": figure_name, "image": image, "section": image.section,
+                    "sections": image.sections, "pages": image.pages, "occurrences": image.occurrences
+                }
+
+    def convention_images(self, document_type="SRS"):
+        """In-memory images for DiagramConvention.process_diagrams, by diagram kind."""
+        images = {"use_case": [], "class": [], "sequence": []}
+        for display_name, diagram in self.diagrams.items():
+            images[classify_diagram(display_name, document_type)].append((f"{display_name}.png", diagram["image"]))
+        return images
+
+    def vision_scopes(self):
+        """{display name: system scope} of every diagram, analysed by the vision model once."""
+        with self._vision_lock:
+            for display_name, diagram in self.diagrams.items():
+                if display_name in self._vision_scopes:
+                    continue
+                image = diagram["image"]
+                try:
+                    # Crop, downscale and re-encode the image before upload
+                    encoded = IMAGE_ENCODER.encode(image.data)
+                    # Call OpenAI vision model, unless a near-identical diagram was already analysed
+                    self._vision_scopes[display_name] = DIAGRAM_CACHE.analyze(
+                        encoded.data, DIAGRAM_SCOPE_PROMPT, "gpt-4o",
+                        lambda: LLM_GATEWAY.chat(
+                            "content_analysis.diagram_scope",
+                            messages=[{"role": "user", "content": DIAGRAM_SCOPE_PROMPT}],
+                            model="gpt-4o",
+                            max_tokens=500,
+                            images=[(encoded.data, encoded.mime_type)]
+                        )
+                    )
+                    logger.info(f"Added diagram scope for {display_name}")
+                except Exception as e:
+                    logger.error(f"Error processing image {image.name}: {str(e)}")
+            return {display_name: self._vision_scopes[display_name]
+                    for display_name in self.diagrams if display_name in self._vision_scopes}
+
+    def figure_texts(self, extract_text, generate_scope):
+        """
+        {figure display name: scope} of the OCR text of each figure's images, computed once.
+
+        Args:
+            extract_text: Function returning the OCR text of a PdfImage
+            generate_scope: Function turning the combined text into a scope
+        """
+        with self._text_lock:
+            texts = OrderedDict()  # figure name -> OCR texts, figures in order of appearance
+            complete = {}  # figure name -> True when every image of the figure was read
+            for display_name, diagram in self.diagrams.items():
+                figure_name = diagram["figure"]
+                texts.setdefault(figure_name, [])
+                complete.setdefault(figure_name, True)
+                if figure_name in self._figure_texts:
+                    continue
+                image_text = self._image_texts.get(display_name)
+                if image_text is None:
+                    try:
+                        image_text = extract_text(diagram["image"])
+                    except Exception as e:
+                        logger.error(f"Error extracting text from {diagram['image'].name}: {str(e)}")
+                        complete[figure_name] = False
+                        continue
+                    self._image_texts[display_name] = image_text
+                if image_text.strip():
+                    texts[figure_name].append(image_text)
+
+            figure_texts = {}
+            for figure_name, figure_text in texts.items():
+                # If no specific match found, use the figure name directly
+                display_name = figure_display_name(figure_name) or f"Figure: {figure_name}"
+                if figure_name in self._figure_texts:
+                    scope = self._figure_texts[figure_name]
+                elif not figure_text:
+                    scope = None
+                else:
+                    try:
+                        scope = generate_scope("\n".join(figure_text))
+                    except Exception as e:
+                        logger.error(f"Error generating the scope of {display_name}: {str(e)}")
+                        continue
+                    logger.info(f"Added figure scope for {display_name}")
+                # A figure missing the text of an image is read again by the next call
+                if complete[figure_name]:
+                    self._figure_texts[figure_name] = scope
+                if scope is not None:
+                    figure_texts[display_name] = scope
+            return figure_texts
+
+
+class DiagramExtractionStage:
+    """
+    The diagram extraction shared by ContentAnalysis and DiagramConvention.
+
+    Finds the important figures of a document, extracts the images captioned as them
+    and keeps the result per document (keyed by the PDF's content hash) in a small
+    LRU, so a request running both analyses, or a re-analysis of the same file,
+    extracts the diagrams and sends them to the vision model once.
+    """
+
+    def __init__(self, max_documents=DIAGRAM_EXTRACTION_CACHE_SIZE):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()  # key -> ExtractedDiagrams, oldest first
+        self._pending = {}  # key -> lock held while the document is extracted
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _document_key(pdf_path, sections_dict):
+        digest = hashlib.sha1()
+        with open(pdf_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        key = digest.hexdigest()
+        if sections_dict is not None:
+            sections_digest = hashlib.sha1()
+            for title, content in sections_dict.items():
+                sections_digest.update(f"{title}\0{content}\0".encode('utf-8', 'replace'))
+            key = f"{key}:{sections_digest.hexdigest()}"
+        return key
+
+    def extract(self, pdf_path, text_processor, sections_dict=None):
+        """
+        The diagrams of a PDF, extracted once per document.
+
+        Args:
+            pdf_path: Path to the PDF file
+            text_processor: TextProcessor finding the figures of the sections
+            sections_dict: Optional {section title: content} to find the figures in;
+                by default the numbered sections of the PDF's own text
+
+        Returns:
+            ExtractedDiagrams
+        """
+        key = self._document_key(pdf_path, sections_dict)
+        with self._lock:
+            extracted = self._documents.get(key)
+            if extracted is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return extracted
+            pending = self._pending.setdefault(key, threading.Lock())
+
+        # Concurrent requests for the same document wait for one extraction
+        with pending:
+            with self._lock:
+                extracted = self._documents.get(key)
+                if extracted is not None:
+                    self.hits += 1
+                    return extracted
+                self.misses += 1
+            try:
+                extracted = self._extract(pdf_path, text_processor, sections_dict)
+                # Stored before the pending lock is dropped, so no request extracts it again
+                with self._lock:
+                    self._documents[key] = extracted
+                    while len(self._documents) > self.max_documents:
+                        self._documents.popitem(last=False)
+            except Exception as e:
+                # Failures are not kept, so the next analysis tries again
+                logger.error(f"Error extracting diagrams: {str(e)}")
+                return ExtractedDiagrams({}, {})
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+        return extracted
+
+    @staticmethod
+    def _extract(pdf_path, text_processor, sections_dict):
+        # Import ImageProcessor here to avoid circular dependency
+        from image_processing import ImageProcessor
+
+        logger.info(f"Extracting diagrams from PDF: {pdf_path}")
+        if sections_dict is None:
+            sections_dict = pdf_sections(pdf_path)
+
+        # Find all figures mentioned in the document
+        all_figures = text_processor._find_figures_in_sections(sections_dict)
+
+        # Filter to only the figures we want to process
+        important_figures = {}
+        for figure_name, figure_info in all_figures.items():
+            if important_term(figure_name):
+                important_figures[figure_name] = figure_info
+                logger.info(f"Will process figure: {figure_name}")
+
+        # If no important figures found, look for captions of any important type
+        if not important_figures:
+            logger.warning("No important figures found with exact matching, trying broader matching")
+            for figure_type in IMPORTANT_FIGURES:
+                important_figures[figure_type] = {
+                    'sections': ["Generic Section"],
+                    'mentions': 1,
+                    'generic': True
+                }
+                logger.info(f"Added generic figure type: {figure_type}")
+
+        # Extract only the images captioned as one of these figures
+        logger.info(f"Extracting images for {len(important_figures)} important diagrams")
+        figure_images = ImageProcessor.extract_figure_images(
+            pdf_path, important_figures, max_images=MAX_IMAGES_PER_FIGURE,
+            strip_numbering=text_processor.strip_numbering
+        )
+        for figure_name, images in figure_images.items():
+            if not images:
+                logger.warning(f"No image captioned as {figure_name} found")
+        return ExtractedDiagrams(important_figures, figure_images)
+
+    def stats(self):
+        """Documents held and hit/miss counters."""
+        with self._lock:
+            return {"documents": len(self._documents), "hits": self.hits, "misses": self.misses}
+
+
+# Shared so every analysis of a document reuses one extraction
+DIAGRAM_EXTRACTION = DiagramExtractionStage()
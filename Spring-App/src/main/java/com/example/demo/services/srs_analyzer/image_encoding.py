@@ -0,0 +1,155 @@
+import io
+import os
+import math
+import logging
+import threading
+from collections import namedtuple
+from PIL import Image, ImageChops
+
+logger = logging.getLogger(__name__)
+
+# The vision model fits high-detail images into 2048 x 2048 and then scales the
+# shortest side down to 768 pixels; anything larger is uploaded for nothing
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "2048"))
+VISION_SHORT_SIDE = int(os.getenv("VISION_SHORT_SIDE", "768"))
+# Billed per 512 x 512 tile, plus a fixed base
+VISION_TILE_SIZE = 512
+VISION_TILE_TOKENS = 170
+VISION_BASE_TOKENS = 85
+# Pixels that differ from the background colour by at most this much are cropped
+WHITESPACE_TOLERANCE = 12
+# Whitespace kept around the cropped content
+CROP_MARGIN = 8
+# Images with at most this many colours are line art and stay lossless
+PALETTE_COLORS = 256
+JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+
+EncodedImage = namedtuple("EncodedImage", [
+    "data", "mime_type", "width", "height", "original_bytes", "original_tokens", "tokens"
+])
+
+
+def vision_tokens(width, height, max_side=VISION_MAX_SIDE, short_side=VISION_SHORT_SIDE):
+    """High-detail vision tokens of an image of the given size."""
+    scale = min(1.0, max_side / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, short_side / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / VISION_TILE_SIZE) * math.ceil(height / VISION_TILE_SIZE)
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * tiles
+
+
+def _flatten(image):
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        return Image.alpha_composite(background, image).convert("RGB")
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def crop_whitespace(image, tolerance=WHITESPACE_TOLERANCE, margin=CROP_MARGIN):
+    """Crop the uniform border around the content; the background is the top-left pixel's colour."""
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    difference = ImageChops.difference(image, background).convert("L").point(lambda value: 255 if value > tolerance else 0)
+    box = difference.getbbox()
+    if not box:
+        return image
+    left, top, right, bottom = box
+    box = (max(0, left - margin), max(0, top - margin),
+           min(image.width, right + margin), min(image.height, bottom + margin))
+    return image.crop(box) if box != (0, 0, image.width, image.height) else image
+
+
+def fit_for_vision(image, max_side=VISION_MAX_SIDE, short_side=VISION_SHORT_SIDE):
+    """Downscale an image to the largest size the vision model makes use of."""
+    scale = min(1.0, max_side / max(image.size))
+    scale = min(scale, short_side / (min(image.size) * scale) * scale)
+    if scale >= 1.0:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def _save(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+class ImageEncoder:
+    """
+    Prepares extracted images for upload to the vision model.
+
+    The surrounding whitespace is cropped, the image is downscaled to the resolution
+    the model actually uses, and it is saved as PNG (palette) when it is line art with
+    few colours, as JPEG otherwise, or kept as it was when that is smaller. The MIME
+    type matches the bytes sent. Bytes and estimated vision tokens saved are counted.
+    """
+
+    def __init__(self, max_side=VISION_MAX_SIDE, short_side=VISION_SHORT_SIDE, jpeg_quality=JPEG_QUALITY):
+        self.max_side = max_side
+        self.short_side = short_side
+        self.jpeg_quality = jpeg_quality
+        self._lock = threading.Lock()
+        self._stats = {"images": 0, "original_bytes": 0, "encoded_bytes": 0, "original_tokens": 0, "encoded_tokens": 0}
+
+    def encode(self, image_bytes):
+        """
+        Encode an image for the vision model.
+
+        Args:
+            image_bytes: The image as extracted (any format PIL reads)
+
+        Returns:
+            EncodedImage; the original bytes with their detected MIME type when the
+            image cannot be decoded
+        """
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as original:
+                original.load()
+                original_format = original.format
+                original_size = original.size
+                image = _flatten(original)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot decode image for encoding ({str(e)}); uploading it unchanged")
+            return EncodedImage(image_bytes, "image/jpeg", None, None, len(image_bytes), None, None)
+
+        original_tokens = vision_tokens(*original_size, self.max_side, self.short_side)
+        image = fit_for_vision(crop_whitespace(image), self.max_side, self.short_side)
+
+        colors = image.getcolors(PALETTE_COLORS)
+        if colors is not None:
+            data = _save(image.quantize(len(colors)) if image.mode == "RGB" else image, "PNG", optimize=True)
+            mime_type = "image/png"
+        else:
+            data = _save(image.convert("RGB"), "JPEG", quality=self.jpeg_quality, optimize=True)
+            mime_type = "image/jpeg"
+        if len(data) >= len(image_bytes) and image.size == original_size and original_format in ("PNG", "JPEG"):
+            data, mime_type = image_bytes, Image.MIME[original_format]
+
+        encoded = EncodedImage(data, mime_type, image.width, image.height, len(image_bytes), original_tokens,
+                               vision_tokens(image.width, image.height, self.max_side, self.short_side))
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["original_bytes"] += encoded.original_bytes
+            self._stats["encoded_bytes"] += len(encoded.data)
+            self._stats["original_tokens"] += encoded.original_tokens
+            self._stats["encoded_tokens"] += encoded.tokens
+        logger.info(f"Encoded {original_size[0]}x{original_size[1]} {original_format} ({len(image_bytes)} bytes, "
+                    f"~{original_tokens} tokens) as {image.width}x{image.height} {mime_type} "
+                    f"({len(data)} bytes, ~{encoded.tokens} tokens)")
+        return encoded
+
+    def stats(self):
+        """Images encoded and the bytes and estimated vision tokens saved."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["bytes_saved"] = stats["original_bytes"] - stats["encoded_bytes"]
+        stats["tokens_saved"] = stats["original_tokens"] - stats["encoded_tokens"]
+        return stats
+
+
+# Shared so the savings cover every image sent by the process
+IMAGE_ENCODER = ImageEncoder()
@@ -2,206 +2,288 @@ import cv2
 import pytesseract
 import fitz
 import os
+import hashlib
+import numpy as np
 from PIL import Image
 import logging
 import re
+from caption_index import AhoCorasick, important_term, is_caption_block, normalize
 
 logger = logging.getLogger(__name__)
 
+# Images smaller than this (in pixels, per side and in area) are icons, bullets or
+# logos rather than diagrams
+MIN_IMAGE_SIDE = int(os.getenv("MIN_IMAGE_SIDE", "64"))
+MIN_IMAGE_AREA = int(os.getenv("MIN_IMAGE_AREA", "16384"))
+# Thin strips (header and footer bands, rules) are longer than this times their width
+MAX_IMAGE_ASPECT = float(os.getenv("MAX_IMAGE_ASPECT", "8"))
+# Captions farther than this (in points) from an image on the page do not describe it
+MAX_CAPTION_DISTANCE = float(os.getenv("MAX_CAPTION_DISTANCE", "144"))
+
+
+def is_decorative(width, height):
+    """True for images too small or too elongated to be a diagram."""
+    if min(width, height) < MIN_IMAGE_SIDE or width * height < MIN_IMAGE_AREA:
+        return True
+    return max(width, height) / max(1, min(width, height)) > MAX_IMAGE_ASPECT
+
+
+def caption_distance(image_rect, caption_rect):
+    """
+    Layout distance between an image placement and a caption block, in points.
+
+    Returns:
+        (vertical gap plus horizontal gap, whether the caption is above the image);
+        tuples sort captions below the image first on ties, where captions usually are
+    """
+    vertical = max(0.0, caption_rect.y0 - image_rect.y1, image_rect.y0 - caption_rect.y1)
+    horizontal = max(0.0, caption_rect.x0 - image_rect.x1, image_rect.x0 - caption_rect.x1)
+    return vertical + horizontal, caption_rect.y1 <= image_rect.y0
+
+
+def match_captions(captions, figure_names):
+    """
+    Wanted figures each caption belongs to.
+
+    A caption belongs to the figures whose name it contains. Figures whose name no
+    caption contains (terms such as "Use Case", section titles, names cut short by
+    the text extraction) take the captions of their figure type instead.
+
+    Returns:
+        List of figure name lists, one per caption
+    """
+    keys = {}
+    for name in figure_names:
+        key = normalize(name)[0].strip()
+        if key:
+            keys.setdefault(key, []).append(name)
+    automaton = AhoCorasick(keys)
+    normalized = [normalize(caption)[0] for caption in captions]
+    matched = [[name for key in {key for _, _, key in automaton.finditer(text)} for name in keys[key]]
+               for text in normalized]
+    found = {name for names in matched for name in names}
+    caption_terms = [important_term(text) for text in normalized]
+    for name in figure_names:
+        term = important_term(name)
+        if name in found or not term:
+            continue
+        for index, caption_term in enumerate(caption_terms):
+            if caption_term == term:
+                matched[index].append(name)
+    return matched
+
+
+class PdfImage:
+    """
+    An image extracted from a PDF, held in memory.
+
+    The encoded bytes are kept as extracted; the OpenCV (BGR) array is decoded from
+    them without a copy on first use and then reused, so OCR, the YOLO processors and
+    the vision calls share one object instead of re-reading a file each. The image
+    is written to disk only by save(), for artifacts that must be served.
+    """
+
+    __slots__ = ("data", "xref", "ext", "width", "height", "hash", "name", "occurrences", "path", "_array")
+
+    def __init__(self, data, xref=None, ext="png", width=None, height=None, name=None, occurrences=None):
+        self.data = data
+        self.xref = xref
+        self.ext = ext
+        self.width = width
+        self.height = height
+        self.hash = hashlib.sha1(data).hexdigest()
+        self.name = name or f"{self.hash[:12]}.{ext}"
+        self.occurrences = occurrences if occurrences is not None else []
+        self.path = None
+        self._array = None
+
+    @property
+    def section(self):
+        """Section of the first page the image appears on."""
+        return self.sections[0] if self.sections else None
+
+    @property
+    def sections(self):
+        """Every section the image appears in, in page order."""
+        sections = []
+        for occurrence in self.occurrences:
+            if occurrence["section"] and occurrence["section"] not in sections:
+                sections.append(occurrence["section"])
+        return sections
+
+    @property
+    def pages(self):
+        """Every page (1-based) the image appears on."""
+        return sorted({occurrence["page"] for occurrence in self.occurrences})
+
+    @property
+    def mime_type(self):
+        return Image.MIME.get(Image.registered_extensions().get(f".{self.ext}"), "application/octet-stream")
+
+    @property
+    def array(self):
+        """The decoded BGR image (None when the bytes cannot be decoded)."""
+        if self._array is None:
+            self._array = cv2.imdecode(np.frombuffer(memoryview(self.data), dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._array
+
+    def grayscale(self):
+        array = self.array
+        return None if array is None else cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
+
+    def save(self, directory, filename=None):
+        """Write the image to a directory (once) and return its path."""
+        if self.path is None:
+            os.makedirs(directory, exist_ok=True)
+            self.path = os.path.join(directory, filename or os.path.basename(self.name))
+            with open(self.path, "wb") as image_file:
+                image_file.write(self.data)
+        return self.path
+
+    def __repr__(self):
+        return f"PdfImage({self.name!r}, {self.width}x{self.height}, {len(self.data)} bytes)"
+
+
 class ImageProcessor:
 
     @staticmethod
-    def extract_images_from_pdf(pdf_path, output_dir="uploads", target_figures=None):
+    def extract_figure_images(pdf_path, figures, max_images=2, strip_numbering=None):
         """
-        Extract images and correctly assign them to sections based on document structure and figure captions.
-        
+        Extract the images of the wanted figures, associated by page layout.
+
+        The caption blocks ("Figure 3: ...") of every page are located, and each
+        placement of an image on a page (page.get_image_rects) is assigned to the
+        nearest caption on that page. Only images whose caption belongs to a wanted
+        figure are extracted; images nearest another caption, with no caption
+        within MAX_CAPTION_DISTANCE, or decorative ones are never read. An image is
+        extracted once (by xref, then by content hash), and every later placement of
+        it is recorded as an occurrence, captioned or not.
+
         Args:
             pdf_path: Path to the PDF file
-            output_dir: Directory to save extracted images
-            target_figures: Optional list of figure names to target (for optimization)
-            
+            figures: Dictionary {figure_name: figure_info} of the wanted figures (see
+                TextProcessor._find_figures_in_sections)
+            max_images: Images kept per figure
+            strip_numbering: Optional function cleaning the section titles the
+                images are named after
+
         Returns:
-            List of paths to extracted images
+            Dictionary {figure_name: [PdfImage]} in page order; occurrences record
+            {"page", "section", "caption"} of every placement (section is None away
+            from a wanted figure's caption, caption with no caption nearby) and names are
+            "<section>/page_<page>img<index>.png"
         """
-        logger.info(f"Extracting images from PDF: {pdf_path}")
-        logger.info(f"Target figures: {target_figures}")
+        logger.info(f"Extracting images of {len(figures)} figures from PDF: {pdf_path}")
+        figure_images = {name: [] for name in figures}
+        by_xref = {}
+        by_hash = {}
         doc = fitz.open(pdf_path)
-        image_paths = []
-
-        from text_processing import TextProcessor
-        text_processor = TextProcessor()
-        full_text = text_processor.extract_text_from_pdf(pdf_path)
-        sections, figures = text_processor.extract_sections_with_figures(full_text)
-
-        figure_map = {}  # Mapping of figures to their section
-        for section in sections:
-            for figure in section["figures"]:
-                # Create more flexible matching for target figures
-                if target_figures:
-                    should_include = False
-                    figure_lower = figure.lower()
-                    
-                    # Check direct substring match first
-                    for target in target_figures:
-                        target_lower = target.lower()
-                        if target_lower in figure_lower or figure_lower in target_lower:
-                            should_include = True
-                            logger.info(f"Matched figure '{figure}' with target '{target}'")
-                            break
-                    
-                    # Check for word-level matches if no direct match
-                    if not should_include:
-                        figure_words = set(figure_lower.split())
-                        for target in target_figures:
-                            target_words = set(target.lower().split())
-                            # If there's significant word overlap
-                            common_words = figure_words.intersection(target_words)
-                            if len(common_words) > 0 and len(common_words)/len(target_words) > 0.3:
-                                should_include = True
-                                logger.info(f"Word-level match for figure '{figure}' with target '{target}'")
-                                break
-                    
-                    if not should_include:
-                        logger.debug(f"Skipping figure '{figure}' - no match with targets")
-                        continue
-                
-                figure_map[figure] = section["title"]
-                logger.info(f"Including figure: '{figure}' in section '{section['title']}'")
-
-        # Skip processing if no figures match our targets
-        if target_figures and not figure_map:
-            logger.warning("No matching target figures found in document")
-            logger.info("Available figures in the document:")
-            for section in sections:
-                for figure in section["figures"]:
-                    logger.info(f"  - '{figure}' in section '{section['title']}'")
-            
-            # If we have targets but no matches, process all figures as a fallback
-            logger.info("Using fallback: processing all figures in the document")
-            for section in sections:
-                for figure in section["figures"]:
-                    figure_map[figure] = section["title"]
-        
-        # If still no figures, process all images as a last resort
-        if not figure_map:
-            logger.warning("No figures with captions found in document. Processing all images.")
-            # Process all pages
-            min_page = 0
-            max_page = len(doc) - 1
-        else:
-            # Minimum and maximum pages to process - optimization
-            min_page = len(doc)
-            max_page = 0
-            
-            # First scan to find page ranges - speeds up processing
-            if target_figures:
-                logger.info("Scanning for page range containing target figures")
-                for page_num in range(len(doc)):
-                    page = doc.load_page(page_num)
-                    page_text = page.get_text("text").strip()
-                    
-                    for figure in figure_map.keys():
-                        if figure in page_text:
-                            min_page = min(min_page, page_num)
-                            max_page = max(max_page, page_num)
-                
-                # Expand range slightly to catch diagrams that might be on adjacent pages
-                min_page = max(0, min_page - 2)  # Increased padding
-                max_page = min(len(doc) - 1, max_page + 2)  # Increased padding
-                
-                logger.info(f"Processing page range {min_page+1} to {max_page+1}")
-            else:
-                # Process all pages if no target figures
-                min_page = 0
-                max_page = len(doc) - 1
-
-        # Special case - if we didn't find any pages with figures, process all pages
-        if min_page > max_page:
-            logger.warning("No pages containing figure captions found. Processing all pages.")
-            min_page = 0
-            max_page = len(doc) - 1
-
-        for page_num in range(min_page, max_page + 1):
-            logger.debug(f"Processing page {page_num + 1}")
-            page = doc.load_page(page_num)
-            images = page.get_images(full=True)
-            page_text = page.get_text("text").strip()
-
-            # Try to match this page with a section
-            matched_section = None
-            for figure, section_title in figure_map.items():
-                if figure in page_text:
-                    matched_section = section_title
-                    logger.info(f"Page {page_num+1} matched to figure '{figure}'")
-                    break
-
-            # Flexible matching for target figures directly in page text
-            if not matched_section and target_figures:
-                for target in target_figures:
-                    if target.lower() in page_text.lower():
-                        matched_section = f"Auto-{target}"
-                        logger.info(f"Page {page_num+1} matched to target figure '{target}'")
-                        break
-
-            if not matched_section:
-                if target_figures and len(target_figures) > 0:
-                    # If no exact match but we're looking for specific figures,
-                    # put images in a folder named after the first target
-                    section_folder = os.path.join(output_dir, target_figures[0])
-                    logger.info(f"No figure match on page {page_num+1}. Using default target folder '{target_figures[0]}'")
-                else:
-                    logger.warning(f"No figure found on page {page_num + 1}. Assigning images to 'Unsorted'.")
-                    section_folder = os.path.join(output_dir, "Unsorted")
-            else:
-                section_folder = os.path.join(output_dir, text_processor.strip_numbering(matched_section))
-
-            os.makedirs(section_folder, exist_ok=True)
-
-            # Only extract images if we found some
-            if len(images) > 0:
-                logger.info(f"Page {page_num+1} has {len(images)} images")
-                
-                for img_index, img in enumerate(images):
-                    try:
-                        xref = img[0]
-                        base_image = doc.extract_image(xref)
-                        image_data = base_image["image"]
-                        img_filename = f"page_{page_num + 1}img{img_index + 1}.png"
-                        img_path = os.path.join(section_folder, img_filename)
-
-                        with open(img_path, "wb") as img_file:
-                            img_file.write(image_data)
+        try:
+            page_captions = []
+            for page in doc:
+                page_captions.append([
+                    (fitz.Rect(block[:4]), " ".join(block[4].split()))
+                    for block in page.get_text("blocks") if block[6] == 0 and is_caption_block(block[4])
+                ])
+            all_captions = [caption for captions in page_captions for _, caption in captions]
+            matches = iter(match_captions(all_captions, list(figures)))
+            page_captions = [[(rect, caption, next(matches)) for rect, caption in captions]
+                             for captions in page_captions]
+            logger.info(f"Found {len(all_captions)} captions, "
+                        f"{sum(1 for captions in page_captions for *_, names in captions if names)} of wanted figures")
 
-                        # We'll include all images now instead of doing selective OCR
-                        image_paths.append(img_path)
-                        logger.debug(f"Saved image to: {img_path}")
+            def placement(captions, rect):
+                """Nearest caption, its wanted figures and their section, for one image placement."""
+                (distance, _), caption, names = min(
+                    ((caption_distance(rect, caption_rect), caption, names)
+                     for caption_rect, caption, names in captions),
+                    key=lambda candidate: candidate[0],
+                    default=((float("inf"), False), None, [])
+                )
+                if distance > MAX_CAPTION_DISTANCE or not names:
+                    return caption if distance <= MAX_CAPTION_DISTANCE else None, [], None
+                section = (figures[names[0]].get('sections') or [caption])[0]
+                return caption, names, strip_numbering(section) if strip_numbering else section
 
+            for page_num, captions in enumerate(page_captions):
+                if not any(names for *_, names in captions):
+                    continue
+                page = doc.load_page(page_num)
+                for img_index, img in enumerate(page.get_images(full=True)):
+                    xref, width, height = img[0], img[2], img[3]
+                    if is_decorative(width, height):
+                        continue
+                    try:
+                        for rect in page.get_image_rects(xref):
+                            caption, names, section = placement(captions, rect)
+                            if caption is None:
+                                logger.debug(f"Image {xref} on page {page_num + 1} has no caption nearby")
+                            names = [name for name in names if len(figure_images[name]) < max_images]
+                            if not names:
+                                continue
+                            image = by_xref.get(xref)
+                            if image is None:
+                                base_image = doc.extract_image(xref)
+                                image_data = base_image["image"]
+                                digest = hashlib.sha1(image_data).hexdigest()
+                                image = by_hash.get(digest)
+                                if image is None:
+                                    image = PdfImage(
+                                        image_data, xref, base_image.get("ext", "png"), width, height,
+                                        name=os.path.join(section, f"page_{page_num + 1}img{img_index + 1}.png")
+                                    )
+                                    by_hash[digest] = image
+                                by_xref[xref] = image
+                            for name in names:
+                                if image not in figure_images[name]:
+                                    figure_images[name].append(image)
+                                    logger.info(f"Image {image.name} belongs to {name!r} (caption {caption!r})")
                     except Exception as e:
                         logger.error(f"Error extracting image {img_index + 1} from page {page_num + 1}: {str(e)}")
-            else:
-                logger.debug(f"No images found on page {page_num+1}")
 
-        logger.info(f"Extracted {len(image_paths)} images total")
-        return image_paths
+            # Every placement of the extracted images, including repeats on pages
+            # without a wanted caption; the page lists are read, no image bytes
+            if by_xref:
+                for page_num, captions in enumerate(page_captions):
+                    page = doc.load_page(page_num)
+                    for img in page.get_images(full=True):
+                        image = by_xref.get(img[0])
+                        if image is None:
+                            continue
+                        for rect in page.get_image_rects(img[0]):
+                            caption, _, section = placement(captions, rect)
+                            occurrence = {"page": page_num + 1, "section": section, "caption": caption}
+                            if occurrence not in image.occurrences:
+                                image.occurrences.append(occurrence)
+        finally:
+            doc.close()
+
+        logger.info(f"Extracted {len(by_hash)} figure images for "
+                    f"{sum(1 for images in figure_images.values() if images)} of {len(figures)} figures "
+                    f"({sum(len(image.occurrences) for image in by_hash.values())} placements)")
+        return figure_images
 
     @staticmethod
-    def preprocess_image(image_path):
-        """Preprocess image for better OCR results."""
-        logger.debug(f"Preprocessing image: {image_path}")
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    def preprocess_image(image):
+        """Preprocess image (a PdfImage or a file path) for better OCR results."""
+        logger.debug(f"Preprocessing image: {image}")
+        if isinstance(image, PdfImage):
+            img = image.grayscale()
+        else:
+            img = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
         if img is None:
-            logger.error(f"Could not read image: {image_path}")
-            raise RuntimeError(f"Could not read image: {image_path}")
+            logger.error(f"Could not read image: {image}")
+            raise RuntimeError(f"Could not read image: {image}")
         img = cv2.threshold(img, 150, 255, cv2.THRESH_BINARY)[1]
         logger.debug("Image preprocessing completed")
         return img
 
     @staticmethod
-    def extract_text_from_image(image_path):
-        """Extract text from image using OCR."""
-        logger.info(f"Extracting text from image: {image_path}")
+    def extract_text_from_image(image):
+        """Extract text from image (a PdfImage or a file path) using OCR."""
+        logger.info(f"Extracting text from image: {image}")
         try:
-            preprocessed_image = ImageProcessor.preprocess_image(image_path)
+            preprocessed_image = ImageProcessor.preprocess_image(image)
             text = pytesseract.image_to_string(preprocessed_image)
             logger.debug(f"Extracted text length: {len(text)}")
             return text
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import httpx
+import openai
+import google.generativeai as genai
+from rate_limiter import RateLimiter, RateLimitExceeded, RetryPolicy
+from rate_limit_storage import RATE_LIMIT_STORAGE
+from llm_scheduler import LLM_SCHEDULER, estimate_chat_tokens, estimate_text_tokens
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a request is abandoned (connection setup has its own, shorter limit)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# Pooled HTTP connections kept open to the OpenAI API
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "90"))
+# Attempts per call, including the first one
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+# Requests per second sent to each provider, with bursts of up to twice that; the
+# limit is shared by all workers when RATE_LIMIT_STORAGE_URI points to a store
+LLM_REQUESTS_PER_SECOND = {
+    "openai": float(os.getenv("OPENAI_REQUESTS_PER_SECOND", "5")),
+    "gemini": float(os.getenv("GEMINI_REQUESTS_PER_SECOND", "2")),
+}
+# Latency samples kept per call site
+LATENCY_WINDOW = 500
+
+# Exception class names (OpenAI, google.api_core and httpx) of transient failures
+RETRYABLE_ERRORS = {
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests",
+    "BadGateway", "GatewayTimeout",
+    "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError",
+}
+RATE_LIMIT_ERRORS = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+
+# True while a request thread makes LLM calls that must not wait (see no_wait)
+LLM_NO_WAIT = contextvars.ContextVar("llm_no_wait", default=False)
+
+
+@contextmanager
+def no_wait():
+    """
+    Make the LLM calls inside the block raise instead of waiting.
+
+    A call that does not fit its quota or request rate at once raises
+    RateLimitExceeded (with retry_after), a provider 429 is not retried, and other
+    transient failures are retried without backoff sleeps.
+    """
+    token = LLM_NO_WAIT.set(True)
+    try:
+        yield
+    finally:
+        LLM_NO_WAIT.reset(token)
+
+
+def is_retryable(error):
+    """True for rate limits, timeouts, connection errors and 5xx responses."""
+    if type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # OpenAI errors carry the HTTP status in status_code, google.api_core ones in code
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def is_rate_limit(error):
+    """True when the provider rejected a request for exceeding its quota."""
+    return type(error).__name__ in RATE_LIMIT_ERRORS or getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error):
+    """Retry-After seconds of a 429 response, if the provider sent one."""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _openai_usage(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def _gemini_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None)
+
+
+def _percentile(sorted_values, share):
+    return sorted_values[min(len(sorted_values) - 1, int(share * len(sorted_values)))]
+
+
+class LLMClients:
+    """
+    Long-lived provider clients shared by every LLM call of the analyzer.
+
+    The OpenAI client keeps a pool of keep-alive HTTP connections, and Gemini models
+    are built once per (model, generation config), so no call pays for client or
+    connection setup. Every request is admitted by the LLMScheduler against the
+    token quota of its model, waits for its provider's request rate limit (token
+    buckets shared across workers when a store is configured), runs with the same
+    timeouts, and is retried on transient failures with jittered exponential
+    backoff under a shared retry budget. Inside no_wait() none of these steps sleeps.
+    The latency of every call is recorded per call site.
+    """
+
+    def __init__(self, timeout=LLM_TIMEOUT, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 max_connections=LLM_MAX_CONNECTIONS, max_attempts=LLM_MAX_ATTEMPTS,
+                 requests_per_second=None, scheduler=None, storage=None):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        rates = dict(LLM_REQUESTS_PER_SECOND, **(requests_per_second or {}))
+        storage = storage if storage is not None else RATE_LIMIT_STORAGE
+        self.limiters = {
+            provider: RateLimiter(storage=storage, tokens_per_second=rate, max_tokens=max(1, 2 * rate))
+            for provider, rate in rates.items()
+        }
+        self.retry_policy = RetryPolicy(max_attempts=max_attempts)
+        self.scheduler = scheduler or LLM_SCHEDULER
+        self._openai_client = None
+        self._gemini_models = {}
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._counts = defaultdict(lambda: {"calls": 0, "errors": 0, "retries": 0})
+        self._stats_lock = threading.Lock()
+
+    def openai(self):
+        """The shared OpenAI client (created on first use)."""
+        with self._lock:
+            if self._openai_client is None:
+                self._openai_client = openai.OpenAI(
+                    timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                    # Retries are handled by call() so they respect the token buckets
+                    max_retries=0,
+                    http_client=openai.DefaultHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections,
+                            keepalive_expiry=LLM_KEEPALIVE_SECONDS
+                        )
+                    )
+                )
+            return self._openai_client
+
+    def gemini_model(self, model, generation_config=None):
+        """The shared Gemini model object for a model name and generation config."""
+        key = (model, json.dumps(generation_config or {}, sort_keys=True))
+        with self._lock:
+            if key not in self._gemini_models:
+                self._gemini_models[key] = genai.GenerativeModel(
+                    model_name=model, generation_config=generation_config or None
+                )
+            return self._gemini_models[key]
+
+    def _record(self, call_site, outcome, seconds=None):
+        with self._stats_lock:
+            self._counts[call_site][outcome] += 1
+            if seconds is not None:
+                self._latencies[call_site].append(seconds)
+
+    def call(self, provider, call_site, request, model=None, estimated_tokens=0, usage=None):
+        """
+        Run one provider request with admission, pacing, retries and latency accounting.
+
+        Args:
+            provider: "openai" or "gemini"; selects the request rate limit
+            call_site: Name of the calling feature, used for statistics
+            request: Function without arguments performing the request
+            model: Model name; calls with a model are admitted by the scheduler
+            estimated_tokens: Estimated prompt plus completion tokens of the request
+            usage: Function returning the actual tokens used from the response
+
+        Returns:
+            The result of request()
+        """
+        limiter = self.limiters.get(provider)
+        wait = not LLM_NO_WAIT.get()
+
+        def acquire_slot():
+            if wait:
+                if not limiter.acquire(f"llm:{provider}", timeout=self.timeout):
+                    raise TimeoutError(f"No {provider} request slot within {self.timeout}s")
+                return
+            allowed, retry_after = limiter.check(f"llm:{provider}")
+            if not allowed:
+                raise RateLimitExceeded(f"No {provider} request slot available", retry_after)
+
+        def retryable(error):
+            # Without waiting, a rate limit goes back to the client as a 429
+            return is_retryable(error) and (wait or not (is_rate_limit(error) or isinstance(error, RateLimitExceeded)))
+
+        def attempt():
+            reservation = self.scheduler.admit(provider, model, estimated_tokens, wait=wait) if model else None
+            sent = settled = False
+            try:
+                if limiter is not None:
+                    acquire_slot()
+                start = time.perf_counter()
+                sent = True
+                try:
+                    result = request()
+                except Exception as e:
+                    if reservation and is_rate_limit(e):
+                        # Released before the drain, so the pause after the 429 is kept whole
+                        self.scheduler.release(reservation)
+                        settled = True
+                        self.scheduler.throttled(provider, model, retry_after_seconds(e))
+                    raise
+                self._record(call_site, "calls", time.perf_counter() - start)
+                if reservation and usage:
+                    self.scheduler.settle(reservation, usage(result))
+                settled = True
+                return result
+            finally:
+                # Every retry reserves again, so a failed attempt gives its reservation back
+                if reservation and not settled:
+                    self.scheduler.release(reservation, sent)
+
+        def on_retry(attempt_number, error, delay):
+            self._record(call_site, "retries")
+            logger.warning(f"{call_site}: {type(error).__name__} from {provider} ({str(error)[:200]}), "
+                           f"retrying in {delay:.2f}s (attempt {attempt_number + 1})")
+
+        try:
+            return self.retry_policy.call(attempt, retryable, on_retry, wait=wait)
+        except Exception:
+            self._record(call_site, "errors")
+            raise
+
+    def chat(self, call_site, **kwargs):
+        """OpenAI chat completion; kwargs are passed to chat.completions.create."""
+        return self.call(
+            "openai", call_site, lambda: self.openai().chat.completions.create(**kwargs),
+            model=kwargs.get("model"),
+            estimated_tokens=estimate_chat_tokens(kwargs.get("messages", []), kwargs.get("max_tokens")),
+            usage=_openai_usage
+        )
+
+    def embed(self, call_site, texts, model="text-embedding-3-small", dimensions=None):
+        """
+        Embed a list of texts in one OpenAI request.
+
+        Returns:
+            List of embedding vectors in input order
+        """
+        kwargs = {"model": model, "input": list(texts)}
+        if dimensions is not None:
+            kwargs["dimensions"] = dimensions
+        response = self.call(
+            "openai", call_site, lambda: self.openai().embeddings.create(**kwargs),
+            model=model, estimated_tokens=sum(estimate_text_tokens(text) for text in kwargs["input"]),
+            usage=_openai_usage
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def generate(self, call_site, prompt, model, generation_config=None):
+        """Gemini generate_content; returns the response text."""
+        gemini_model = self.gemini_model(model, generation_config)
+        completion_tokens = (generation_config or {}).get("max_output_tokens")
+        response = self.call(
+            "gemini", call_site,
+            lambda: gemini_model.generate_content(prompt, request_options={"timeout": self.timeout}),
+            model=model,
+            estimated_tokens=estimate_chat_tokens([{"content": prompt}], completion_tokens),
+            usage=_gemini_usage
+        )
+        return response.text
+
+    def stats(self):
+        """
+        Call statistics per call site.
+
+        Returns:
+            Dictionary {call site: {"calls", "errors", "retries", "mean_ms", "p50_ms",
+            "p95_ms", "last_ms"}} over the last LATENCY_WINDOW calls
+        """
+        with self._stats_lock:
+            sites = {site: (dict(counts), list(self._latencies[site])) for site, counts in self._counts.items()}
+        result = {}
+        for site, (counts, latencies) in sites.items():
+            if latencies:
+                ordered = sorted(latencies)
+                counts.update({
+                    "mean_ms": round(1000 * sum(ordered) / len(ordered), 1),
+                    "p50_ms": round(1000 * _percentile(ordered, 0.5), 1),
+                    "p95_ms": round(1000 * _percentile(ordered, 0.95), 1),
+                    "last_ms": round(1000 * latencies[-1], 1)
+                })
+            result[site] = counts
+        return result
+
+
+# Shared by every module so connections and rate limits are process-wide
+LLM_CLIENTS = LLMClients()
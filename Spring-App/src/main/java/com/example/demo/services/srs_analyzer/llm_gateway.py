@@ -0,0 +1,289 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import base64
+from collections import defaultdict
+from llm_clients import LLM_CLIENTS
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "llm_responses.sqlite3")
+)
+# Seconds a cached response stays valid
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 60 * 60)))
+# "0" disables the cache everywhere
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+# Comma-separated call sites that never use the cache
+LLM_CACHE_DISABLED_SITES = {
+    site.strip() for site in os.getenv("LLM_CACHE_DISABLED_SITES", "").split(",") if site.strip()
+}
+# Expired entries are purged after this many writes
+PURGE_INTERVAL = 500
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_prompt(text):
+    """Collapse whitespace so re-indented but identical prompts share a cache entry."""
+    return WHITESPACE_PATTERN.sub(' ', text or '').strip()
+
+
+def image_hash(image_bytes):
+    """Content hash of an image sent with a prompt."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def cache_key(provider, model, prompt, temperature, image_hashes=(), params=None):
+    """
+    Cache key of an LLM request.
+
+    Args:
+        provider: "openai" or "gemini"
+        model: Model name
+        prompt: Prompt text, or the list of chat messages
+        temperature: Sampling temperature (None when the provider default is used)
+        image_hashes: Hashes of the images sent with the prompt
+        params: Other parameters that change the response (max tokens, response format)
+    """
+    if isinstance(prompt, list):
+        prompt = [[message["role"], normalize_prompt(message["content"])] for message in prompt]
+    else:
+        prompt = normalize_prompt(prompt)
+    payload = json.dumps(
+        [provider, model, prompt, temperature, list(image_hashes), params or {}],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """Persistent SQLite cache of LLM responses with a time-to-live."""
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._available = True
+        try:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                "cache_key TEXT PRIMARY KEY, call_site TEXT NOT NULL, provider TEXT NOT NULL, "
+                "model TEXT NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"LLM response cache unavailable: {str(e)}")
+            self._available = False
+
+    def get(self, key):
+        """Return the cached response for a key, or None."""
+        if not self._available:
+            return None
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT response FROM llm_responses WHERE cache_key = ? AND expires_at > ?",
+                    (key, time.time())
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading LLM response cache: {str(e)}")
+                return None
+        return row[0] if row else None
+
+    def put(self, key, response, call_site, provider, model, ttl=None):
+        """Store a response."""
+        if not self._available:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_responses "
+                    "(cache_key, call_site, provider, model, response, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, call_site, provider, model, response, now, now + (ttl or self.ttl))
+                )
+                self._writes += 1
+                if self._writes % PURGE_INTERVAL == 0:
+                    self._conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing LLM response cache: {str(e)}")
+
+    def size(self):
+        """Number of stored responses (including expired ones not yet purged)."""
+        if not self._available:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+
+
+class LLMGateway:
+    """
+    Single entry point for the OpenAI and Gemini calls of the analyzer.
+
+    Every request is identified by its call site (e.g. "similarity.system_scope") and
+    looked up in a persistent response cache keyed by provider, model, normalized
+    prompt, temperature and image hashes, so re-analysing a document or a section
+    copied from the template does not spend quota again. Call sites can opt out with
+    cache=False or through LLM_CACHE_DISABLED_SITES, and pass validate to keep
+    replies they cannot parse out of the cache.
+    """
+
+    def __init__(self, cache=None, clients=None):
+        self.cache = cache or LLMResponseCache()
+        self.clients = clients or LLM_CLIENTS
+        self._stats = defaultdict(lambda: {"hits": 0, "misses": 0, "uncached": 0})
+        self._stats_lock = threading.Lock()
+
+    def _use_cache(self, call_site, cache):
+        return LLM_CACHE_ENABLED and cache and call_site not in LLM_CACHE_DISABLED_SITES
+
+    def _count(self, call_site, outcome):
+        with self._stats_lock:
+            self._stats[call_site][outcome] += 1
+
+    @staticmethod
+    def _valid(response, validate):
+        if not response:
+            return False
+        if validate is None:
+            return True
+        try:
+            return bool(validate(response))
+        except Exception:
+            return False
+
+    def _cached_call(self, call_site, key, cache, ttl, provider, model, call, validate=None):
+        if not self._use_cache(call_site, cache):
+            self._count(call_site, "uncached")
+            return call()
+        cached = self.cache.get(key)
+        # Entries stored before the call site validated its replies are checked too
+        if cached is not None and self._valid(cached, validate):
+            self._count(call_site, "hits")
+            logger.debug(f"LLM cache hit for {call_site}")
+            return cached
+        self._count(call_site, "misses")
+        response = call()
+        if self._valid(response, validate):
+            self.cache.put(key, response, call_site, provider, model, ttl)
+        else:
+            logger.warning(f"Not caching an invalid {call_site} response")
+        return response
+
+    def chat(self, call_site, messages, model, temperature=None, max_tokens=None, images=None,
+             response_format=None, cache=True, ttl=None, validate=None):
+        """
+        Send a chat completion request to OpenAI.
+
+        Args:
+            call_site: Name of the calling feature, used for opt-out and statistics
+            messages: Chat messages ({"role", "content"} with string contents)
+            model: OpenAI model name
+            temperature: Sampling temperature (provider default when None)
+            max_tokens: Maximum tokens in the response
+            images: Optional list of (image bytes, MIME type) attached to the last message
+            response_format: Optional OpenAI response_format
+            cache: False to bypass the response cache for this call
+            ttl: Cache lifetime in seconds for this response
+            validate: Optional predicate on the response text; responses for which it
+                is false (or raises) are neither cached nor served from the cache
+
+        Returns:
+            The text of the first choice
+        """
+        images = images or []
+        params = {"max_tokens": max_tokens, "response_format": response_format}
+        key = cache_key("openai", model, messages, temperature,
+                        [image_hash(data) for data, _ in images], params)
+
+        def call():
+            request_messages = [dict(message) for message in messages]
+            if images:
+                parts = [{"type": "text", "text": request_messages[-1]["content"]}]
+                for data, mime_type in images:
+                    encoded = base64.b64encode(data).decode('utf-8')
+                    parts.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded}"}})
+                request_messages[-1]["content"] = parts
+            kwargs = {"model": model, "messages": request_messages}
+            if temperature is not None:
+                kwargs["temperature"] = temperature
+            if max_tokens is not None:
+                kwargs["max_tokens"] = max_tokens
+            if response_format is not None:
+                kwargs["response_format"] = response_format
+            response = self.clients.chat(call_site, **kwargs)
+            return response.choices[0].message.content
+
+        return self._cached_call(call_site, key, cache, ttl, "openai", model, call, validate)
+
+    def generate(self, call_site, prompt, model, generation_config=None, cache=True, ttl=None, validate=None):
+        """
+        Send a prompt to Gemini.
+
+        Args:
+            call_site: Name of the calling feature, used for opt-out and statistics
+            prompt: Prompt text
+            model: Gemini model name
+            generation_config: Optional Gemini generation config (temperature etc.)
+            cache: False to bypass the response cache for this call
+            ttl: Cache lifetime in seconds for this response
+            validate: Optional predicate on the response text; responses for which it
+                is false (or raises) are neither cached nor served from the cache
+
+        Returns:
+            The response text
+        """
+        generation_config = dict(generation_config or {})
+        temperature = generation_config.pop("temperature", None)
+        key = cache_key("gemini", model, prompt, temperature, params=generation_config)
+
+        def call():
+            config = dict(generation_config)
+            if temperature is not None:
+                config["temperature"] = temperature
+            return self.clients.generate(call_site, prompt, model, config or None)
+
+        return self._cached_call(call_site, key, cache, ttl, "gemini", model, call, validate)
+
+    def embed(self, call_site, texts, model="text-embedding-3-small", dimensions=None):
+        """Embed texts in one request (embeddings are not cached)."""
+        return self.clients.embed(call_site, texts, model, dimensions)
+
+    def stats(self):
+        """
+        Cache statistics per call site.
+
+        Returns:
+            Dictionary {call site: {"hits", "misses", "uncached", "hit_ratio"}} plus a
+            "total" entry, the number of stored responses, the request latencies
+            of the client layer and the quota admissions of the scheduler
+        """
+        with self._stats_lock:
+            sites = {site: dict(counts) for site, counts in self._stats.items()}
+        total = {"hits": 0, "misses": 0, "uncached": 0}
+        for counts in sites.values():
+            for outcome in total:
+                total[outcome] += counts[outcome]
+        for counts in list(sites.values()) + [total]:
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_ratio"] = round(counts["hits"] / lookups, 3) if lookups else 0.0
+        return {"call_sites": sites, "total": total, "stored_responses": self.cache.size(),
+                "requests": self.clients.stats(), "quotas": self.clients.scheduler.stats()}
+
+
+# Shared by every module so the statistics cover the whole process
+LLM_GATEWAY = LLMGateway()
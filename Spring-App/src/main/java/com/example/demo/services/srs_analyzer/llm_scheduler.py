@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from contextlib import contextmanager
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Tokens and requests per minute per model; LLM_QUOTAS (JSON, same shape) overrides
+# or extends these, e.g. {"gpt-4": {"tpm": 40000, "rpm": 500}}
+DEFAULT_QUOTAS = {
+    "gpt-4": {"tpm": 10000, "rpm": 500},
+    "gpt-4o": {"tpm": 30000, "rpm": 500},
+    "gpt-3.5-turbo": {"tpm": 200000, "rpm": 500},
+    "text-embedding-3-small": {"tpm": 1000000, "rpm": 3000},
+    "gemini-1.5-flash": {"tpm": 1000000, "rpm": 15},
+    "gemini-2.0-flash": {"tpm": 1000000, "rpm": 15},
+}
+# Used for models without their own entry
+PROVIDER_QUOTAS = {
+    "openai": {"tpm": 30000, "rpm": 500},
+    "gemini": {"tpm": 1000000, "rpm": 15},
+}
+# Rough size of English text in tokens, and the fixed costs of messages and images
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 765
+# Completion size assumed when a call sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+# Seconds a queued call waits between checks when it is not at the head of the queue
+QUEUE_POLL_SECONDS = 1.0
+
+# Document on whose behalf the current thread makes LLM calls
+CURRENT_DOCUMENT = contextvars.ContextVar("llm_document", default="default")
+
+Reservation = namedtuple("Reservation", ["key", "tokens", "document", "queued_seconds"])
+
+
+def _load_quotas():
+    quotas = dict(DEFAULT_QUOTAS)
+    try:
+        quotas.update(json.loads(os.getenv("LLM_QUOTAS", "{}")))
+    except ValueError as e:
+        logger.error(f"Ignoring invalid LLM_QUOTAS: {str(e)}")
+    return quotas
+
+
+def estimate_text_tokens(text):
+    """Token estimate of a text."""
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+
+def estimate_chat_tokens(messages, max_tokens=None):
+    """
+    Prompt plus completion token estimate of a chat request.
+
+    Message contents may be strings or lists of text and image_url parts.
+    """
+    tokens = max_tokens or DEFAULT_COMPLETION_TOKENS
+    for message in messages:
+        tokens += MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    tokens += IMAGE_TOKENS
+                else:
+                    tokens += estimate_text_tokens(part.get("text"))
+        else:
+            tokens += estimate_text_tokens(content)
+    return tokens
+
+
+class RateBucket:
+    """
+    Per-minute budget refilled continuously, debited by arbitrary amounts.
+
+    Not thread-safe; LLMScheduler guards its buckets with its own lock. The level may
+    go negative when the actual usage of a call exceeds its estimate or after a 429,
+    which delays the next admissions accordingly.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount):
+        """Seconds until `amount` can be taken."""
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def adjust(self, amount):
+        """Credit (positive) or debit (negative) the bucket."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, seconds=0.0):
+        """Empty the bucket, and keep it empty for `seconds`."""
+        self._refill()
+        self.level = min(self.level, -seconds * self.rate)
+
+
+class LLMScheduler:
+    """
+    Admits LLM calls against the tokens-per-minute and requests-per-minute quotas of
+    each provider and model.
+
+    Every call states its estimated prompt plus completion tokens before dispatch and
+    waits until both budgets allow it, so the pipeline runs at the quota ceiling
+    instead of collecting 429s. After the call the estimate is corrected with the
+    actual usage. Calls waiting for the same model are queued per document and served
+    round-robin, so one large document cannot starve the others.
+    """
+
+    def __init__(self, quotas=None):
+        self.quotas = quotas if quotas is not None else _load_quotas()
+        self._buckets = {}
+        self._queues = {}
+        self._condition = threading.Condition()
+        self._stats = defaultdict(lambda: {
+            "admitted": 0, "queued_seconds": 0.0, "estimated_tokens": 0, "actual_tokens": 0, "throttled": 0,
+            "released": 0
+        })
+
+    def quota(self, provider, model):
+        """The {"tpm", "rpm"} quota of a model."""
+        return self.quotas.get(model) or PROVIDER_QUOTAS.get(provider) or PROVIDER_QUOTAS["openai"]
+
+    def _buckets_for(self, key):
+        if key not in self._buckets:
+            quota = self.quota(*key)
+            self._buckets[key] = (RateBucket(quota["tpm"]), RateBucket(quota["rpm"]))
+        return self._buckets[key]
+
+    @contextmanager
+    def document(self, document_id):
+        """Attribute the LLM calls made inside the block to a document."""
+        token = CURRENT_DOCUMENT.set(str(document_id))
+        try:
+            yield
+        finally:
+            CURRENT_DOCUMENT.reset(token)
+
+    def admit(self, provider, model, estimated_tokens, document=None, wait=True):
+        """
+        Wait until a call fits the quotas of its model, then reserve its tokens.
+
+        Args:
+            provider: "openai" or "gemini"
+            model: Model name
+            estimated_tokens: Estimated prompt plus completion tokens
+            document: Queue of the call (defaults to the current document)
+            wait: False raises RateLimitExceeded instead of waiting when the call
+                cannot be admitted at once
+
+        Returns:
+            Reservation to pass to settle() once the actual usage is known
+        """
+        key = (provider, model)
+        document = document or CURRENT_DOCUMENT.get()
+        ticket = object()
+        start = time.monotonic()
+        with self._condition:
+            tokens, requests = self._buckets_for(key)
+            # A call larger than the whole budget is admitted once the bucket is full
+            amount = min(estimated_tokens, tokens.capacity)
+            queues = self._queues.setdefault(key, OrderedDict())
+            queues.setdefault(document, deque()).append(ticket)
+            while True:
+                head_document = next(iter(queues))
+                if queues[head_document][0] is ticket:
+                    delay = max(tokens.seconds_until(amount), requests.seconds_until(1))
+                    if delay <= 0:
+                        tokens.take(amount)
+                        requests.take(1)
+                        queues[document].popleft()
+                        # Round-robin: the document goes to the back of the line
+                        if queues[document]:
+                            queues.move_to_end(document)
+                        else:
+                            del queues[document]
+                        queued = time.monotonic() - start
+                        stats = self._stats[key]
+                        stats["admitted"] += 1
+                        stats["queued_seconds"] += queued
+                        stats["estimated_tokens"] += amount
+                        self._condition.notify_all()
+                        return Reservation(key, amount, document, queued)
+                else:
+                    delay = QUEUE_POLL_SECONDS
+                if not wait:
+                    queues[document].remove(ticket)
+                    if not queues[document]:
+                        del queues[document]
+                    self._condition.notify_all()
+                    raise RateLimitExceeded(f"{provider}/{model} quota exhausted", delay)
+                self._condition.wait(timeout=delay)
+
+    def settle(self, reservation, actual_tokens):
+        """Correct a reservation with the tokens the call actually used."""
+        if actual_tokens is None:
+            return
+        with self._condition:
+            tokens, _ = self._buckets_for(reservation.key)
+            tokens.adjust(reservation.tokens - actual_tokens)
+            self._stats[reservation.key]["actual_tokens"] += actual_tokens
+            self._condition.notify_all()
+
+    def release(self, reservation, sent=True):
+        """
+        Return the tokens of a call that failed, since the provider billed none.
+
+        A call that was never sent (no request slot) also returns its request.
+        """
+        with self._condition:
+            tokens, requests = self._buckets_for(reservation.key)
+            tokens.adjust(reservation.tokens)
+            if not sent:
+                requests.adjust(1)
+            self._stats[reservation.key]["released"] += 1
+            self._condition.notify_all()
+
+    def throttled(self, provider, model, retry_after=None):
+        """Stop admitting calls for a model after the provider rejected one with a 429."""
+        key = (provider, model)
+        with self._condition:
+            tokens, requests = self._buckets_for(key)
+            tokens.drain(retry_after or 0.0)
+            requests.drain(retry_after or 0.0)
+            self._stats[key]["throttled"] += 1
+        logger.warning(f"{provider}/{model} rate limited by the provider; admissions paused")
+
+    def stats(self):
+        """
+        Admission statistics per model.
+
+        Returns:
+            Dictionary {"provider/model": {"admitted", "queued_seconds", "estimated_tokens",
+            "actual_tokens", "throttled", "released", "waiting", "tokens_available"}}
+        """
+        with self._condition:
+            result = {}
+            for key, stats in self._stats.items():
+                tokens, _ = self._buckets_for(key)
+                tokens.adjust(0)
+                entry = dict(stats)
+                entry["queued_seconds"] = round(entry["queued_seconds"], 3)
+                entry["waiting"] = sum(len(queue) for queue in self._queues.get(key, {}).values())
+                entry["tokens_available"] = int(tokens.level)
+                result["/".join(key)] = entry
+            return result
+
+
+# Shared so every call of the process draws from the same quotas
+LLM_SCHEDULER = LLMScheduler()
@@ -0,0 +1,73 @@
+import os
+import time
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Total compressed bytes kept in memory
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Seconds a cached page stays valid
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", str(24 * 60 * 60)))
+COMPRESSION_LEVEL = 6
+
+
+class PageCache:
+    """
+    In-memory cache of the cleaned text of fetched web pages, keyed by URL.
+
+    Texts are stored zlib-compressed in an LRU bounded by total compressed size, and
+    expire after a TTL so pages that change are eventually fetched again.
+    """
+
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES, ttl=PAGE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # url -> (expires_at, compressed text)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, url):
+        _, data = self._entries.pop(url)
+        self._size -= len(data)
+
+    def get(self, url):
+        """Return the cached text of a URL, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._evict(url)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            data = entry[1]
+        return zlib.decompress(data).decode('utf-8')
+
+    def put(self, url, text):
+        """Cache the cleaned text of a URL."""
+        data = zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if url in self._entries:
+                self._evict(url)
+            self._entries[url] = (time.time() + self.ttl, data)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def stats(self):
+        """Return entry count, compressed size and hit/miss counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,213 @@
+import re
+import time
+import random
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Words per shingle; short enough for phrases of a dozen words to yield several shingles
+PHRASE_SHINGLE_SIZE = 3
+# Extra shingle positions allowed in a matching window beyond the phrase length,
+# so a passage with a few inserted or changed words still counts as one window
+WINDOW_SLACK = 4
+# Characters of context reported around the best window
+CONTEXT_CHARS = 100
+
+WORD_PATTERN = re.compile(r'\w+')
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SHINGLE_MULTIPLIER = np.uint64(0x100000001B3)
+_SHINGLE_FINALIZER = np.uint64(0xBF58476D1CE4E5B9)
+
+
+def shingle_text(text, size=PHRASE_SHINGLE_SIZE):
+    """
+    Hash the word shingles of a text.
+
+    Each distinct word is hashed once and the word hashes of every shingle are combined
+    with vectorized polynomial mixing, so a page costs one hash per distinct word
+    rather than one per shingle. The hashes only need to agree within one process;
+    they are never stored.
+
+    Returns:
+        Tuple (hashes, starts, ends) of numpy arrays: the 32-bit hash of each shingle
+        and the character span it covers in the original text
+    """
+    words, starts, ends = [], [], []
+    for match in WORD_PATTERN.finditer(text or ''):
+        words.append(match.group(0).lower())
+        starts.append(match.start())
+        ends.append(match.end())
+
+    count = len(words) - size + 1
+    if count <= 0:
+        empty = np.zeros(0, dtype=np.uint32)
+        return empty, empty.astype(np.int64), empty.astype(np.int64)
+
+    word_hashes = {}
+    for word in words:
+        if word not in word_hashes:
+            word_hashes[word] = int.from_bytes(
+                hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+    values = np.fromiter((word_hashes[word] for word in words), dtype=np.uint64, count=len(words))
+    # uint64 arithmetic wraps around
+    mixed = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        mixed = mixed * _SHINGLE_MULTIPLIER + values[offset:offset + count]
+    mixed ^= mixed >> np.uint64(29)
+    mixed *= _SHINGLE_FINALIZER
+    mixed ^= mixed >> np.uint64(32)
+    hashes = (mixed & _MAX_HASH).astype(np.uint32)
+    return hashes, np.asarray(starts[:count], dtype=np.int64), np.asarray(ends[size - 1:], dtype=np.int64)
+
+
+class PageMatcher:
+    """
+    Scores search phrases against fetched pages with hashed word shingles.
+
+    The shingles of every page are hashed once and kept in one sorted array. For each
+    phrase, the occurrences of its shingles in all pages are found with a single
+    searchsorted, and the densest window of occurrences per page is located with
+    vectorized operations. The similarity is the share of the phrase's shingles that
+    appear in that window, which says how much of the phrase a page reproduces,
+    independent of the page length.
+    """
+
+    def __init__(self, page_texts):
+        """
+        Args:
+            page_texts: Dictionary {url: cleaned page text}
+        """
+        self.urls = []
+        self.texts = []
+        self._starts = []
+        self._ends = []
+        hashes, page_ids, positions = [], [], []
+        for url, text in page_texts.items():
+            page_hashes, starts, ends = shingle_text(text, PHRASE_SHINGLE_SIZE)
+            if not len(page_hashes):
+                continue
+            page_id = len(self.urls)
+            self.urls.append(url)
+            self.texts.append(text)
+            self._starts.append(starts)
+            self._ends.append(ends)
+            hashes.append(page_hashes)
+            page_ids.append(np.full(len(page_hashes), page_id, dtype=np.int64))
+            positions.append(np.arange(len(page_hashes), dtype=np.int64))
+
+        if hashes:
+            all_hashes = np.concatenate(hashes)
+            order = np.argsort(all_hashes, kind='stable')
+            self._hashes = all_hashes[order]
+            self._page_ids = np.concatenate(page_ids)[order]
+            self._positions = np.concatenate(positions)[order]
+            self._position_span = int(self._positions.max()) + 1
+        else:
+            self._hashes = np.zeros(0, dtype=np.uint32)
+            self._page_ids = self._positions = np.zeros(0, dtype=np.int64)
+            self._position_span = 1
+        logger.info(f"Indexed {len(self._hashes)} shingles from {len(self.urls)} pages")
+
+    def match(self, phrase):
+        """
+        Score a phrase against every page.
+
+        Returns:
+            Dictionary {url: {"similarity", "start", "end", "matched_content"}} for the
+            pages sharing at least one shingle with the phrase; start/end are the
+            character offsets of the best-matching window in the page text
+        """
+        phrase_hashes = np.unique(shingle_text(phrase, PHRASE_SHINGLE_SIZE)[0])
+        if not len(phrase_hashes) or not len(self._hashes):
+            return {}
+
+        # Every occurrence of every phrase shingle across all pages
+        lower = np.searchsorted(self._hashes, phrase_hashes, side='left')
+        upper = np.searchsorted(self._hashes, phrase_hashes, side='right')
+        counts = upper - lower
+        if not counts.any():
+            return {}
+        hits = lower[np.repeat(np.arange(len(lower)), counts)] + (
+            np.arange(counts.sum()) - np.repeat(counts.cumsum() - counts, counts)
+        )
+        hit_pages = self._page_ids[hits]
+        hit_positions = self._positions[hits]
+        hit_shingles = self._hashes[hits]
+
+        # Sort hits by (page, position); the window size is added to a key that leaves a
+        # gap between pages, so windows never run into the next page
+        window = len(phrase_hashes) + WINDOW_SLACK
+        keys = hit_pages * (self._position_span + window) + hit_positions
+        order = np.argsort(keys, kind='stable')
+        keys, hit_pages, hit_positions, hit_shingles = keys[order], hit_pages[order], hit_positions[order], hit_shingles[order]
+
+        # Occurrences inside the window starting at each hit, and the densest window per page
+        window_counts = np.searchsorted(keys, keys + window, side='left') - np.arange(len(keys))
+        page_starts = np.flatnonzero(np.concatenate(([True], hit_pages[1:] != hit_pages[:-1])))
+        best_counts = np.maximum.reduceat(window_counts, page_starts)
+
+        results = {}
+        page_ends = np.append(page_starts[1:], len(keys))
+        for page_start, page_end, best_count in zip(page_starts, page_ends, best_counts):
+            page_window_counts = window_counts[page_start:page_end]
+            first = page_start + int(np.argmax(page_window_counts == best_count))
+            last = first + int(best_count) - 1
+            # Repeated shingles inside the window count once
+            similarity = len(np.unique(hit_shingles[first:last + 1])) / len(phrase_hashes)
+
+            page_id = int(hit_pages[first])
+            start = int(self._starts[page_id][hit_positions[first]])
+            end = int(self._ends[page_id][hit_positions[last]])
+            text = self.texts[page_id]
+            context_start = max(0, start - CONTEXT_CHARS)
+            context_end = min(len(text), end + CONTEXT_CHARS)
+            results[self.urls[page_id]] = {
+                "similarity": round(min(1.0, similarity), 4),
+                "start": start,
+                "end": end,
+                "matched_content": ("..." if context_start else "") + text[context_start:context_end] +
+                                   ("..." if context_end < len(text) else "")
+            }
+        return results
+
+
+def benchmark(page_count=25, page_words=20000, phrase_count=5, seed=3):
+    """Compare per-pair TF-IDF cosine with the shingle matcher on synthetic pages."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    rng = random.Random(seed)
+    vocabulary = [f"term{n}" for n in range(5000)]
+    pages = {f"https://example.org/{n}": " ".join(rng.choice(vocabulary) for _ in range(page_words))
+             for n in range(page_count)}
+    source = pages["https://example.org/0"].split()
+    phrases = [" ".join(source[offset:offset + 25]) for offset in (100, 5000, 9000)]
+    phrases += [" ".join(rng.choice(vocabulary) for _ in range(25)) for _ in range(phrase_count - len(phrases))]
+
+    start = time.perf_counter()
+    for phrase in phrases:
+        for text in pages.values():
+            tfidf_matrix = TfidfVectorizer().fit_transform([phrase, text])
+            cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])
+    tfidf_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = PageMatcher(pages)
+    scores = [matcher.match(phrase) for phrase in phrases]
+    matcher_seconds = time.perf_counter() - start
+
+    print(f"{phrase_count} phrases x {page_count} pages of {page_words} words")
+    print(f"Per-pair TF-IDF:  {tfidf_seconds:.2f}s")
+    print(f"Shingle matcher:  {matcher_seconds:.2f}s")
+    for phrase_scores in scores:
+        best = max(phrase_scores.items(), key=lambda item: item[1]["similarity"], default=(None, None))
+        if best[0]:
+            print(f"  best page {best[0]}: similarity {best[1]['similarity']} at {best[1]['start']}-{best[1]['end']}")
+        else:
+            print("  no shared shingles")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,347 @@
+import os
+import re
+import math
+import sqlite3
+import hashlib
+import logging
+import threading
+from section_parser import SectionParser
+
+logger = logging.getLogger(__name__)
+
+PHRASE_CORPUS_PATH = os.getenv(
+    "PHRASE_CORPUS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "phrase_corpus.sqlite3")
+)
+# Corpus used when a document is not tied to a course
+DEFAULT_CORPUS = "__global__"
+
+# Probe budget: one probe per WORDS_PER_PROBE words, within [MIN_PROBES, MAX_PROBES]
+WORDS_PER_PROBE = 800
+MIN_PROBES = 3
+MAX_PROBES = 12
+# Candidate sentences must have this many words; longer ones are cut for the search query
+MIN_PHRASE_WORDS = 8
+MAX_PHRASE_WORDS = 32
+# Selected phrases are at least this many sentences apart, so probes cover the document
+MIN_SENTENCE_GAP = 3
+# Sentences found in this many other documents of the corpus are template text
+TEMPLATE_SENTENCE_DOCUMENTS = 3
+# Sentences where this share of the words comes from template headings are skipped
+MAX_TEMPLATE_WORD_SHARE = 0.5
+
+SENTENCE_PATTERN = re.compile(r'[^.!?]+(?:[.!?]+|$)')
+# Numbered heading lines such as "3.2 System Overview"
+NUMBERED_HEADING_PATTERN = re.compile(r'^\s*\d+(?:\.\d+)*\.?\s+\S')
+MAX_HEADING_WORDS = 10
+# Words split across lines by PDF hyphenation ("imple-\nmentation")
+HYPHENATION_PATTERN = re.compile(r'(\w)-\n\s*(\w)')
+# Everything after the last references header is the bibliography, which is not probed
+REFERENCES_HEADER_PATTERN = re.compile(r'^\s*(?:\d+\s+)?(?:References|Bibliography|Works Cited)\s*$',
+                                       re.IGNORECASE | re.MULTILINE)
+# Sentences where more than this share of the words are capitalized or numeric are
+# table rows, names or citations rather than prose
+MAX_CAPITALIZED_SHARE = 0.5
+TERM_PATTERN = re.compile(r'[a-z][a-z\-]{2,}')
+WORD_PATTERN = re.compile(r'\S+')
+STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "her", "was",
+    "one", "our", "out", "has", "his", "how", "its", "may", "new", "now", "see", "who", "did",
+    "this", "that", "with", "from", "they", "will", "would", "there", "their", "what", "which",
+    "when", "where", "been", "have", "into", "than", "then", "them", "these", "those", "such",
+    "also", "each", "other", "some", "more", "most", "only", "over", "very", "should", "could",
+    "about", "after", "before", "between", "through", "while", "being", "both", "must", "shall",
+    "using", "used", "use", "able", "well", "within", "without", "upon", "via"
+}
+
+
+def _template_headings():
+    """Normalized section headings of every predefined document structure."""
+    headings = set()
+
+    def collect(structure):
+        for title, children in structure.items():
+            headings.add(SectionParser.strip_numbering(title))
+            collect(children)
+
+    for structure in SectionParser.PREDEFINED_STRUCTURES.values():
+        collect(structure)
+    return headings
+
+
+TEMPLATE_HEADINGS = _template_headings()
+TEMPLATE_WORDS = {word for heading in TEMPLATE_HEADINGS for word in TERM_PATTERN.findall(heading)} - STOPWORDS
+
+
+def is_heading_line(line):
+    """True for template headings and short numbered heading lines."""
+    stripped = line.strip()
+    if not stripped:
+        return False
+    if SectionParser.strip_numbering(stripped) in TEMPLATE_HEADINGS:
+        return True
+    return bool(NUMBERED_HEADING_PATTERN.match(stripped)) and len(stripped.split()) <= MAX_HEADING_WORDS \
+        and not stripped.endswith('.')
+
+
+def content_terms(text):
+    """Lower-cased content words of a text (stopwords and short tokens removed)."""
+    return [term for term in TERM_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+def sentence_key(sentence):
+    """Stable hash of a sentence, insensitive to case, spacing and punctuation."""
+    normalized = " ".join(TERM_PATTERN.findall(sentence.lower()))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def probe_budget(text):
+    """Number of search probes for a document, scaled with its length."""
+    words = len(WORD_PATTERN.findall(text or ''))
+    return max(MIN_PROBES, min(MAX_PROBES, math.ceil(words / WORDS_PER_PROBE)))
+
+
+class PhraseSelector:
+    """
+    Deterministic selection of the most distinctive sentences of a document.
+
+    Sentences are ranked by the mean inverse document frequency of their content words
+    against a per-course corpus of earlier documents, so phrases specific to this
+    submission are searched instead of wording every student shares. Template headings
+    and sentences that recur across the course are excluded. The same text and corpus
+    always yield the same phrases.
+    """
+
+    def __init__(self, path=PHRASE_CORPUS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.available = True
+        try:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS corpus_documents (corpus TEXT PRIMARY KEY, documents INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS term_frequencies ("
+                "corpus TEXT NOT NULL, term TEXT NOT NULL, documents INTEGER NOT NULL, PRIMARY KEY (corpus, term))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sentence_frequencies ("
+                "corpus TEXT NOT NULL, sentence TEXT NOT NULL, documents INTEGER NOT NULL, PRIMARY KEY (corpus, sentence))"
+            )
+            # Documents already counted, by content hash, so re-checking one never counts it again
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS corpus_members ("
+                "corpus TEXT NOT NULL, document TEXT NOT NULL, PRIMARY KEY (corpus, document))"
+            )
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            # Without the corpus, sentences are ranked by their rarity within the document
+            logger.error(f"Phrase corpus unavailable: {str(e)}")
+            self.available = False
+
+    @staticmethod
+    def split_sentences(text):
+        """
+        Split text into sentences with whitespace collapsed, in document order.
+
+        Heading lines are dropped first so they do not run into the following sentence.
+        """
+        text = text or ''
+        headers = list(REFERENCES_HEADER_PATTERN.finditer(text))
+        if headers:
+            text = text[:headers[-1].start()]
+        text = HYPHENATION_PATTERN.sub(r'\1\2', text)
+        body = "\n".join(line for line in text.splitlines() if not is_heading_line(line))
+        sentences = []
+        for match in SENTENCE_PATTERN.finditer(body):
+            sentence = " ".join(match.group(0).split())
+            if sentence:
+                sentences.append(sentence)
+        return sentences
+
+    @classmethod
+    def _document_features(cls, text):
+        """(content hash, content terms, sentence keys) a document contributes to a corpus."""
+        terms = set(content_terms(text or ''))
+        sentences = {sentence_key(sentence) for sentence in cls.split_sentences(text)
+                     if len(WORD_PATTERN.findall(sentence)) >= MIN_PHRASE_WORDS}
+        digest = hashlib.sha1(" ".join(TERM_PATTERN.findall((text or '').lower())).encode('utf-8')).hexdigest()
+        return digest, terms, sentences
+
+    def _is_member(self, corpus, digest):
+        if not self.available:
+            return False
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM corpus_members WHERE corpus = ? AND document = ?", (corpus, digest)
+            ).fetchone() is not None
+
+    def add_document(self, text, corpus=None):
+        """
+        Count the terms and sentences of a document into a corpus.
+
+        Returns:
+            False when the same content was already counted into the corpus, or
+            the corpus is unavailable
+        """
+        if not self.available:
+            return False
+        corpus = str(corpus) if corpus else DEFAULT_CORPUS
+        digest, terms, sentences = self._document_features(text)
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(
+                "INSERT OR IGNORE INTO corpus_members (corpus, document) VALUES (?, ?)", (corpus, digest)
+            )
+            if not cursor.rowcount:
+                self._conn.rollback()
+                return False
+            cursor.execute(
+                "INSERT INTO corpus_documents (corpus, documents) VALUES (?, 1) "
+                "ON CONFLICT(corpus) DO UPDATE SET documents = documents + 1", (corpus,)
+            )
+            cursor.executemany(
+                "INSERT INTO term_frequencies (corpus, term, documents) VALUES (?, ?, 1) "
+                "ON CONFLICT(corpus, term) DO UPDATE SET documents = documents + 1",
+                [(corpus, term) for term in terms]
+            )
+            cursor.executemany(
+                "INSERT INTO sentence_frequencies (corpus, sentence, documents) VALUES (?, ?, 1) "
+                "ON CONFLICT(corpus, sentence) DO UPDATE SET documents = documents + 1",
+                [(corpus, key) for key in sentences]
+            )
+            self._conn.commit()
+        return True
+
+    def _frequencies(self, table, column, corpus, keys):
+        frequencies = {}
+        if not self.available:
+            return frequencies
+        keys = list(keys)
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT {column}, documents FROM {table} WHERE corpus = ? "
+                    f"AND {column} IN ({','.join('?' * len(chunk))})",
+                    [corpus] + chunk
+                ).fetchall()
+                frequencies.update(rows)
+        return frequencies
+
+    def rank_sentences(self, text, corpus=None):
+        """
+        Rank the candidate sentences of a document by distinctiveness.
+
+        Returns:
+            List of {"phrase", "index", "score"} sorted by descending score (ties keep
+            document order); index is the sentence position in the document
+        """
+        corpus = str(corpus) if corpus else DEFAULT_CORPUS
+        sentences = self.split_sentences(text)
+        candidates = []
+        for index, sentence in enumerate(sentences):
+            words = WORD_PATTERN.findall(sentence)
+            if len(words) < MIN_PHRASE_WORDS:
+                continue
+            if sum(word[0].isupper() or word[0].isdigit() for word in words) / len(words) > MAX_CAPITALIZED_SHARE:
+                continue
+            terms = content_terms(sentence)
+            # Tables, tables of contents and lists of numbers carry too few words
+            if len(terms) < MIN_PHRASE_WORDS // 2:
+                continue
+            if sum(term in TEMPLATE_WORDS for term in terms) / len(terms) > MAX_TEMPLATE_WORD_SHARE:
+                continue
+            candidates.append((index, sentence, terms))
+        if not candidates:
+            return []
+
+        row = None
+        if self.available:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT documents FROM corpus_documents WHERE corpus = ?", (corpus,)
+                ).fetchone()
+        document_count = row[0] if row else 0
+        term_frequencies = self._frequencies(
+            "term_frequencies", "term", corpus, {term for _, _, terms in candidates for term in terms}
+        )
+        sentence_frequencies = self._frequencies(
+            "sentence_frequencies", "sentence", corpus, {sentence_key(sentence) for _, sentence, _ in candidates}
+        )
+        # A document already in the corpus is ranked against the other documents only,
+        # so checking it again gives the same phrases
+        digest, own_terms, own_sentences = self._document_features(text)
+        if self._is_member(corpus, digest):
+            document_count -= 1
+            for term in own_terms & term_frequencies.keys():
+                term_frequencies[term] -= 1
+            for key in own_sentences & sentence_frequencies.keys():
+                sentence_frequencies[key] -= 1
+        # Rarity within the document itself keeps the ranking meaningful while the
+        # course corpus is still small
+        sentence_count = len(sentences)
+        local_frequencies = {}
+        for _, _, terms in candidates:
+            for term in set(terms):
+                local_frequencies[term] = local_frequencies.get(term, 0) + 1
+
+        ranked = []
+        for index, sentence, terms in candidates:
+            if sentence_frequencies.get(sentence_key(sentence), 0) >= TEMPLATE_SENTENCE_DOCUMENTS:
+                continue
+            unique_terms = set(terms)
+            idf = sum(
+                math.log((document_count + 1) / (term_frequencies.get(term, 0) + 1)) + 1 +
+                math.log((sentence_count + 1) / (local_frequencies[term] + 1))
+                for term in unique_terms
+            ) / len(unique_terms)
+            # Favour sentences with enough distinct content words to make a specific query
+            score = idf * min(1.0, len(unique_terms) / MIN_PHRASE_WORDS)
+            phrase = " ".join(WORD_PATTERN.findall(sentence)[:MAX_PHRASE_WORDS])
+            ranked.append({"phrase": phrase, "index": index, "score": round(score, 6)})
+
+        ranked.sort(key=lambda item: (-item["score"], item["index"]))
+        return ranked
+
+    def select(self, text, corpus=None, count=None):
+        """
+        Select the phrases to probe for a document.
+
+        Args:
+            text: Document text
+            corpus: Course id whose corpus provides the document frequencies
+            count: Number of phrases; defaults to probe_budget(text)
+
+        Returns:
+            List of phrases in rank order, spread at least MIN_SENTENCE_GAP sentences apart
+        """
+        count = count or probe_budget(text)
+        selected = []
+        for candidate in self.rank_sentences(text, corpus):
+            if all(abs(candidate["index"] - chosen["index"]) >= MIN_SENTENCE_GAP for chosen in selected):
+                selected.append(candidate)
+                if len(selected) >= count:
+                    break
+        return [candidate["phrase"] for candidate in selected]
+
+
+if __name__ == "__main__":
+    # Checking the same document repeatedly must neither count it again nor change its phrases
+    selector = PhraseSelector(":memory:")
+    sample = " ".join(
+        f"The {topic} module validates every submitted record against the course schema before it is stored."
+        for topic in ("billing", "grading", "scheduling", "reporting", "enrolment", "messaging", "auditing")
+    )
+    runs = []
+    for _ in range(5):
+        runs.append(selector.select(sample, "course-1"))
+        selector.add_document(sample, "course-1")
+    assert all(run == runs[0] for run in runs), runs
+    assert runs[0], "no phrases selected"
+    print(f"{len(runs)} checks selected the same {len(runs[0])} phrases")
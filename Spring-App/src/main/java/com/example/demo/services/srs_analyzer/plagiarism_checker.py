@@ -0,0 +1,233 @@
+import time
+import logging
+import threading
+from web_fetcher import WebFetcher
+from page_cache import PageCache
+from page_matcher import PageMatcher
+from phrase_selector import PhraseSelector
+
+logger = logging.getLogger(__name__)
+
+# Results where more than this share of the phrase's shingles appear in one window of
+# the page are reported as matches
+SIMILARITY_THRESHOLD = 0.3
+# Phrases are probed in rounds of this size, most distinctive first
+PROBE_ROUND_SIZE = 3
+# Probing stops once this many phrases have a match at or above STRONG_MATCH_SIMILARITY
+EVIDENCE_PHRASES = 2
+STRONG_MATCH_SIMILARITY = 0.6
+
+# Shared by all checks so connections stay pooled between requests
+FETCHER = WebFetcher()
+# Cleaned page texts shared across checks (students' phrases often lead to the same pages)
+PAGE_CACHE = PageCache()
+# Course corpora used to rank phrases by distinctiveness
+PHRASE_SELECTOR = PhraseSelector()
+
+
+def search_google(query, fetcher=None):
+    """Search for a phrase and return up to five {"title", "link"} results."""
+    return (fetcher or FETCHER).search(query)
+
+
+def fetch_page_texts(links, fetcher=None, page_cache=None):
+    """
+    Return the cleaned text of every page, from the cache when possible.
+
+    Only cache misses are downloaded (concurrently) and parsed; their text is cached.
+
+    Returns:
+        Dictionary {link: text}; pages that could not be fetched map to ""
+    """
+    fetcher = fetcher or FETCHER
+    page_cache = page_cache or PAGE_CACHE
+
+    page_texts = {}
+    missing = []
+    for link in dict.fromkeys(links):
+        cached = page_cache.get(link)
+        if cached is None:
+            missing.append(link)
+        else:
+            page_texts[link] = cached
+
+    for link, page in fetcher.fetch_many(missing).items():
+        if page["text"] and page["status"] == 200:
+            page_texts[link] = fetcher.page_text(page["text"])
+            page_cache.put(link, page_texts[link])
+        else:
+            page_texts[link] = ""
+
+    logger.info(f"Page texts: {len(page_texts) - len(missing)} from cache, {len(missing)} fetched")
+    return page_texts
+
+
+def _score_phrases(phrases, fetcher, page_cache):
+    """Search a round of phrases and score them against their result pages."""
+    results_per_phrase = fetcher.search_many(phrases)
+    page_texts = fetch_page_texts(
+        [result["link"] for results in results_per_phrase for result in results],
+        fetcher, page_cache
+    )
+    matcher = PageMatcher({link: content for link, content in page_texts.items() if content})
+
+    matches = []
+    search_results = []
+    for phrase, results in zip(phrases, results_per_phrase):
+        if not results:
+            logger.info(f"No search results found for phrase: '{phrase}'")
+            continue
+        search_url = fetcher.search_url(phrase)
+        scores = matcher.match(phrase)
+
+        for result in results:
+            link = result["link"]
+            content = page_texts.get(link, "")
+            if not content:
+                continue
+
+            score = scores.get(link)
+            similarity = score["similarity"] if score else 0.0
+            # Best-matching passage with some context, or the start of the page
+            matched_content = score["matched_content"] if score else content[:500] + "..."
+            match_start = score["start"] if score else None
+            match_end = score["end"] if score else None
+
+            # Add to search results regardless of similarity
+            search_results.append({
+                "query": phrase,
+                "search_url": search_url,
+                "url": link,
+                "title": result["title"],
+                "similarity": float(similarity),
+                "matched_content": matched_content,
+                "match_start": match_start,
+                "match_end": match_end
+            })
+
+            if similarity > SIMILARITY_THRESHOLD:
+                matches.append({
+                    "phrase": phrase,
+                    "similarity": float(similarity),
+                    "url": link,
+                    "title": result["title"],
+                    "matched_content": matched_content,
+                    "match_start": match_start,
+                    "match_end": match_end
+                })
+    return search_results, matches
+
+
+def check_plagiarism(text, course_id=None, fetcher=None, page_cache=None, phrase_selector=None):
+    """
+    Check for plagiarism in the given text.
+
+    The most distinctive sentences of the document (see PhraseSelector) are probed in
+    rounds, with a budget that grows with document length. Each round searches its
+    phrases concurrently, fetches the distinct result pages concurrently (unless
+    cached) and scores the phrases with the PageMatcher. Probing stops early once
+    EVIDENCE_PHRASES phrases have strong matches.
+
+    Args:
+        text: Document text
+        course_id: Course whose corpus ranks the phrases (the document is added to it)
+    """
+    fetcher = fetcher or FETCHER
+    phrase_selector = phrase_selector or PHRASE_SELECTOR
+    try:
+        logger.info("Starting plagiarism check")
+        start = time.perf_counter()
+
+        candidates = phrase_selector.select(text, course_id)
+        phrase_selector.add_document(text, course_id)
+        logger.info(f"Selected {len(candidates)} phrases to probe")
+
+        phrases = []
+        matches = []
+        search_results = []
+        strong_phrases = set()
+        for round_start in range(0, len(candidates), PROBE_ROUND_SIZE):
+            round_phrases = candidates[round_start:round_start + PROBE_ROUND_SIZE]
+            phrases.extend(round_phrases)
+            round_results, round_matches = _score_phrases(round_phrases, fetcher, page_cache)
+            search_results.extend(round_results)
+            matches.extend(round_matches)
+            strong_phrases.update(match["phrase"] for match in round_matches
+                                  if match["similarity"] >= STRONG_MATCH_SIMILARITY)
+            if len(strong_phrases) >= EVIDENCE_PHRASES:
+                logger.info(f"Stopping after {len(phrases)} of {len(candidates)} probes: "
+                            f"{len(strong_phrases)} phrases with strong matches")
+                break
+
+        logger.info(f"Plagiarism check complete: {len(phrases)} phrases, {len(search_results)} results, "
+                    f"{len(matches)} matches in {time.perf_counter() - start:.2f}s")
+
+        return {
+            "status": "success",
+            "total_phrases_checked": len(phrases),
+            "similar_matches_found": len(matches),
+            "phrases_checked": phrases,
+            "search_results": search_results,
+            "results": matches
+        }
+
+    except Exception as e:
+        logger.error(f"Error in plagiarism check: {str(e)}")
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+
+def _start_stand_in_server(latency=0.5):
+    """Serve fake search and result pages on localhost, each response delayed by `latency`."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            url = urlsplit(self.path)
+            if url.path == "/search":
+                query = parse_qs(url.query).get("q", [""])[0]
+                base = f"http://127.0.0.1:{self.server.server_port}"
+                body = "".join(
+                    f'<div class="g"><a href="{base}/page/{abs(hash(query)) % 3}/{i}">'
+                    f'<h3>Result {i}</h3></a></div>' for i in range(5)
+                )
+            else:
+                body = f"<p>{'Sentence 7 about requirements engineering for student projects. ' * 50}</p>"
+            payload = f"<html><body>{body}</body></html>".encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 64
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # Time two checks against a local stand-in with 0.5s per response; the second one
+    # finds the result pages in the page cache
+    server = _start_stand_in_server()
+    fetcher = WebFetcher(search_url_template=f"http://127.0.0.1:{server.server_port}/search?q={{query}}",
+                         per_host_limit=16)
+    selector = PhraseSelector(":memory:")
+    sample = ". ".join(f"Sentence {n} about requirements engineering for student projects" for n in range(40))
+    for run in (1, 2):
+        start = time.perf_counter()
+        report = check_plagiarism(sample, fetcher=fetcher, phrase_selector=selector)
+        print(f"Run {run}: checked {report['total_phrases_checked']} phrases, {len(report['search_results'])} "
+              f"results, {report['similar_matches_found']} matches in {time.perf_counter() - start:.2f}s")
+        print(f"  phrases: {report['phrases_checked']}")
+    print(f"Page cache: {PAGE_CACHE.stats()}")
+    server.shutdown()
@@ -0,0 +1,302 @@
+import os
+import time
+import socket
+import hashlib
+import logging
+import threading
+from urllib.parse import urlsplit
+from rate_limiter import LocalBucketStorage
+
+logger = logging.getLogger(__name__)
+
+# Shared store for rate limits, e.g. "redis://localhost:6379/0"; unset keeps the
+# limits per process. Also used as the flask-limiter storage. Needs Redis 4.0 or later
+# (multi-field HSET in TOKEN_BUCKET_SCRIPT).
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "")
+# Seconds a store command may take before the local buckets take over
+STORE_TIMEOUT = float(os.getenv("RATE_LIMIT_STORE_TIMEOUT", "0.25"))
+# Seconds before an unreachable store is tried again
+STORE_RETRY_INTERVAL = float(os.getenv("RATE_LIMIT_STORE_RETRY_INTERVAL", "5"))
+KEY_PREFIX = "srs_analyzer:bucket:"
+
+# Refill and take tokens in one atomic step. Returns {allowed, tokens left}.
+# The current time is passed by the caller (ARGV[4]) instead of read with TIME:
+# before Redis 5 a script that calls TIME and then writes is rejected unless it
+# enables effects replication. Worker clocks are therefore expected to be in sync;
+# an update from a clock running behind refills nothing and never moves the bucket's
+# time backwards.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(math.max(now, updated)))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+TOKEN_BUCKET_SHA = hashlib.sha1(TOKEN_BUCKET_SCRIPT.encode('utf-8')).hexdigest()
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol store."""
+
+
+class RespClient:
+    """
+    Minimal client for Redis-protocol (RESP) stores.
+
+    Each thread keeps its own connection, opened on first use and dropped after any
+    network error.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=STORE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url, timeout=STORE_TIMEOUT):
+        """Client for a redis://[:password@]host[:port][/db] URL."""
+        parts = urlsplit(url)
+        db = parts.path.strip("/")
+        return cls(parts.hostname or "localhost", parts.port or 6379, int(db) if db else 0,
+                   parts.password, timeout)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = (sock, sock.makefile("rb"))
+            self._local.connection = connection
+            if self.password:
+                self._execute(connection, "AUTH", self.password)
+            if self.db:
+                self._execute(connection, "SELECT", self.db)
+        return connection
+
+    def close(self):
+        """Close the calling thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection:
+            connection[1].close()
+            connection[0].close()
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the store")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RespError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the store: {line[:20]!r}")
+
+    def _execute(self, connection, *args):
+        sock, reader = connection
+        sock.sendall(self._encode(args))
+        return self._read(reader)
+
+    def execute(self, *args):
+        """Send one command and return its reply; raises RespError or OSError."""
+        try:
+            return self._execute(self._connection(), *args)
+        except OSError:
+            self.close()
+            raise
+
+
+class RespBucketStorage:
+    """
+    Token buckets kept in a Redis-protocol store, shared by every worker and node.
+
+    Each check runs TOKEN_BUCKET_SCRIPT, which refills and takes tokens atomically on
+    the store. When the store cannot be reached the check falls back to local buckets
+    and the store is tried again after STORE_RETRY_INTERVAL seconds, so requests are
+    never blocked on an unavailable store (limits are then enforced per process).
+    """
+
+    def __init__(self, client, fallback=None, retry_interval=STORE_RETRY_INTERVAL):
+        self.client = client
+        self.fallback = fallback if fallback is not None else LocalBucketStorage()
+        self.retry_interval = retry_interval
+        self._unavailable_until = 0.0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self._unavailable_until
+
+    def _evalsha(self, key, tokens_per_second, max_tokens, cost):
+        args = ("EVALSHA", TOKEN_BUCKET_SHA, 1, key, tokens_per_second, max_tokens, cost, repr(time.time()))
+        try:
+            return self.client.execute(*args)
+        except RespError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            self.client.execute("SCRIPT", "LOAD", TOKEN_BUCKET_SCRIPT)
+            return self.client.execute(*args)
+
+    def consume(self, key, tokens_per_second, max_tokens, cost=1):
+        """
+        Take `cost` tokens from the shared bucket (or the local one while the store is down).
+
+        Returns:
+            (allowed, tokens left)
+        """
+        if self.available:
+            try:
+                allowed, tokens = self._evalsha(KEY_PREFIX + key, tokens_per_second, max_tokens, cost)
+                return bool(allowed), float(tokens)
+            except (OSError, RespError, ValueError) as e:
+                self._unavailable_until = time.monotonic() + self.retry_interval
+                logger.warning(f"Rate limit store unavailable ({str(e)}); using local buckets "
+                               f"for {self.retry_interval:.0f}s")
+        return self.fallback.consume(key, tokens_per_second, max_tokens, cost)
+
+
+def storage_from_uri(uri=RATE_LIMIT_STORAGE_URI):
+    """Bucket storage for a storage URI: shared for redis:// URIs, local otherwise."""
+    if uri.startswith("redis://"):
+        return RespBucketStorage(RespClient.from_url(uri))
+    if uri:
+        logger.warning(f"Unsupported rate limit store for token buckets ({uri.split(':')[0]}); using local buckets")
+    return LocalBucketStorage()
+
+
+def limiter_storage_uri(uri=RATE_LIMIT_STORAGE_URI):
+    """flask-limiter storage URI: the shared store when configured, memory otherwise."""
+    return uri or "memory://"
+
+
+# Token buckets shared by the limiters of this process
+RATE_LIMIT_STORAGE = storage_from_uri()
+
+
+def _start_stand_in_store():
+    """
+    Serve a local stand-in for a Redis-protocol store.
+
+    It answers PING, AUTH, SELECT, SCRIPT LOAD and EVALSHA; EVALSHA of
+    TOKEN_BUCKET_SCRIPT runs a line-by-line Python transcription of the script (the
+    stand-in has no Lua interpreter), with the time the caller passes in ARGV[4].
+    """
+    import socketserver
+
+    buckets = {}
+    scripts = set()
+    lock = threading.Lock()
+
+    def token_bucket(key, rate, capacity, cost, now):
+        with lock:
+            tokens, updated = buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            allowed = 0
+            if tokens >= cost:
+                tokens -= cost
+                allowed = 1
+            buckets[key] = (tokens, max(now, updated))
+            return [allowed, repr(tokens)]
+
+    def encode(value):
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+        data = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def read_command(self):
+            line = self.rfile.readline()
+            if not line:
+                return None
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+            return args
+
+        def handle(self):
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                command = args[0].upper()
+                if command in ("PING", "AUTH", "SELECT"):
+                    reply = b"+OK\r\n" if command != "PING" else b"+PONG\r\n"
+                elif command == "SCRIPT":
+                    digest = hashlib.sha1(args[2].encode("utf-8")).hexdigest()
+                    scripts.add(digest)
+                    reply = encode(digest)
+                elif command == "EVALSHA" and args[1] in scripts:
+                    reply = encode(token_bucket(args[3], *(float(arg) for arg in args[4:8])))
+                elif command == "EVALSHA":
+                    reply = b"-NOSCRIPT No matching script\r\n"
+                else:
+                    reply = b"-ERR unknown command\r\n"
+                self.wfile.write(reply)
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    # Two "workers" with their own storage objects share one stand-in store, so the
+    # burst of 5 is enforced across both; then the store goes away and each worker
+    # falls back to its local buckets.
+    server = _start_stand_in_store()
+    uri = f"redis://127.0.0.1:{server.server_address[1]}/0"
+    workers = [storage_from_uri(uri), storage_from_uri(uri)]
+    allowed = sum(workers[n % 2].consume("client-1", 0.2, 5)[0] for n in range(10))
+    print(f"Shared store: {allowed} of 10 requests allowed across 2 workers (limit 5)")
+
+    start = time.perf_counter()
+    checks = 2000
+    for n in range(checks):
+        workers[0].consume(f"client-{n % 50}", 100, 100)
+    print(f"Shared store: {checks / (time.perf_counter() - start):.0f} checks/s from one thread")
+
+    server.shutdown()
+    server.server_close()
+    for worker in workers:
+        worker.client.close()
+    allowed = sum(workers[n % 2].consume("client-1", 0.2, 5)[0] for n in range(10))
+    print(f"Store down: {allowed} of 10 requests allowed (limit 5 per worker)")
@@ -1,7 +1,8 @@
 import random
 import time
+import asyncio
 from functools import wraps
-from collections import defaultdict
+from collections import OrderedDict
 import threading
 import logging
 
@@ -16,7 +17,7 @@ class TokenBucket:
         self.last_update = time.time()
         self.lock = threading.Lock()
 
-    def get_token(self):
+    def get_token(self, cost=1):
         with self.lock:
             now = time.time()
             # Add new tokens based on elapsed time
@@ -25,32 +26,274 @@ class TokenBucket:
             self.tokens = min(self.tokens + new_tokens, self.max_tokens)
             self.last_update = now
 
-            if self.tokens >= 1:
-                self.tokens -= 1
+            if self.tokens >= cost:
+                self.tokens -= cost
                 return True
             return False
 
-class RateLimiter:
-    """Rate limiter implementation with per-client tracking."""
+    def seconds_until_token(self):
+        """Seconds until the next token is available (0 if one is available now)."""
+        with self.lock:
+            tokens = min(self.tokens + (time.time() - self.last_update) * self.tokens_per_second, self.max_tokens)
+            if tokens >= 1:
+                return 0.0
+            return (1 - tokens) / self.tokens_per_second
+
+    def acquire(self, timeout=None):
+        """
+        Wait for a token.
+
+        Args:
+            timeout: Maximum seconds to wait (None waits indefinitely)
+
+        Returns:
+            True if a token was taken, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.get_token():
+            wait = self.seconds_until_token()
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            time.sleep(max(wait, 0.001))
+        return True
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff with a shared retry budget.
+
+    Delays use "full jitter" (uniform between 0 and the exponential cap) so concurrent
+    callers do not retry in lockstep. Every retry also takes a token from a TokenBucket,
+    which caps the retry rate across all callers sharing the policy and prevents retry
+    storms while a provider is overloaded.
+    """
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=20.0, retries_per_second=0.5, max_retry_burst=5):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = TokenBucket(tokens_per_second=retries_per_second, max_tokens=max_retry_burst)
+
+    def delay(self, attempt):
+        """Backoff before retry number `attempt` (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, func, is_retryable, on_retry=None, wait=True):
+        """
+        Call func, retrying when is_retryable(exception) is true.
+
+        Args:
+            func: Function without arguments
+            is_retryable: Predicate deciding whether an exception is transient
+            on_retry: Optional callback(attempt, exception, delay) invoked before sleeping
+            wait: False retries at once instead of sleeping (for request threads)
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_attempts - 1 or not is_retryable(e) or not self.budget.get_token():
+                    raise
+                delay = self.delay(attempt) if wait else 0.0
+                if on_retry:
+                    on_retry(attempt, e, delay)
+                if delay:
+                    time.sleep(delay)
+
+    async def call_async(self, func, is_retryable, on_retry=None):
+        """Like call() for a coroutine function; awaits between attempts instead of sleeping."""
+        for attempt in range(self.max_attempts):
+            try:
+                return await func()
+            except Exception as e:
+                if attempt >= self.max_attempts - 1 or not is_retryable(e) or not self.budget.get_token():
+                    raise
+                delay = self.delay(attempt)
+                if on_retry:
+                    on_retry(attempt, e, delay)
+                await asyncio.sleep(delay)
+
+class _Bucket:
+    """Token bucket state; updated under the lock of its shard."""
+    __slots__ = ("tokens", "updated", "blocked_until", "seen")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.blocked_until = 0.0
+        self.seen = now
+
+class _Shard:
+    __slots__ = ("lock", "buckets")
+
     def __init__(self):
-        self.clients = defaultdict(lambda: TokenBucket(tokens_per_second=0.2, max_tokens=5))  # 5 requests per 5 seconds
         self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # key -> _Bucket, oldest first
+
+class LocalBucketStorage:
+    """
+    Token buckets of this process only (see rate_limit_storage for shared storage).
+
+    Keys are spread over independently locked shards, so checks for different clients
+    rarely contend. A client whose bucket is empty is rejected without taking any lock
+    until its next token is due, which keeps floods from throttled clients cheap.
+    Buckets idle for longer than idle_ttl are dropped (an idle bucket has refilled, so
+    dropping it changes nothing), and each shard holds at most max_buckets / shards
+    buckets, evicting the least recently inserted idle ones first (second chance for
+    recently seen buckets, which approximates LRU without reordering on every check).
+    """
+    def __init__(self, shards=16, max_buckets=100000, idle_ttl=600.0):
+        self.shard_count = 1 << max(0, (shards - 1).bit_length())
+        self.shards = [_Shard() for _ in range(self.shard_count)]
+        self.max_per_shard = max(1, max_buckets // self.shard_count)
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+
+    def _evict(self, shard, now):
+        buckets = shard.buckets
+        # Amortized TTL sweep: look at the two oldest buckets on every insert
+        for _ in range(2):
+            key = next(iter(buckets))
+            if now - buckets[key].seen <= self.idle_ttl:
+                break
+            buckets.popitem(last=False)
+            self.evictions += 1
+        # Over capacity: evict the oldest bucket, giving recently seen ones a second chance
+        chances = 2
+        while len(buckets) > self.max_per_shard:
+            key = next(iter(buckets))
+            if chances and now - buckets[key].seen < self.idle_ttl / 10:
+                chances -= 1
+                buckets.move_to_end(key)
+                continue
+            buckets.popitem(last=False)
+            self.evictions += 1
+
+    def consume(self, key, tokens_per_second, max_tokens, cost=1):
+        """
+        Take `cost` tokens from the bucket of a key.
+
+        Returns:
+            (allowed, tokens left)
+        """
+        shard = self.shards[hash(key) & (self.shard_count - 1)]
+        bucket = shard.buckets.get(key)
+        now = time.monotonic()
+        # Fast path: the bucket was empty and no token is due yet
+        if bucket is not None and now < bucket.blocked_until:
+            return False, bucket.tokens
+
+        with shard.lock:
+            bucket = shard.buckets.get(key)
+            if bucket is None:
+                bucket = shard.buckets[key] = _Bucket(max_tokens, now)
+                self._evict(shard, now)
+            bucket.tokens = min(bucket.tokens + (now - bucket.updated) * tokens_per_second, max_tokens)
+            bucket.updated = now
+            bucket.seen = now
+            if bucket.tokens >= cost:
+                bucket.tokens -= cost
+                return True, bucket.tokens
+            bucket.blocked_until = now + (cost - bucket.tokens) / tokens_per_second
+            return False, bucket.tokens
+
+    def __len__(self):
+        return sum(len(shard.buckets) for shard in self.shards)
+
+class RateLimiter:
+    """Rate limiter implementation with per-client tracking."""
+    def __init__(self, storage=None, tokens_per_second=0.2, max_tokens=5):  # 5 requests per 5 seconds
+        self.storage = storage if storage is not None else LocalBucketStorage()
+        self.tokens_per_second = tokens_per_second
+        self.max_tokens = max_tokens
 
     def is_allowed(self, client_id):
-        with self.lock:
-            return self.clients[client_id].get_token()
+        allowed, _ = self.storage.consume(str(client_id), self.tokens_per_second, self.max_tokens)
+        return allowed
+
+    def check(self, client_id):
+        """
+        Take a token of a client without waiting.
+
+        Returns:
+            (allowed, seconds until the next token is due; 0 when allowed)
+        """
+        allowed, tokens = self.storage.consume(str(client_id), self.tokens_per_second, self.max_tokens)
+        if allowed:
+            return True, 0.0
+        return False, max((1 - tokens) / self.tokens_per_second, 0.001)
+
+    def acquire(self, client_id, timeout=None):
+        """
+        Wait for a token of a client.
+
+        Returns:
+            True if a token was taken, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            allowed, wait = self.check(client_id)
+            if allowed:
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
 
-def rate_limit(max_retries=3, initial_delay=1.0):
+    async def acquire_async(self, client_id, timeout=None):
+        """Like acquire(), awaiting instead of blocking the thread."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            allowed, wait = self.check(client_id)
+            if allowed:
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+class RateLimitExceeded(Exception):
+    """Raised instead of waiting when a rate limit is reached."""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def rate_limit(max_retries=3, initial_delay=1.0, storage=None):
     """
     Decorator to apply rate limiting with exponential backoff.
     Usage:
         @rate_limit(max_retries=3, initial_delay=1.0)
         def your_function():
             pass
+
+    Pass rate_limit_storage.RATE_LIMIT_STORAGE as storage to share the limit across workers.
+    Coroutine functions get a wrapper that awaits instead of sleeping.
     """
-    rate_limiter = RateLimiter()
+    rate_limiter = RateLimiter(storage=storage)
 
     def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                client_id = kwargs.get('client_id', 'default')
+                delay = initial_delay
+
+                for attempt in range(max_retries):
+                    allowed, wait = rate_limiter.check(client_id)
+                    if allowed:
+                        try:
+                            return await func(*args, **kwargs)
+                        except Exception as e:
+                            if "RATE_LIMIT_EXCEEDED" in str(e) and attempt < max_retries - 1:
+                                logger.warning(f"Rate limit exceeded. Retrying in {delay:.2f} seconds. Attempt {attempt + 1}/{max_retries}")
+                                await asyncio.sleep(delay + random.uniform(0, 1))
+                                delay *= 2
+                            else:
+                                raise
+                    else:
+                        # The bucket says when the next token is due
+                        logger.warning(f"Rate limit reached. Waiting {wait:.2f} seconds before retry. Attempt {attempt + 1}/{max_retries}")
+                        await asyncio.sleep(wait)
+
+                raise RateLimitExceeded("Rate limit exceeded after maximum retries", wait)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             client_id = kwargs.get('client_id', 'default')
@@ -84,22 +327,75 @@ def exponential_backoff(retries=3, initial_delay=1.0):
         @exponential_backoff(retries=3, initial_delay=1.0)
         def your_function():
             pass
+
+    Coroutine functions get a wrapper that awaits between attempts instead of sleeping.
     """
+    policy = RetryPolicy(max_attempts=retries, base_delay=initial_delay)
+
+    def on_retry(attempt, error, delay):
+        logger.warning(f"Rate limit exceeded. Retrying in {delay:.2f} seconds. Attempt {attempt + 1}/{retries}")
+
     def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_retry_function(*args, **kwargs):
+                return await policy.call_async(
+                    lambda: func(*args, **kwargs),
+                    lambda e: "RATE_LIMIT_EXCEEDED" in str(e),
+                    on_retry
+                )
+            return async_retry_function
+
         @wraps(func)
         def retry_function(*args, **kwargs):
-            delay = initial_delay
-            for attempt in range(retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    if "RATE_LIMIT_EXCEEDED" in str(e) and attempt < retries - 1:
-                        wait_time = delay + random.uniform(0, 1)  # Add jitter
-                        logger.warning(f"Rate limit exceeded. Retrying in {wait_time:.2f} seconds. Attempt {attempt + 1}/{retries}")
-                        time.sleep(wait_time)
-                        delay *= 2  # Double the delay
-                    else:
-                        raise
-            return func(*args, **kwargs)
+            return policy.call(
+                lambda: func(*args, **kwargs),
+                lambda e: "RATE_LIMIT_EXCEEDED" in str(e),
+                on_retry
+            )
         return retry_function
-    return decorate
\ No newline at end of file
+    return decorate
+
+def benchmark(threads=8, checks_per_thread=50000, clients=200000):
+    """Compare one global lock over a defaultdict with the sharded bucket storage."""
+    from collections import defaultdict
+    from concurrent.futures import ThreadPoolExecutor
+
+    class GlobalLockLimiter:
+        def __init__(self):
+            self.clients = defaultdict(lambda: TokenBucket(tokens_per_second=0.2, max_tokens=5))
+            self.lock = threading.Lock()
+
+        def is_allowed(self, client_id):
+            with self.lock:
+                return self.clients[client_id].get_token()
+
+    def run(limiter, client_ids):
+        def worker(offset):
+            for n in range(checks_per_thread):
+                limiter.is_allowed(client_ids[(offset * 7919 + n) % len(client_ids)])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(worker, range(threads)))
+        return threads * checks_per_thread / (time.perf_counter() - start)
+
+    print(f"{threads} threads x {checks_per_thread} checks")
+    scenarios = [
+        ("10000 active clients", [f"client-{n}" for n in range(10000)], 100000),
+        (f"{clients} clients, 50000 kept", [f"client-{n}" for n in range(clients)], 50000),
+        # A few hot clients that are mostly over their limit
+        ("16 throttled clients", [f"client-{n}" for n in range(16)], 100000),
+    ]
+    for name, client_ids, max_buckets in scenarios:
+        legacy = GlobalLockLimiter()
+        legacy_rate = run(legacy, client_ids)
+        sharded = RateLimiter(storage=LocalBucketStorage(max_buckets=max_buckets))
+        sharded_rate = run(sharded, client_ids)
+        print(f"{name}:")
+        print(f"  global lock: {legacy_rate:>9.0f} checks/s, {len(legacy.clients)} buckets kept")
+        print(f"  sharded:     {sharded_rate:>9.0f} checks/s, {len(sharded.storage)} buckets kept "
+              f"({sharded.storage.evictions} evicted)")
+
+if __name__ == "__main__":
+    benchmark()
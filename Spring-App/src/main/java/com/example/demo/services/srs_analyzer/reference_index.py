@@ -0,0 +1,279 @@
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import threading
+import unicodedata
+from fuzzywuzzy import fuzz
+
+logger = logging.getLogger(__name__)
+
+BIBLIOGRAPHIC_INDEX_PATH = os.getenv(
+    "BIBLIOGRAPHIC_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "bibliographic_index.sqlite3")
+)
+
+# A title match at or above this confidence counts as verified
+VERIFIED_CONFIDENCE = 0.85
+# Number of full-text candidates re-scored with fuzzy matching
+CANDIDATE_LIMIT = 10
+IMPORT_BATCH_SIZE = 5000
+
+DOI_PATTERN = re.compile(r'10\.\d{4,9}/[^\s"<>,;]+', re.IGNORECASE)
+YEAR_PATTERN = re.compile(r'\b(19|20)\d{2}\b')
+NON_WORD_PATTERN = re.compile(r'[^a-z0-9\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+STOPWORDS = {
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "of", "on",
+    "or", "the", "to", "via", "with", "using", "towards", "toward"
+}
+
+
+def normalize_doi(doi):
+    """Lower-case a DOI and strip resolver prefixes and trailing punctuation."""
+    if not doi:
+        return None
+    doi = doi.strip().lower()
+    doi = re.sub(r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)', '', doi)
+    return doi.rstrip('.)]}') or None
+
+
+def extract_doi(reference):
+    """Return the normalized DOI mentioned in a reference, if any."""
+    match = DOI_PATTERN.search(reference or '')
+    return normalize_doi(match.group(0)) if match else None
+
+
+def normalize_title(title):
+    """Normalize a title for matching: ASCII-fold, lower-case, drop punctuation."""
+    title = unicodedata.normalize('NFKD', title or '').encode('ascii', 'ignore').decode('ascii')
+    title = NON_WORD_PATTERN.sub(' ', title.lower())
+    return WHITESPACE_PATTERN.sub(' ', title).strip()
+
+
+class BibliographicIndex:
+    """
+    Offline bibliographic index used to verify references without network access.
+
+    Records (DOI, title, authors, year) are imported from a bibliographic dump into
+    SQLite. References are matched by exact DOI first and then by a full-text (FTS5)
+    search on the normalized title whose candidates are re-scored with fuzzy matching.
+    """
+
+    def __init__(self, path=BIBLIOGRAPHIC_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.available = True
+        self.fts_available = False
+        try:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS works ("
+                "id INTEGER PRIMARY KEY, doi TEXT UNIQUE, title TEXT NOT NULL, "
+                "norm_title TEXT NOT NULL, authors TEXT, year INTEGER)"
+            )
+            self.fts_available = True
+            try:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS works_fts USING fts5("
+                    "norm_title, content='works', content_rowid='id')"
+                )
+            except sqlite3.OperationalError as e:
+                # SQLite builds without FTS5 fall back to an indexed prefix scan
+                logger.warning(f"FTS5 not available, title search will be slower: {str(e)}")
+                self.fts_available = False
+                self._conn.execute("CREATE INDEX IF NOT EXISTS works_norm_title ON works(norm_title)")
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            # Without the index references are reported unverified instead of failing
+            logger.error(f"Bibliographic index unavailable: {str(e)}")
+            self.available = False
+
+    def count(self):
+        """Return the number of indexed records."""
+        if not self.available:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM works").fetchone()[0]
+
+    def import_records(self, records):
+        """
+        Import bibliographic records into the index.
+
+        Args:
+            records: Iterable of dictionaries with "title" and optionally "doi",
+                     "authors" (string or list) and "year"
+
+        Returns:
+            Number of records imported
+        """
+        imported = 0
+        batch = []
+        for record in records:
+            title = (record.get("title") or "").strip()
+            if not title:
+                continue
+            authors = record.get("authors") or ""
+            if isinstance(authors, (list, tuple)):
+                authors = "; ".join(str(author) for author in authors)
+            year = record.get("year")
+            try:
+                year = int(str(year)[:4]) if year else None
+            except ValueError:
+                year = None
+            batch.append((normalize_doi(record.get("doi")), title, normalize_title(title), authors, year))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += self._insert_batch(batch)
+                batch = []
+        if batch:
+            imported += self._insert_batch(batch)
+        logger.info(f"Imported {imported} bibliographic records into {self.path}")
+        return imported
+
+    def _insert_batch(self, batch):
+        if not self.available:
+            return 0
+        with self._lock:
+            cursor = self._conn.cursor()
+            inserted = 0
+            for row in batch:
+                cursor.execute(
+                    "INSERT OR IGNORE INTO works (doi, title, norm_title, authors, year) VALUES (?, ?, ?, ?, ?)",
+                    row
+                )
+                if not cursor.rowcount:
+                    continue
+                inserted += 1
+                if self.fts_available:
+                    cursor.execute(
+                        "INSERT INTO works_fts (rowid, norm_title) VALUES (?, ?)",
+                        (cursor.lastrowid, row[2])
+                    )
+            self._conn.commit()
+            return inserted
+
+    def import_dump(self, dump_path):
+        """
+        Import a bibliographic dump file.
+
+        Supports JSON Lines (.jsonl), JSON arrays (.json) and CSV (.csv) files with
+        doi/title/authors/year fields, optionally gzip-compressed (.gz).
+        """
+        opener = gzip.open if dump_path.endswith(".gz") else open
+        base_path = dump_path[:-3] if dump_path.endswith(".gz") else dump_path
+        with opener(dump_path, "rt", encoding="utf-8") as dump_file:
+            if base_path.endswith(".csv"):
+                return self.import_records(csv.DictReader(dump_file))
+            if base_path.endswith(".json"):
+                return self.import_records(json.load(dump_file))
+            return self.import_records(json.loads(line) for line in dump_file if line.strip())
+
+    def _row_to_record(self, row):
+        return {"doi": row[0], "title": row[1], "authors": row[2], "year": row[3]}
+
+    def lookup_doi(self, doi):
+        """Return the record with this DOI, or None."""
+        doi = normalize_doi(doi)
+        if not doi or not self.available:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doi, title, authors, year FROM works WHERE doi = ?", (doi,)
+            ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def _title_candidates(self, norm_title):
+        words = [word for word in norm_title.split() if word not in STOPWORDS and len(word) > 1]
+        if not words or not self.available:
+            return []
+        with self._lock:
+            if self.fts_available:
+                terms = [f'"{word}"' for word in words[:24]]
+                # Titles containing every significant word are the selective, common case;
+                # the OR query only runs when the reference title is partial or misspelled
+                for query in (" AND ".join(terms), " OR ".join(terms)):
+                    rows = self._conn.execute(
+                        "SELECT w.doi, w.title, w.authors, w.year, w.norm_title FROM works_fts "
+                        "JOIN works w ON w.id = works_fts.rowid WHERE works_fts MATCH ? "
+                        "ORDER BY bm25(works_fts) LIMIT ?",
+                        (query, CANDIDATE_LIMIT)
+                    ).fetchall()
+                    if rows:
+                        return rows
+                return []
+            return self._conn.execute(
+                "SELECT doi, title, authors, year, norm_title FROM works WHERE norm_title LIKE ? LIMIT ?",
+                (f"{' '.join(words[:2])}%", CANDIDATE_LIMIT)
+            ).fetchall()
+
+    def match_title(self, title, year=None):
+        """
+        Find the indexed record that best matches a title.
+
+        Returns:
+            Tuple (record or None, confidence between 0 and 1)
+        """
+        norm_title = normalize_title(title)
+        if not norm_title:
+            return None, 0.0
+
+        best_record, best_score = None, 0.0
+        for row in self._title_candidates(norm_title):
+            score = fuzz.token_sort_ratio(norm_title, row[4]) / 100.0
+            if year and row[3] and int(year) == row[3]:
+                score = min(1.0, score + 0.05)
+            if score > best_score:
+                best_record, best_score = self._row_to_record(row), score
+        return best_record, best_score
+
+    def verify(self, reference, title=None):
+        """
+        Verify a reference against the index.
+
+        Args:
+            reference: Full reference text
+            title: Title already extracted from the reference, if available
+
+        Returns:
+            Dictionary with "verified", "confidence", "method" and the matched "record"
+        """
+        doi = extract_doi(reference)
+        if doi:
+            record = self.lookup_doi(doi)
+            if record:
+                return {"verified": True, "confidence": 1.0, "method": "doi", "record": record}
+
+        year_match = YEAR_PATTERN.search(reference or '')
+        year = year_match.group(0) if year_match else None
+        record, confidence = self.match_title(title or reference, year)
+        return {
+            "verified": record is not None and confidence >= VERIFIED_CONFIDENCE,
+            "confidence": round(confidence, 3),
+            "method": "title" if record else None,
+            "record": record
+        }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "import":
+        index = BibliographicIndex()
+        for path in sys.argv[2:]:
+            print(f"Imported {index.import_dump(path)} records from {path}")
+        print(f"Index now holds {index.count()} records")
+    elif len(sys.argv) > 2 and sys.argv[1] == "verify":
+        index = BibliographicIndex()
+        start = time.perf_counter()
+        result = index.verify(" ".join(sys.argv[2:]))
+        print(json.dumps(result, indent=2))
+        print(f"Answered in {(time.perf_counter() - start) * 1000:.2f} ms")
+    else:
+        print("Usage: python reference_index.py import <dump.jsonl|.json|.csv[.gz]> ...")
+        print("       python reference_index.py verify <reference text>")
@@ -0,0 +1,282 @@
+import re
+import time
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+# All patterns are compiled once and are free of nested quantifiers, so every scan is linear
+REFERENCE_MARKER_PATTERN = re.compile(r'\[(\d+)\]')
+LEADING_NUMBER_PATTERN = re.compile(r'^\[(\d+)\]\s*')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+AUTHOR_PATTERN = re.compile(
+    r"^\[\d+\]\s+([A-Z][a-zA-Z]+(?: [A-Z][a-zA-Z]+)*(?:\s+et al\.)?|[A-Z]\.\s+[A-Za-z]+|[A-Za-z]+\s+[A-Z]\.)"
+)
+UNQUOTED_TITLE_PATTERN = re.compile(r"\]\s+[^\.]+\.\s+([A-Z][^\.]+)\.")
+JOURNAL_PATTERN = re.compile(r'[A-Za-z\s\.]+,\s+vol\.\s+\d+')
+CONFERENCE_PATTERN = re.compile(r'(?:In:|Proc\.|Proceedings of)\s+[A-Za-z0-9\s\-\.]+')
+VOLUME_PATTERN = re.compile(r'\bvol\.\s*(\d+)', re.IGNORECASE)
+ISSUE_PATTERN = re.compile(r'\bno\.\s*(\d+)', re.IGNORECASE)
+PAGES_PATTERN = re.compile(r'\bpp?\.\s*(\d+(?:\s*[-–]\s*\d+)?)', re.IGNORECASE)
+YEAR_PATTERN = re.compile(r'\b(?:19|20)\d{2}\b')
+DOI_MENTION_PATTERN = re.compile(r'doi', re.IGNORECASE)
+DOI_PATTERN = re.compile(r'doi:?\s*(10\.\d+/[^\s\.]+(?:\.[^\s\.]+)*)', re.IGNORECASE)
+URL_PATTERN = re.compile(r'(?:https?://|www\.)[^\s,]+')
+VENUE_END_PATTERN = re.compile(r',\s*(?:vol\.|no\.|pp?\.|doi|\d{4}|[A-Z][a-z]{2}\.?\s+\d{4})')
+AUTHOR_SEPARATOR_PATTERN = re.compile(r',\s*(?:and\s+)?|\s+and\s+')
+ACCESSED_PATTERN = re.compile(r'accessed\s+[A-Za-z]+\.?\s+\d+,\s+\d{4}', re.IGNORECASE)
+
+# Opening quote -> accepted closing quotes
+QUOTE_PAIRS = {
+    '"': '"”',
+    '“': '”"',
+    '„': '“”‟"',
+    '‟': '”"',
+    '‘': '’',
+    '«': '»',
+    '‹': '›',
+    '❝': '❞',
+    '❮': '❯',
+    '〝': '〞',
+    '＂': '＂',
+}
+# Quoted spans shorter than this are not considered titles
+MIN_TITLE_LENGTH = 4
+
+
+class ReferenceParser:
+    """
+    Tokenizer-based parser for IEEE reference lists.
+
+    The bibliography is split in one linear pass over its [n] markers, each entry is
+    parsed into structured fields, and the IEEE rules are checked against those fields.
+    """
+
+    @staticmethod
+    def split_references(references_text):
+        """
+        Split the text of a references section into individual references.
+
+        A marker starts a new entry when it begins a line or carries the next expected
+        reference number, so in-text citations such as "see [3]" inside an entry do not
+        split it.
+
+        Returns:
+            List of references with normalized whitespace, each starting with its [n]
+        """
+        starts = []
+        expected = None
+        # Whether the current line holds only whitespace up to `scanned`; only the text
+        # between two markers is looked at, so the pass stays linear on long lines
+        scanned, line_blank = 0, True
+        for match in REFERENCE_MARKER_PATTERN.finditer(references_text):
+            number = int(match.group(1))
+            newline = references_text.rfind('\n', scanned, match.start())
+            if newline != -1:
+                line_blank = not references_text[newline + 1:match.start()].strip()
+            else:
+                line_blank = line_blank and not references_text[scanned:match.start()].strip()
+            if not starts or line_blank or number == expected:
+                starts.append(match.start())
+                expected = number + 1
+            scanned, line_blank = match.end(), False
+
+        references = []
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(references_text)
+            reference = WHITESPACE_PATTERN.sub(' ', references_text[start:end]).strip()
+            if reference:
+                references.append(reference)
+        return references
+
+    @staticmethod
+    def _find_quoted_title(text):
+        """Return (title, start, end) of the first quoted span, scanning the text once."""
+        position = 0
+        length = len(text)
+        while position < length:
+            char = text[position]
+            closers = QUOTE_PAIRS.get(char)
+            if closers:
+                for end in range(position + 1, length):
+                    if text[end] in closers:
+                        title = text[position + 1:end].strip().rstrip(',.').strip()
+                        if len(title) >= MIN_TITLE_LENGTH:
+                            return title, position, end + 1
+                        position = end
+                        break
+                else:
+                    return None, -1, -1
+            position += 1
+        return None, -1, -1
+
+    @staticmethod
+    def parse_reference(reference):
+        """
+        Parse one reference into structured fields.
+
+        Returns:
+            Dictionary with number, authors, title, title_quoted, venue, volume, issue,
+            pages, year, doi, url and accessed (None when a field is absent)
+        """
+        text = WHITESPACE_PATTERN.sub(' ', reference or '').strip()
+        fields = {
+            "number": None, "authors": [], "title": None, "title_quoted": False,
+            "venue": None, "volume": None, "issue": None, "pages": None,
+            "year": None, "doi": None, "url": None, "accessed": None
+        }
+
+        number_match = LEADING_NUMBER_PATTERN.match(text)
+        body_start = 0
+        if number_match:
+            fields["number"] = int(number_match.group(1))
+            body_start = number_match.end()
+        body = text[body_start:]
+
+        title, title_start, title_end = ReferenceParser._find_quoted_title(body)
+        if title:
+            fields["title"] = title
+            fields["title_quoted"] = True
+            author_text = body[:title_start].strip().rstrip(',').strip()
+            rest = body[title_end:].lstrip(' ,.')
+            # The venue runs up to the first bibliographic field
+            venue = VENUE_END_PATTERN.split(rest, maxsplit=1)[0]
+            fields["venue"] = venue.strip(' ,.') or None
+        else:
+            unquoted = UNQUOTED_TITLE_PATTERN.search(text)
+            if unquoted:
+                fields["title"] = unquoted.group(1).strip()
+                author_text = text[body_start:unquoted.start(1)].strip().rstrip('.')
+            else:
+                author_text = body.split('.', 1)[0]
+
+        fields["authors"] = [
+            author.strip() for author in AUTHOR_SEPARATOR_PATTERN.split(author_text) if author.strip()
+        ]
+
+        for key, pattern in (("volume", VOLUME_PATTERN), ("issue", ISSUE_PATTERN), ("pages", PAGES_PATTERN)):
+            match = pattern.search(text)
+            if match:
+                fields[key] = match.group(1)
+
+        years = YEAR_PATTERN.findall(text)
+        if years:
+            fields["year"] = int(years[-1])
+
+        doi_match = DOI_PATTERN.search(text)
+        if doi_match:
+            fields["doi"] = doi_match.group(1)
+        url_match = URL_PATTERN.search(text)
+        if url_match:
+            fields["url"] = url_match.group(0).rstrip('.')
+        accessed_match = ACCESSED_PATTERN.search(text)
+        if accessed_match:
+            fields["accessed"] = accessed_match.group(0)
+
+        return fields
+
+    @staticmethod
+    def validate_fields(reference, fields):
+        """
+        Check the IEEE rules against the parsed fields of a reference.
+
+        Returns:
+            List of issue descriptions (empty when the reference is valid)
+        """
+        issues = []
+        text = WHITESPACE_PATTERN.sub(' ', reference or '').strip()
+
+        if fields["number"] is None:
+            issues.append("Missing reference number (e.g., [1]).")
+
+        if not AUTHOR_PATTERN.search(text):
+            issues.append("Author names should follow IEEE format.")
+
+        if not fields["title"]:
+            issues.append("Could not find title in quotation marks.")
+        elif not fields["title_quoted"]:
+            issues.append(f"Title not properly quoted: '{fields['title']}'")
+        elif not fields["title"][0].isupper():
+            issues.append("Title should be properly quoted and capitalized.")
+
+        is_periodical = JOURNAL_PATTERN.search(text) or CONFERENCE_PATTERN.search(text)
+        if not is_periodical and "URL:" in text and not fields["accessed"]:
+            issues.append("Website citation missing access date (e.g., accessed Jan. 10, 2023).")
+
+        if fields["volume"] and not (fields["issue"] and fields["pages"]):
+            issues.append("Journal reference missing volume (vol.), issue (no.), or page numbers (pp.).")
+
+        if fields["year"] is None:
+            issues.append("Missing publication year.")
+
+        if DOI_MENTION_PATTERN.search(text) and not fields["doi"]:
+            issues.append("Incorrect DOI format. Should be 'doi: 10.xxxx/xxxxx'.")
+
+        return issues
+
+    @staticmethod
+    def validate_ieee_format(reference):
+        """Parse a reference and validate it against the IEEE format."""
+        fields = ReferenceParser.parse_reference(reference)
+        issues = ReferenceParser.validate_fields(reference, fields)
+        return {
+            "is_valid": len(issues) == 0,
+            "issues": issues,
+            "fields": fields
+        }
+
+
+def _synthetic_reference(number, rng):
+    authors = ", ".join(f"{rng.choice('ABCDEFGH')}. {rng.choice(['Smith', 'Lee', 'Garcia', 'Chen', 'Ali'])}"
+                        for _ in range(rng.randint(1, 4)))
+    kind = rng.random()
+    if kind < 0.5:
+        return (f"[{number}] {authors}, “A study of requirement quality number {number},” "
+                f"IEEE Trans. Softw. Eng., vol. {rng.randint(1, 50)}, no. {rng.randint(1, 12)}, "
+                f"pp. {rng.randint(1, 400)}–{rng.randint(401, 900)}, {rng.randint(1990, 2024)}, "
+                f"doi: 10.1109/TSE.{rng.randint(1000, 9999)}.{number}.")
+    if kind < 0.8:
+        return (f"[{number}] {authors}, \"Modelling systems with UML {number},\" in Proc. Int. Conf. "
+                f"Softw. Eng., {rng.randint(1990, 2024)}, pp. {rng.randint(1, 400)}-{rng.randint(401, 900)}.")
+    return (f"[{number}] {authors}. Online guide {number}. URL: https://example.org/guide/{number} "
+            f"(accessed Jan. {rng.randint(1, 28)}, {rng.randint(2015, 2024)}).")
+
+
+def benchmark(reference_count=5000, seed=11):
+    """Compare the old lazy-regex split with the tokenizer and time parsing plus validation."""
+    rng = random.Random(seed)
+    # Wrap entries over several lines like text extracted from a PDF
+    entries = [_synthetic_reference(n, rng) for n in range(1, reference_count + 1)]
+    references_text = "\n".join(
+        "\n".join(entry[i:i + 90] for i in range(0, len(entry), 90)) for entry in entries
+    )
+
+    start = time.perf_counter()
+    legacy = [WHITESPACE_PATTERN.sub(' ', m.group(1).strip())
+              for m in re.finditer(r'(\[\d+\].*?)(?=\[\d+\]|\Z)', references_text, re.DOTALL)]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    references = ReferenceParser.split_references(references_text)
+    split_seconds = time.perf_counter() - start
+
+    # Text extracted without line breaks puts the whole bibliography on one line
+    one_line = " ".join(entries)
+    start = time.perf_counter()
+    one_line_references = ReferenceParser.split_references(one_line)
+    one_line_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    valid = sum(ReferenceParser.validate_ieee_format(reference)["is_valid"] for reference in references)
+    validate_seconds = time.perf_counter() - start
+
+    print(f"Bibliography: {len(references_text)} characters, {reference_count} references")
+    print(f"Lazy regex split:   {legacy_seconds * 1000:.1f} ms ({len(legacy)} entries)")
+    print(f"Tokenizer split:    {split_seconds * 1000:.1f} ms ({len(references)} entries)")
+    print(f"One-line split:     {one_line_seconds * 1000:.1f} ms ({len(one_line_references)} entries)")
+    print(f"Parse + validate:   {validate_seconds * 1000:.1f} ms "
+          f"({reference_count / validate_seconds:.0f} references/s, {valid} valid)")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# References whose deterministic title scores below this go to the LLM
+TITLE_CONFIDENCE_THRESHOLD = 0.8
+# Maximum number of references sent to the LLM in one prompt
+LLM_BATCH_SIZE = 25
+
+TITLE_CACHE_PATH = os.getenv(
+    "REFERENCE_TITLE_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "reference_titles.sqlite3")
+)
+MEMORY_CACHE_SIZE = 2048
+
+REFERENCE_NUMBER_PATTERN = re.compile(r'^\s*\[\d+\]\s*')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# Straight, curly and typographic double quotes as used around IEEE titles
+QUOTED_TITLE_PATTERN = re.compile(r'["“”„‟«»＂]([^"“”„‟«»＂]{4,}?)[,.]?["“”„‟«»＂]')
+AUTHOR_END_PATTERNS = [
+    re.compile(r'et al\.,?\s+["“]([^"”]+)["”]'),
+    re.compile(r'[A-Z][a-z]+,?\s+["“]([^"”]+)["”]'),
+    re.compile(r'[A-Z][a-z]+\s+and\s+[A-Z][a-z]+\.\s+["“]([^"”]+)["”]')
+]
+
+
+def normalize_reference(reference):
+    """Normalize a reference for cache lookups (drops numbering, case and spacing)."""
+    reference = REFERENCE_NUMBER_PATTERN.sub('', reference or '')
+    return WHITESPACE_PATTERN.sub(' ', reference).strip().lower()
+
+
+def reference_hash(reference):
+    """Stable hash of a normalized reference."""
+    return hashlib.sha256(normalize_reference(reference).encode('utf-8')).hexdigest()
+
+
+def parse_title(reference):
+    """
+    Extract a title from an IEEE-style reference without calling an LLM.
+
+    Args:
+        reference: The reference text, with or without its [n] number
+
+    Returns:
+        Tuple (title, confidence) where confidence is between 0 and 1
+    """
+    normalized_ref = WHITESPACE_PATTERN.sub(' ', reference or '').strip()
+    ref_without_num = REFERENCE_NUMBER_PATTERN.sub('', normalized_ref)
+
+    # IEEE titles are enclosed in quotation marks; a quoted span after the authors is decisive
+    for pattern in AUTHOR_END_PATTERNS:
+        match = pattern.search(ref_without_num)
+        if match:
+            return match.group(1).strip().rstrip(','), 0.95
+
+    match = QUOTED_TITLE_PATTERN.search(ref_without_num)
+    if match:
+        title = match.group(1).strip().rstrip(',')
+        # Very short quoted spans are usually not titles (e.g. quoted acronyms)
+        return title, 0.9 if len(title.split()) >= 2 else 0.5
+
+    # Fall back to the first sentence, capped at 100 characters
+    title = ref_without_num.split('.')[0][:100]
+    return title, 0.2
+
+
+class TitleCache:
+    """
+    Persistent cache of extracted reference titles keyed by normalized-reference hash.
+
+    A small in-memory LRU sits in front of an SQLite table so repeated references
+    (common textbooks cited by many students) are served without touching disk or the LLM.
+    """
+
+    def __init__(self, path=TITLE_CACHE_PATH, memory_size=MEMORY_CACHE_SIZE):
+        self.path = path
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_available = True
+        try:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS reference_titles ("
+                "ref_hash TEXT PRIMARY KEY, title TEXT NOT NULL, source TEXT NOT NULL)"
+            )
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Title cache unavailable, using memory only: {str(e)}")
+            self._disk_available = False
+
+    def _remember(self, ref_hash, entry):
+        self._memory[ref_hash] = entry
+        self._memory.move_to_end(ref_hash)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, reference):
+        """Return {"title", "source"} for a cached reference, or None."""
+        ref_hash = reference_hash(reference)
+        with self._lock:
+            if ref_hash in self._memory:
+                self._memory.move_to_end(ref_hash)
+                return self._memory[ref_hash]
+            if not self._disk_available:
+                return None
+            try:
+                row = self._conn.execute(
+                    "SELECT title, source FROM reference_titles WHERE ref_hash = ?", (ref_hash,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading title cache: {str(e)}")
+                return None
+            if row is None:
+                return None
+            entry = {"title": row[0], "source": row[1]}
+            self._remember(ref_hash, entry)
+            return entry
+
+    def put(self, reference, title, source):
+        """Store the title of a reference."""
+        ref_hash = reference_hash(reference)
+        entry = {"title": title, "source": source}
+        with self._lock:
+            self._remember(ref_hash, entry)
+            if not self._disk_available:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO reference_titles (ref_hash, title, source) VALUES (?, ?, ?)",
+                    (ref_hash, title, source)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing title cache: {str(e)}")
+
+
+def build_batch_title_prompt(references):
+    """Build one prompt asking the LLM for the titles of several references as JSON."""
+    numbered = "\n".join(f"{i}: {WHITESPACE_PATTERN.sub(' ', ref).strip()}" for i, ref in enumerate(references))
+    return f"""
+            Extract ONLY the title from each academic reference below.
+
+            In IEEE format, the title is usually enclosed in quotation marks.
+            For example, in "[1] D. V. Lindberg and H. K. H. Lee, "Optimization under constraints by applying an asymmetric entropy measure," J. Comput. Graph. Statist., vol. 24, no. 2, pp. 379–393, Jun. 2015, doi: 10.1080/10618600.2014.901225."
+            the title is "Optimization under constraints by applying an asymmetric entropy measure"
+
+            Return ONLY a JSON array with one object per reference, in the same order, like:
+            [{{"id": 0, "title": "..."}}, {{"id": 1, "title": "..."}}]
+            Do not include quotation marks inside the titles and do not add any other text.
+
+            References:
+            {numbered}
+            """
+
+
+def parse_batch_title_response(response_text, count):
+    """
+    Parse the JSON returned for a batched title prompt.
+
+    Returns:
+        Dictionary {reference index: title} for the entries that could be read
+    """
+    text = (response_text or "").strip()
+    # Models sometimes wrap JSON in a markdown code fence
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end == -1:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+
+    titles = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        title = str(item.get("title") or "").strip().strip('"\'“”')
+        if 0 <= index < count and title:
+            titles[index] = title
+    return titles
@@ -0,0 +1,431 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SECTION_INDEX_DIR = os.getenv(
+    "SECTION_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "section_index")
+)
+# Stored dimensions; text-embedding-3 vectors keep their meaning when truncated and
+# re-normalized, so the 1536-dimensional analysis embeddings are reused as they are
+SECTION_INDEX_DIMENSIONS = int(os.getenv("SECTION_INDEX_DIMENSIONS", "512"))
+# Courses with at least this many sections are searched through an IVF index
+IVF_MIN_ROWS = int(os.getenv("SECTION_INDEX_IVF_MIN_ROWS", "8192"))
+# Inverted lists probed per query
+IVF_NPROBE = int(os.getenv("SECTION_INDEX_IVF_NPROBE", "8"))
+KMEANS_ITERATIONS = 8
+# Rows added to a vector file whenever it is full
+GROWTH_ROWS = 1024
+
+KINDS = ("section", "diagram")
+
+
+def reduce_embedding(vector, dimensions=SECTION_INDEX_DIMENSIONS):
+    """Truncate an embedding to the index dimensions and normalize it to unit length."""
+    vector = np.asarray(vector, dtype=np.float32)[:dimensions]
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def train_ivf(vectors, lists, seed=0):
+    """
+    Spherical k-means centroids for an IVF index.
+
+    Returns:
+        (centroids, assignment of every row)
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), lists * 64), replace=False)]
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _unit_rows(sums)
+    return centroids, assign_ivf(vectors, centroids)
+
+
+def assign_ivf(vectors, centroids, chunk=16384):
+    """Nearest centroid of every row."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        labels[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return labels
+
+
+class _CourseVectors:
+    """Memory-mapped vectors of one course with the row metadata needed to filter queries."""
+
+    def __init__(self, path, dimensions, rows):
+        self.path = path
+        self.dimensions = dimensions
+        self.count = len(rows)
+        self.submissions = np.array([row[0] for row in rows], dtype=object)
+        self.titles = [row[1] for row in rows]
+        self.types = np.array([row[2] for row in rows], dtype=object)
+        self.kinds = np.array([KINDS.index(row[3]) for row in rows], dtype=np.int8)
+        self.deleted = np.array([bool(row[4]) for row in rows], dtype=bool)
+        self.vectors = None
+        self.capacity = 0
+        self.centroids = None
+        self.labels = np.zeros(0, dtype=np.int32)
+        self.ivf_rows = 0
+        self._open(max(self.count, 1))
+
+    def _open(self, rows):
+        row_bytes = self.dimensions * 4
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < rows * row_bytes:
+            with open(self.path, "ab") as handle:
+                handle.truncate(rows * row_bytes)
+            size = rows * row_bytes
+        self.capacity = size // row_bytes
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dimensions))
+
+    def append(self, vectors, submission_id, titles, types, kinds):
+        if self.count + len(vectors) > self.capacity:
+            self.vectors.flush()
+            self._open(self.count + len(vectors) + GROWTH_ROWS)
+        start = self.count
+        self.vectors[start:start + len(vectors)] = vectors
+        self.vectors.flush()
+        self.count += len(vectors)
+        self.submissions = np.append(self.submissions, np.array([submission_id] * len(vectors), dtype=object))
+        self.titles.extend(titles)
+        self.types = np.append(self.types, np.array(types, dtype=object))
+        self.kinds = np.append(self.kinds, np.array([KINDS.index(kind) for kind in kinds], dtype=np.int8))
+        self.deleted = np.append(self.deleted, np.zeros(len(vectors), dtype=bool))
+        return start
+
+
+class SectionIndex:
+    """
+    Course-wide vector index of section and diagram-scope embeddings.
+
+    Each course has one append-only, memory-mapped float32 file of unit vectors
+    (truncated to SECTION_INDEX_DIMENSIONS) and its row metadata in SQLite. Sections
+    are added as soon as a submission's content analysis completes; re-analysing a
+    submission replaces its rows. Workers sharing the directory allocate rows inside
+    an immediate SQLite transaction and reload a course whose rows changed on disk.
+    Small courses are searched exhaustively with one
+    matrix-vector product. Courses with at least IVF_MIN_ROWS sections get an IVF
+    index (spherical k-means lists, retrained whenever the course doubles in size) and
+    only the IVF_NPROBE lists nearest to the query are scanned.
+    """
+
+    def __init__(self, directory=SECTION_INDEX_DIR, dimensions=SECTION_INDEX_DIMENSIONS,
+                 ivf_min_rows=IVF_MIN_ROWS, nprobe=IVF_NPROBE):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._courses = {}
+        self._stale = set()  # cached courses another process may have changed
+        self._data_version = None
+        self._lock = threading.Lock()
+        self.available = True
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.directory, "sections.sqlite3"), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sections ("
+                "course_id TEXT NOT NULL, row INTEGER NOT NULL, submission_id TEXT NOT NULL, document_name TEXT, "
+                "section_title TEXT NOT NULL, section_type TEXT, kind TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, PRIMARY KEY (course_id, row))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sections_submission ON sections(course_id, submission_id)")
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            # Without the index, analyses skip indexing and searches find nothing
+            logger.error(f"Section index unavailable: {str(e)}")
+            self.available = False
+
+    def _course(self, course_id, sync=False):
+        """
+        Cached vectors of a course, reloaded when other workers changed its rows.
+
+        Args:
+            course_id: Course to load
+            sync: Compare with the rows on disk even if no other connection committed
+                (done inside the write transaction before rows are allocated)
+        """
+        # data_version changes whenever another connection commits
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._stale.update(self._courses)
+        course = self._courses.get(course_id)
+        if course is not None and (sync or course_id in self._stale):
+            self._stale.discard(course_id)
+            rows, deleted = self._conn.execute(
+                "SELECT COALESCE(MAX(row) + 1, 0), COALESCE(SUM(deleted), 0) FROM sections WHERE course_id = ?",
+                (course_id,)
+            ).fetchone()
+            if (rows, deleted) != (course.count, int(course.deleted[:course.count].sum())):
+                course = self._load_course(course_id, previous=course)
+        if course is None:
+            course = self._load_course(course_id)
+        return course
+
+    def _load_course(self, course_id, previous=None):
+        rows = self._conn.execute(
+            "SELECT submission_id, section_title, section_type, kind, deleted FROM sections "
+            "WHERE course_id = ? ORDER BY row", (course_id,)
+        ).fetchall()
+        name = hashlib.sha1(course_id.encode("utf-8")).hexdigest()[:16]
+        course = _CourseVectors(os.path.join(self.directory, f"{name}.f32"), self.dimensions, rows)
+        if previous is not None and previous.centroids is not None and previous.count <= course.count:
+            # Rows are append-only, so the lists of the rows already seen still hold
+            course.centroids, course.labels, course.ivf_rows = previous.centroids, previous.labels, previous.ivf_rows
+        self._courses[course_id] = course
+        self._refresh_ivf(course)
+        return course
+
+    def _refresh_ivf(self, course):
+        """Train the IVF lists when a course reaches the threshold or doubles, else assign new rows."""
+        if course.count < self.ivf_min_rows:
+            course.centroids = None
+            return
+        if course.centroids is None or course.count >= 2 * course.ivf_rows:
+            lists = max(16, int(np.sqrt(course.count)))
+            start = time.perf_counter()
+            course.centroids, course.labels = train_ivf(np.asarray(course.vectors[:course.count]), lists)
+            course.ivf_rows = course.count
+            logger.info(f"Trained {lists} IVF lists over {course.count} sections in {time.perf_counter() - start:.2f}s")
+        elif len(course.labels) < course.count:
+            new_rows = np.asarray(course.vectors[len(course.labels):course.count])
+            course.labels = np.concatenate([course.labels, assign_ivf(new_rows, course.centroids)])
+
+    def add_submission(self, course_id, submission_id, sections, document_name=None):
+        """
+        Index the sections of a submission, replacing its earlier rows.
+
+        Args:
+            course_id: Course of the submission
+            submission_id: Unique id of the submission
+            sections: List of {"title", "type", "kind" ("section" or "diagram"), "embedding"}
+            document_name: Optional display name reported with results
+
+        Returns:
+            Number of sections indexed (0 when the index is unavailable)
+        """
+        if not self.available:
+            return 0
+        course_id, submission_id = str(course_id), str(submission_id)
+        sections = [section for section in sections if section.get("embedding") is not None]
+        vectors = np.stack([reduce_embedding(section["embedding"], self.dimensions) for section in sections]) \
+            if sections else np.zeros((0, self.dimensions), dtype=np.float32)
+        keep = np.linalg.norm(vectors, axis=1) > 0
+        sections = [section for section, kept in zip(sections, keep) if kept]
+        vectors = vectors[keep]
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            try:
+                # The write lock makes MAX(row) + 1 the next free row for every worker
+                cursor.execute("BEGIN IMMEDIATE")
+                course = self._course(course_id, sync=True)
+                start = course.count
+                cursor.execute("UPDATE sections SET deleted = 1 WHERE course_id = ? AND submission_id = ?",
+                               (course_id, submission_id))
+                course.deleted[course.submissions == submission_id] = True
+                if sections:
+                    now = time.time()
+                    cursor.executemany(
+                        "INSERT INTO sections (course_id, row, submission_id, document_name, section_title, "
+                        "section_type, kind, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(course_id, start + offset, submission_id, document_name, section["title"],
+                          section.get("type"), section.get("kind", "section"), now)
+                         for offset, section in enumerate(sections)]
+                    )
+                    # Vectors are written before the rows become visible to other workers
+                    course.append(vectors, submission_id, [section["title"] for section in sections],
+                                  [section.get("type") for section in sections],
+                                  [section.get("kind", "section") for section in sections])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                # The cached course may hold rows that were never committed
+                self._courses.pop(course_id, None)
+                raise
+            self._refresh_ivf(course)
+        logger.info(f"Indexed {len(sections)} sections of submission {submission_id} in course {course_id}")
+        return len(sections)
+
+    def section_vector(self, course_id, submission_id, section_title):
+        """Stored vector of a section of a submission, or None."""
+        if not self.available:
+            return None
+        with self._lock:
+            course = self._course(str(course_id))
+            rows = np.flatnonzero((course.submissions == str(submission_id)) & ~course.deleted)
+            for row in rows:
+                if course.titles[row] == section_title:
+                    return np.array(course.vectors[row])
+        return None
+
+    def search(self, course_id, vector, k=10, kind=None, section_type=None, exclude_submission=None):
+        """
+        Top-k most similar sections of a course.
+
+        Args:
+            course_id: Course to search
+            vector: Query embedding (any length of at least the index dimensions)
+            k: Number of results
+            kind: Optional "section" or "diagram" filter
+            section_type: Optional section type filter (see SimilarityAnalyzer.determine_section_type)
+            exclude_submission: Submission whose own sections are skipped
+
+        Returns:
+            List of {"submission_id", "document_name", "section_title", "section_type",
+            "kind", "similarity"} by decreasing similarity
+        """
+        if not self.available:
+            return []
+        course_id = str(course_id)
+        query = reduce_embedding(vector, self.dimensions)
+        with self._lock:
+            course = self._course(course_id)
+            if course.count == 0:
+                return []
+            if course.centroids is not None:
+                probes = np.argsort(course.centroids @ query)[::-1][:self.nprobe]
+                candidates = np.flatnonzero(np.isin(course.labels[:course.count], probes))
+            else:
+                candidates = np.arange(course.count)
+            valid = ~course.deleted[candidates]
+            if kind is not None:
+                valid &= course.kinds[candidates] == KINDS.index(kind)
+            if section_type is not None:
+                valid &= course.types[candidates] == section_type
+            if exclude_submission is not None:
+                valid &= course.submissions[candidates] != str(exclude_submission)
+            candidates = candidates[valid]
+            if not len(candidates):
+                return []
+            if len(candidates) == course.count:
+                scores = np.asarray(course.vectors[:course.count]) @ query
+            else:
+                scores = np.asarray(course.vectors[candidates]) @ query
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            rows = candidates[top]
+            results = [(int(row), float(scores[index])) for row, index in zip(rows, top)]
+            metadata = [(course.submissions[row], course.titles[row], course.types[row], KINDS[course.kinds[row]])
+                        for row, _ in results]
+        names = self._document_names(course_id, {submission for submission, _, _, _ in metadata})
+        return [{
+            "submission_id": submission,
+            "document_name": names.get(submission),
+            "section_title": title,
+            "section_type": section_type,
+            "kind": kind,
+            "similarity": round(similarity, 4)
+        } for (submission, title, section_type, kind), (_, similarity) in zip(metadata, results)]
+
+    def similar_submissions(self, course_id, submission_id, k=5):
+        """
+        Submissions of a course that describe the most similar system.
+
+        Every submission is summarized by the normalized mean of its section vectors.
+
+        Returns:
+            List of {"submission_id", "document_name", "similarity", "sections"}
+        """
+        if not self.available:
+            return []
+        course_id, submission_id = str(course_id), str(submission_id)
+        with self._lock:
+            course = self._course(course_id)
+            live = np.flatnonzero(~course.deleted[:course.count])
+            if not len(live):
+                return []
+            submissions, owners = np.unique(course.submissions[live].astype(str), return_inverse=True)
+            if submission_id not in submissions:
+                return []
+            sums = np.zeros((len(submissions), self.dimensions), dtype=np.float32)
+            np.add.at(sums, owners, np.asarray(course.vectors[live]))
+            counts = np.bincount(owners, minlength=len(submissions))
+        centroids = _unit_rows(sums)
+        own = int(np.flatnonzero(submissions == submission_id)[0])
+        scores = centroids @ centroids[own]
+        scores[own] = -np.inf
+        order = np.argsort(-scores)[:k]
+        order = order[np.isfinite(scores[order])]
+        names = self._document_names(course_id, {submissions[index] for index in order})
+        return [{
+            "submission_id": str(submissions[index]),
+            "document_name": names.get(str(submissions[index])),
+            "similarity": round(float(scores[index]), 4),
+            "sections": int(counts[index])
+        } for index in order]
+
+    def _document_names(self, course_id, submission_ids):
+        submission_ids = list(submission_ids)
+        if not submission_ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT submission_id, document_name FROM sections WHERE course_id = ? "
+                f"AND deleted = 0 AND submission_id IN ({','.join('?' * len(submission_ids))})",
+                [course_id] + submission_ids
+            ).fetchall()
+        return dict(rows)
+
+    def count(self, course_id):
+        """Number of live sections of a course."""
+        if not self.available:
+            return 0
+        with self._lock:
+            course = self._course(str(course_id))
+            return int((~course.deleted[:course.count]).sum())
+
+
+def benchmark(sections=30000, dimensions=1536, queries=50, seed=7):
+    """Flat and IVF query latency and IVF recall on clustered synthetic embeddings."""
+    import tempfile
+
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(300, dimensions)).astype(np.float32)
+    embeddings = topics[rng.integers(0, len(topics), sections)] + 0.6 * rng.normal(size=(sections, dimensions)).astype(np.float32)
+    query_vectors = topics[rng.integers(0, len(topics), queries)] + 0.6 * rng.normal(size=(queries, dimensions)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for name, ivf_min_rows in (("flat", sections + 1), ("ivf", 1)):
+            index = SectionIndex(os.path.join(directory, name), ivf_min_rows=ivf_min_rows)
+            start = time.perf_counter()
+            for submission in range(0, sections, 20):
+                index.add_submission("course", f"s{submission}", [
+                    {"title": f"Section {n}", "type": "requirements", "kind": "section", "embedding": embeddings[n]}
+                    for n in range(submission, min(sections, submission + 20))
+                ])
+            insert_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            results[name] = [index.search("course", vector, k=10) for vector in query_vectors]
+            query_ms = 1000 * (time.perf_counter() - start) / queries
+            print(f"{name}: {sections} sections inserted in {insert_seconds:.1f}s, {query_ms:.2f} ms/query")
+        recall = np.mean([
+            len({(r["submission_id"], r["section_title"]) for r in flat} &
+                {(r["submission_id"], r["section_title"]) for r in ivf}) / 10
+            for flat, ivf in zip(results["flat"], results["ivf"])
+        ])
+        print(f"IVF recall@10 against flat search: {recall:.2f}")
+
+
+if __name__ == "__main__":
+    benchmark()
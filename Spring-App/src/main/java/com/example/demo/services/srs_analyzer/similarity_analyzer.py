@@ -9,6 +9,9 @@ import json
 from typing import List, Tuple, Dict
 import math
 import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from llm_gateway import LLM_GATEWAY
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -29,6 +32,75 @@ if api_key:
 else:
     logging.error("OpenAI API key not found in environment variables")
 
+# Title keywords of each section type, checked in order (first match wins)
+SECTION_TYPE_PATTERNS = {
+    'requirements': ['requirement', 'functional', 'non-functional', 'use case'],
+    'system_description': ['description', 'overview', 'introduction', 'system'],
+    'architecture': ['architecture', 'design', 'component', 'structure'],
+    'data_design': ['data', 'database', 'storage', 'entity'],
+    'ui_design': ['interface', 'ui', 'user interface', 'screen'],
+    'testing': ['test', 'validation', 'verification'],
+    'deployment': ['deployment', 'installation', 'configuration'],
+    'diagram': ['diagram', 'figure', 'chart', 'graph']
+}
+DIAGRAM_TYPE_PATTERNS = {
+    'use_case_diagram': ['use case diagram', 'use-case'],
+    'class_diagram': ['class diagram', 'object diagram'],
+    'sequence_diagram': ['sequence diagram', 'interaction'],
+    'activity_diagram': ['activity diagram', 'workflow'],
+    'er_diagram': ['er diagram', 'entity relationship', 'eerd'],
+    'component_diagram': ['component diagram'],
+    'deployment_diagram': ['deployment diagram'],
+    'state_diagram': ['state diagram', 'state machine']
+}
+# Which section types are compared with each other
+COMPARISON_RULES = {
+    'requirements': ['system_description', 'use_case_diagram', 'class_diagram'],
+    'system_description': ['requirements', 'architecture', 'component_diagram'],
+    'architecture': ['system_description', 'component_diagram', 'deployment_diagram'],
+    'data_design': ['class_diagram', 'er_diagram'],
+    'ui_design': ['requirements', 'activity_diagram'],
+    'testing': ['requirements'],
+    'deployment': ['architecture', 'deployment_diagram'],
+    'use_case_diagram': ['requirements', 'activity_diagram'],
+    'class_diagram': ['requirements', 'data_design', 'er_diagram'],
+    'sequence_diagram': ['requirements', 'use_case_diagram'],
+    'activity_diagram': ['requirements', 'use_case_diagram'],
+    'er_diagram': ['data_design', 'class_diagram'],
+    'component_diagram': ['architecture'],
+    'deployment_diagram': ['architecture', 'deployment'],
+    'state_diagram': ['requirements']
+}
+
+
+def _type_adjacency(rules):
+    """Symmetric adjacency of section types (a pair is compared if either side lists the other)."""
+    adjacency = {}
+    for section_type, related in rules.items():
+        for other in related:
+            adjacency.setdefault(section_type, set()).add(other)
+            adjacency.setdefault(other, set()).add(section_type)
+    return {section_type: frozenset(related) for section_type, related in adjacency.items()}
+
+
+TYPE_ADJACENCY = _type_adjacency(COMPARISON_RULES)
+# Score only the pairs allowed by TYPE_ADJACENCY, from one embedding per scope
+SIMILARITY_SPARSE = os.getenv("SIMILARITY_SPARSE", "1") != "0"
+# Texts per embeddings request
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_DIMENSIONS = 1536
+
+# Pairs scoring above this (after scaling) are candidates for a relationship analysis
+RELATIONSHIP_MIN_SIMILARITY = 0.3
+# Each scope contributes at most its RELATIONSHIP_TOP_K most similar pairs
+RELATIONSHIP_TOP_K = max(1, int(os.getenv("RELATIONSHIP_TOP_K", "2")))
+# Pairs analysed per GPT-4 request, and requests allowed per document
+RELATIONSHIP_BATCH_SIZE = max(1, int(os.getenv("RELATIONSHIP_BATCH_SIZE", "5")))
+RELATIONSHIP_CALL_BUDGET = int(os.getenv("RELATIONSHIP_CALL_BUDGET", "3"))
+# Characters of each section included in the prompt
+RELATIONSHIP_EXCERPT_CHARS = 500
+RELATIONSHIP_TOKENS_PER_PAIR = 350
+
 class SimilarityAnalyzer:
     @staticmethod
     def compare_sections_with_gpt(section1, section2, section1_name=None, section2_name=None):
@@ -85,23 +157,24 @@ class SimilarityAnalyzer:
                 """
             
             logger.debug(f"Sending request to OpenAI with prompt: {prompt[:100]}...")
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
+            response = LLM_GATEWAY.chat(
+                "similarity.compare_sections",
                 messages=[
                     {"role": "system", "content": "You are a similarity analyzer. Return only a number between 0 and 1 representing the similarity between the given texts."},
                     {"role": "user", "content": prompt}
                 ],
+                model="gpt-3.5-turbo",
                 temperature=0.1,
                 max_tokens=10
             )
             
-            logger.debug(f"Received response from OpenAI: {response.choices[0].message.content}")
+            logger.debug(f"Received response from OpenAI: {response}")
             try:
-                score = float(response.choices[0].message.content.strip())
+                score = float(response.strip())
                 logger.debug(f"Converted score: {score}")
                 return min(max(score, 0), 1)
             except ValueError as ve:
-                logger.error(f"Failed to convert response to float: {response.choices[0].message.content}")
+                logger.error(f"Failed to convert response to float: {response}")
                 return SimilarityAnalyzer.compare_scopes(section1, section2)
             
         except Exception as e:
@@ -133,17 +206,18 @@ class SimilarityAnalyzer:
             {text}
             """
             
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
+            response = LLM_GATEWAY.chat(
+                "similarity.system_scope",
                 messages=[
                     {"role": "system", "content": "You are a system scope analyzer. Create clear, structured system scopes."},
                     {"role": "user", "content": prompt}
                 ],
+                model="gpt-3.5-turbo",
                 temperature=0.3,
                 max_tokens=500
             )
             
-            return response.choices[0].message.content.strip()
+            return response.strip()
             
         except Exception as e:
             logger.error(f"Error creating system scope with GPT: {str(e)}")
@@ -185,17 +259,18 @@ class SimilarityAnalyzer:
             {diagram_info}
             """
             
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
+            response = LLM_GATEWAY.chat(
+                "similarity.diagram_scope",
                 messages=[
                     {"role": "system", "content": "You are a diagram analyzer. Create clear, structured system scopes from diagrams."},
                     {"role": "user", "content": prompt}
                 ],
+                model="gpt-3.5-turbo",
                 temperature=0.3,
                 max_tokens=500
             )
             
-            return response.choices[0].message.content.strip()
+            return response.strip()
             
         except Exception as e:
             logger.error(f"Error creating diagram scope with GPT: {str(e)}")
@@ -227,37 +302,14 @@ class SimilarityAnalyzer:
         """
         title_lower = section_title.lower()
         
-        # Define patterns for different section types
-        section_patterns = {
-            'requirements': ['requirement', 'functional', 'non-functional', 'use case'],
-            'system_description': ['description', 'overview', 'introduction', 'system'],
-            'architecture': ['architecture', 'design', 'component', 'structure'],
-            'data_design': ['data', 'database', 'storage', 'entity'],
-            'ui_design': ['interface', 'ui', 'user interface', 'screen'],
-            'testing': ['test', 'validation', 'verification'],
-            'deployment': ['deployment', 'installation', 'configuration'],
-            'diagram': ['diagram', 'figure', 'chart', 'graph']
-        }
-        
         # Check if the title matches any pattern
-        for section_type, patterns in section_patterns.items():
+        for section_type, patterns in SECTION_TYPE_PATTERNS.items():
             for pattern in patterns:
                 if pattern in title_lower:
                     return section_type
         
         # Check for specific diagram types
-        diagram_types = {
-            'use_case_diagram': ['use case diagram', 'use-case'],
-            'class_diagram': ['class diagram', 'object diagram'],
-            'sequence_diagram': ['sequence diagram', 'interaction'],
-            'activity_diagram': ['activity diagram', 'workflow'],
-            'er_diagram': ['er diagram', 'entity relationship', 'eerd'],
-            'component_diagram': ['component diagram'],
-            'deployment_diagram': ['deployment diagram'],
-            'state_diagram': ['state diagram', 'state machine']
-        }
-        
-        for diagram_type, patterns in diagram_types.items():
+        for diagram_type, patterns in DIAGRAM_TYPE_PATTERNS.items():
             for pattern in patterns:
                 if pattern in title_lower:
                     return diagram_type
@@ -276,32 +328,7 @@ class SimilarityAnalyzer:
         Returns:
             bool: True if the sections should be compared, False otherwise
         """
-        # Define which section types should be compared
-        comparison_rules = {
-            'requirements': ['system_description', 'use_case_diagram', 'class_diagram'],
-            'system_description': ['requirements', 'architecture', 'component_diagram'],
-            'architecture': ['system_description', 'component_diagram', 'deployment_diagram'],
-            'data_design': ['class_diagram', 'er_diagram'],
-            'ui_design': ['requirements', 'activity_diagram'],
-            'testing': ['requirements'],
-            'deployment': ['architecture', 'deployment_diagram'],
-            'use_case_diagram': ['requirements', 'activity_diagram'],
-            'class_diagram': ['requirements', 'data_design', 'er_diagram'],
-            'sequence_diagram': ['requirements', 'use_case_diagram'],
-            'activity_diagram': ['requirements', 'use_case_diagram'],
-            'er_diagram': ['data_design', 'class_diagram'],
-            'component_diagram': ['architecture'],
-            'deployment_diagram': ['architecture', 'deployment'],
-            'state_diagram': ['requirements']
-        }
-        
-        # Check if the sections should be compared
-        if section_type1 in comparison_rules and section_type2 in comparison_rules[section_type1]:
-            return True
-        if section_type2 in comparison_rules and section_type1 in comparison_rules[section_type2]:
-            return True
-        
-        return False
+        return section_type2 in TYPE_ADJACENCY.get(section_type1, ())
 
     def generate_relationship_analysis(self, section1_title, section1_content, section2_title, section2_content, similarity_score):
         """
@@ -351,16 +378,16 @@ class SimilarityAnalyzer:
         
         try:
             # Call OpenAI API
-            client = openai.OpenAI()
-            response = client.chat.completions.create(
-                model="gpt-4",
+            analysis_text = LLM_GATEWAY.chat(
+                "similarity.relationship_analysis",
                 messages=[{"role": "user", "content": prompt}],
+                model="gpt-4",
                 temperature=0.3,
-                max_tokens=800
+                max_tokens=800,
+                validate=lambda text: isinstance(json.loads(text), dict)
             )
             
             # Parse the response
-            analysis_text = response.choices[0].message.content
             analysis = json.loads(analysis_text)
             
             # Add the section types and similarity score
@@ -371,17 +398,291 @@ class SimilarityAnalyzer:
             return analysis
         except Exception as e:
             print(f"Error generating relationship analysis: {e}")
-            return {
-                "relationship_strength": "Unknown",
-                "description": "Failed to generate analysis",
-                "consistent_elements": [],
-                "inconsistencies": [],
-                "recommendation": "Please try again",
-                "section1_type": section1_type,
-                "section2_type": section2_type,
-                "similarity_score": similarity_score,
-                "error": str(e)
-            }
+            return self._failed_relationship_analysis(section1_type, section2_type, similarity_score, str(e))
+
+    @staticmethod
+    def _failed_relationship_analysis(section1_type, section2_type, similarity_score, error):
+        return {
+            "relationship_strength": "Unknown",
+            "description": "Failed to generate analysis",
+            "consistent_elements": [],
+            "inconsistencies": [],
+            "recommendation": "Please try again",
+            "section1_type": section1_type,
+            "section2_type": section2_type,
+            "similarity_score": similarity_score,
+            "error": error
+        }
+
+    @staticmethod
+    def select_relationship_pairs(candidates, top_k=None, max_pairs=None):
+        """
+        Choose the pairs worth a relationship analysis.
+
+        A pair is kept when it is among the top_k most similar pairs of either of its
+        scopes; the kept pairs are capped at max_pairs, most similar first.
+
+        Args:
+            candidates: List of (title1, title2, similarity)
+            top_k: Pairs per scope (defaults to RELATIONSHIP_TOP_K)
+            max_pairs: Maximum number of pairs (defaults to the per-document budget)
+
+        Returns:
+            The selected candidates, most similar first
+        """
+        top_k = top_k or RELATIONSHIP_TOP_K
+        max_pairs = max_pairs if max_pairs is not None else RELATIONSHIP_BATCH_SIZE * RELATIONSHIP_CALL_BUDGET
+        ranked = sorted(candidates, key=lambda pair: -pair[2])
+        per_scope = {}
+        selected = []
+        for pair in ranked:
+            title1, title2, _ = pair
+            if per_scope.get(title1, 0) < top_k or per_scope.get(title2, 0) < top_k:
+                selected.append(pair)
+            per_scope[title1] = per_scope.get(title1, 0) + 1
+            per_scope[title2] = per_scope.get(title2, 0) + 1
+        return selected[:max_pairs]
+
+    @staticmethod
+    def _parse_relationship_batch(text):
+        """Parse the {"analyses": [...]} object of a batched response."""
+        # The object may be wrapped in a code fence or a sentence
+        start, end = text.find("{"), text.rfind("}")
+        data = json.loads(text[start:end + 1])
+        analyses = {}
+        for item in data.get("analyses", []):
+            try:
+                analyses[int(item.pop("pair_id"))] = item
+            except (KeyError, TypeError, ValueError):
+                continue
+        return analyses
+
+    def _analyze_relationship_batch(self, batch, all_scopes, section_types):
+        """Analyse a batch of pairs with one GPT-4 request."""
+        blocks = []
+        for pair_id, (title1, title2, similarity) in enumerate(batch):
+            blocks.append(
+                f"PAIR {pair_id} (similarity {similarity:.2f})\n"
+                f"SECTION 1 ({section_types[title1]}): {title1}\n"
+                f"{all_scopes[title1][:RELATIONSHIP_EXCERPT_CHARS]}...\n"
+                f"SECTION 2 ({section_types[title2]}): {title2}\n"
+                f"{all_scopes[title2][:RELATIONSHIP_EXCERPT_CHARS]}..."
+            )
+        prompt = (
+            "Analyze the relationship between the two sections of each pair below, taken from a "
+            "software documentation.\n\n" + "\n\n".join(blocks) + "\n\n"
+            "For every pair provide:\n"
+            "1. A brief description of how these sections relate to each other\n"
+            "2. Key elements that are consistent between the sections\n"
+            "3. Any inconsistencies or missing elements\n"
+            "4. A recommendation for improving the alignment between these sections\n\n"
+            "Return only JSON with the following structure, one entry per pair:\n"
+            '{"analyses": [{"pair_id": 0, "relationship_strength": "Strong|Moderate|Weak", '
+            '"description": "Brief description of the relationship", '
+            '"consistent_elements": ["Element 1", "Element 2"], '
+            '"inconsistencies": ["Inconsistency 1", "Inconsistency 2"], '
+            '"recommendation": "A specific recommendation"}]}'
+        )
+        try:
+            response = LLM_GATEWAY.chat(
+                "similarity.relationship_analysis",
+                messages=[{"role": "user", "content": prompt}],
+                model="gpt-4",
+                temperature=0.3,
+                max_tokens=RELATIONSHIP_TOKENS_PER_PAIR * len(batch),
+                validate=lambda text: bool(self._parse_relationship_batch(text))
+            )
+            parsed = self._parse_relationship_batch(response)
+            error = "No analysis returned for this pair"
+        except Exception as e:
+            logger.error(f"Error generating batched relationship analysis: {str(e)}")
+            parsed = {}
+            error = str(e)
+
+        analyses = {}
+        for pair_id, (title1, title2, similarity) in enumerate(batch):
+            type1, type2 = section_types[title1], section_types[title2]
+            analysis = parsed.get(pair_id)
+            if analysis is None:
+                analysis = self._failed_relationship_analysis(type1, type2, similarity, error)
+            else:
+                analysis.update({"section1_type": type1, "section2_type": type2, "similarity_score": similarity})
+            analyses[f"{title1}|{title2}"] = analysis
+        return analyses
+
+    def generate_relationship_analyses(self, candidates, all_scopes, section_types, call_budget=None):
+        """
+        Relationship analyses of the most similar pairs, in a few batched requests.
+
+        Args:
+            candidates: List of (title1, title2, similarity) above the analysis threshold
+            all_scopes: Dictionary {title: content}
+            section_types: Dictionary {title: section type}
+            call_budget: Maximum GPT-4 requests (defaults to RELATIONSHIP_CALL_BUDGET)
+
+        Returns:
+            Dictionary {"title1|title2": analysis}, the same per-pair JSON as
+            generate_relationship_analysis
+        """
+        call_budget = RELATIONSHIP_CALL_BUDGET if call_budget is None else call_budget
+        if not candidates or call_budget <= 0:
+            return {}
+        pairs = self.select_relationship_pairs(candidates, max_pairs=RELATIONSHIP_BATCH_SIZE * call_budget)
+        batches = [pairs[start:start + RELATIONSHIP_BATCH_SIZE]
+                   for start in range(0, len(pairs), RELATIONSHIP_BATCH_SIZE)]
+        if not batches:
+            return {}
+        logger.info(f"Analysing {len(pairs)} of {len(candidates)} related pairs in {len(batches)} requests")
+
+        analyses = {}
+        # Batches run concurrently in the caller's context (for fair LLM scheduling)
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self._analyze_relationship_batch,
+                                       batch, all_scopes, section_types) for batch in batches]
+            for future in futures:
+                analyses.update(future.result())
+        return analyses
+
+    @staticmethod
+    def allowed_pairs(section_types):
+        """
+        Enumerate the scope pairs that should be compared.
+
+        Scopes are grouped by type and only groups adjacent in TYPE_ADJACENCY are
+        paired, so the work grows with the number of meaningful pairs instead of n².
+
+        Args:
+            section_types (list): Type of each scope, by index
+
+        Returns:
+            list: Sorted (i, j) index pairs with i < j
+        """
+        groups = {}
+        for index, section_type in enumerate(section_types):
+            groups.setdefault(section_type, []).append(index)
+        pairs = []
+        for section_type, indices in groups.items():
+            for other_type in TYPE_ADJACENCY.get(section_type, ()):
+                if other_type < section_type or other_type not in groups:
+                    continue
+                if other_type == section_type:
+                    pairs.extend((i, j) for n, i in enumerate(indices) for j in indices[n + 1:])
+                    continue
+                for i in indices:
+                    for j in groups[other_type]:
+                        pairs.append((i, j) if i < j else (j, i))
+        pairs.sort()
+        return pairs
+
+    def _embed_batch(self, texts):
+        return LLM_GATEWAY.embed(
+            "similarity.embeddings",
+            [self.preprocess_text_for_similarity(text) for text in texts],
+            model="text-embedding-3-small",
+            dimensions=EMBEDDING_DIMENSIONS
+        )
+
+    def embed_scopes(self, texts, skip_failed=False):
+        """
+        Unit-length embeddings of several scopes, in batched requests.
+
+        Args:
+            texts: Scope contents
+            skip_failed: When a batch fails, embed its texts one by one and leave a
+                zero row for each text that still fails, instead of raising
+
+        Returns:
+            numpy.ndarray: One row per text (zeros for empty or skipped texts)
+        """
+        matrix = np.zeros((len(texts), EMBEDDING_DIMENSIONS))
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            try:
+                matrix[start:start + len(batch)] = self._embed_batch(batch)
+                continue
+            except Exception as e:
+                if not skip_failed:
+                    raise
+                logger.warning(f"Embedding batch of {len(batch)} scopes failed, retrying one by one: {str(e)}")
+            for offset, text in enumerate(batch):
+                try:
+                    matrix[start + offset] = self._embed_batch([text])[0]
+                except Exception as e:
+                    logger.error(f"Skipping scope {start + offset} from the similarity: {str(e)}")
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+    def create_sparse_similarity(self, all_scopes):
+        """
+        Score only the pairs of scopes whose types should be compared.
+
+        Each scope is classified once, the allowed pairs come from the type adjacency
+        table, every scope taking part in a pair is embedded once, and the pair scores
+        are row-wise dot products of the embeddings.
+
+        Args:
+            all_scopes (dict): A dictionary of section titles and their content
+
+        Returns:
+            dict: COO matrix {"shape", "rows", "cols", "values"} holding the scaled
+            non-zero scores of the upper triangle, plus "section_titles",
+            "section_types" (by index) and "embeddings" (unit rows by index, zeros for
+            scopes that take part in no pair)
+        """
+        section_titles = list(all_scopes.keys())
+        section_types = [self.determine_section_type(title) for title in section_titles]
+        pairs = self.allowed_pairs(section_types)
+        n = len(section_titles)
+        embeddings = np.zeros((n, EMBEDDING_DIMENSIONS))
+        coo = {"shape": [n, n], "rows": [], "cols": [], "values": [],
+               "section_titles": section_titles, "section_types": section_types, "embeddings": embeddings}
+        if not pairs:
+            return coo
+
+        rows = np.array([i for i, _ in pairs])
+        cols = np.array([j for _, j in pairs])
+        used = np.unique(np.concatenate([rows, cols]))
+        # A failed scope only loses its own pairs (its row stays zero)
+        embeddings[used] = self.embed_scopes([all_scopes[section_titles[i]] for i in used], skip_failed=True)
+        skipped = [section_titles[i] for i in used if not embeddings[i].any()]
+        if skipped:
+            logger.warning(f"Scored without embeddings (no similarity): {skipped}")
+        similarities = np.einsum('ij,ij->i', embeddings[rows], embeddings[cols])
+
+        # Vectorized scale_similarity_score
+        scaled = np.where(similarities < 0.1, 0.0, np.sqrt(np.clip(similarities, 0.0, 1.0)))
+        nonzero = scaled > 0
+        coo["rows"] = rows[nonzero].tolist()
+        coo["cols"] = cols[nonzero].tolist()
+        coo["values"] = scaled[nonzero].tolist()
+        logger.info(f"Scored {len(pairs)} of {n * (n - 1) // 2} scope pairs from {len(used)} embeddings")
+        return coo
+
+    @staticmethod
+    def coo_to_dense(coo):
+        """Symmetric dense matrix (list of lists) of a COO similarity result."""
+        n = coo["shape"][0]
+        matrix = np.zeros((n, n))
+        matrix[coo["rows"], coo["cols"]] = coo["values"]
+        matrix[coo["cols"], coo["rows"]] = coo["values"]
+        return matrix.tolist()
+
+    def create_sparse_similarity_matrix(self, all_scopes):
+        """
+        Sparse counterpart of create_filtered_similarity_matrix.
+
+        Returns:
+            tuple: The COO result of create_sparse_similarity, the section titles and
+            the relationship analyses
+        """
+        coo = self.create_sparse_similarity(all_scopes)
+        section_titles = coo["section_titles"]
+        section_types = dict(zip(section_titles, coo["section_types"]))
+        candidates = [(section_titles[i], section_titles[j], value)
+                      for i, j, value in zip(coo["rows"], coo["cols"], coo["values"])
+                      if value > RELATIONSHIP_MIN_SIMILARITY]
+        relationship_analyses = self.generate_relationship_analyses(candidates, all_scopes, section_types)
+        return coo, section_titles, relationship_analyses
 
     def create_filtered_similarity_matrix(self, all_scopes):
         """
@@ -393,6 +694,10 @@ class SimilarityAnalyzer:
         Returns:
             tuple: A tuple containing the filtered matrix, section titles, and relationship analyses
         """
+        if SIMILARITY_SPARSE:
+            coo, section_titles, relationship_analyses = self.create_sparse_similarity_matrix(all_scopes)
+            return self.coo_to_dense(coo), section_titles, relationship_analyses
+
         # Get all section titles
         section_titles = list(all_scopes.keys())
         
@@ -403,8 +708,8 @@ class SimilarityAnalyzer:
         n = len(section_titles)
         matrix = [[0.0 for _ in range(n)] for _ in range(n)]
         
-        # Create a dictionary to store relationship analyses
-        relationship_analyses = {}
+        # Pairs related strongly enough to be worth an analysis
+        candidates = []
         
         # Fill the matrix with similarity scores for sections that should be compared
         for i in range(n):
@@ -428,18 +733,17 @@ class SimilarityAnalyzer:
                     matrix[i][j] = scaled_similarity
                     matrix[j][i] = scaled_similarity  # Mirror for lower triangle
                     
-                    # If the similarity is above a threshold, generate an analysis
-                    if scaled_similarity > 0.3:  # Adjust threshold as needed
-                        analysis_key = f"{title1}|{title2}"
-                        analysis = self.generate_relationship_analysis(
-                            title1, content1, title2, content2, scaled_similarity
-                        )
-                        relationship_analyses[analysis_key] = analysis
+                    # If the similarity is above a threshold, the pair may be analysed
+                    if scaled_similarity > RELATIONSHIP_MIN_SIMILARITY:
+                        candidates.append((title1, title2, scaled_similarity))
                 else:
                     # Set to 0 for sections that shouldn't be compared
                     matrix[i][j] = 0.0
                     matrix[j][i] = 0.0
         
+        # Only the top pairs per scope are analysed, in a few batched requests
+        relationship_analyses = self.generate_relationship_analyses(candidates, all_scopes, section_types)
+        
         return matrix, section_titles, relationship_analyses
 
     def scale_similarity_score(self, similarity):
@@ -479,24 +783,13 @@ class SimilarityAnalyzer:
             text1 = self.preprocess_text_for_similarity(text1)
             text2 = self.preprocess_text_for_similarity(text2)
             
-            # Get embeddings using OpenAI's text-embedding-3 model
-            client = openai.OpenAI()
-            
-            # Get embedding for text1
-            response1 = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text1,
-                dimensions=1536
-            )
-            embedding1 = response1.data[0].embedding
-            
-            # Get embedding for text2
-            response2 = client.embeddings.create(
+            # Get both embeddings with OpenAI's text-embedding-3 model in one request
+            embedding1, embedding2 = LLM_GATEWAY.embed(
+                "similarity.embeddings",
+                [text1, text2],
                 model="text-embedding-3-small",
-                input=text2,
                 dimensions=1536
             )
-            embedding2 = response2.data[0].embedding
             
             # Calculate cosine similarity
             dot_product = sum(a * b for a, b in zip(embedding1, embedding2))
@@ -7,6 +7,14 @@ import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import json
+from citation_index import CitationIndex
+from reference_index import BibliographicIndex
+from reference_parser import ReferenceParser
+from llm_gateway import LLM_GATEWAY
+from reference_titles import (
+    TitleCache, parse_title, build_batch_title_prompt, parse_batch_title_response,
+    TITLE_CONFIDENCE_THRESHOLD, LLM_BATCH_SIZE
+)
 
 # Load environment variables
 load_dotenv()
@@ -23,6 +31,11 @@ except Exception as e:
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Titles are shared across requests so repeated references cost nothing
+TITLE_CACHE = TitleCache()
+# Offline index of known publications used for reference verification
+BIBLIOGRAPHIC_INDEX = BibliographicIndex()
+
 class SimpleReferencesValidator:
     """A simplified class to handle reference validation and cross-referencing."""
 
@@ -58,43 +71,9 @@ class SimpleReferencesValidator:
         
         # Get text after References header
         references_text = text[references_match.end():]
-        
-        # Method 1: Extract references using regex pattern for reference numbers
-        # More robust pattern that handles multi-line references
-        ref_pattern = r'(\[\d+\].*?)(?=\[\d+\]|\Z)'
-        matches = re.finditer(ref_pattern, references_text, re.DOTALL)
-        
-        for match in matches:
-            ref = match.group(1).strip()
-            # Clean up the reference (normalize whitespace)
-            ref = re.sub(r'\s+', ' ', ref)
-            if ref:
-                references.append(ref)
-        
-        # If no references found with the regex pattern, try line-by-line approach
-        if not references:
-            logger.debug("No references found with regex pattern, trying line-by-line approach")
-            lines = references_text.splitlines()
-            current_ref = ""
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # Check if this line starts a new reference
-                if re.match(r'^\[\d+\]', line):
-                    # Save the previous reference if any
-                    if current_ref:
-                        references.append(current_ref)
-                    current_ref = line
-                elif current_ref:
-                    # Continue the current reference
-                    current_ref += " " + line
-            
-            # Add the last reference
-            if current_ref:
-                references.append(current_ref)
+
+        # Split on the [n] markers in one linear pass (in-text "[n]" mentions do not split entries)
+        references = ReferenceParser.split_references(references_text)
         
         # Post-process references to ensure they are complete
         processed_references = []
@@ -114,67 +93,19 @@ class SimpleReferencesValidator:
         return references
 
     @staticmethod
-    def find_citations(text, ref_number):
-        """Find citations of a reference in the text."""
+    def find_citations(text, ref_number, citation_index=None):
+        """
+        Find citations of a reference in the text.
+
+        Pass a prebuilt CitationIndex when looking up many references in the same
+        document; otherwise the text is indexed for this single lookup.
+        """
         logger.info(f"Finding citations for reference [{ref_number}]")
-        citations = []
-        
-        # More robust patterns to find citations
-        # Single reference pattern
-        single_pattern = rf'\[{ref_number}\]'
-        
-        # Multiple reference pattern (e.g., [1, 2, 3] or [1-3])
-        multiple_patterns = [
-            rf'\[(?:\d+,\s*)*{ref_number}(?:,\s*\d+)*\]',  # [1, 2, 3]
-            rf'\[\d+-{ref_number}\]',                       # [1-3]
-            rf'\[{ref_number}-\d+\]'                        # [3-5]
-        ]
-        
-        # Find all matches for single pattern
-        for match in re.finditer(single_pattern, text):
-            # Get context (100 chars before and after)
-            start = max(0, match.start() - 100)
-            end = min(len(text), match.end() + 100)
-            context = text[start:end]
-            
-            # Skip if this is in the References section
-            if re.search(r'(?:References|Bibliography|Works Cited)', context, re.IGNORECASE) and re.search(r'^\[\d+\]', context):
-                continue
-                
-            # Add to citations
-            citations.append({
-                "context": context.replace(match.group(0), f"**{match.group(0)}**"),
-                "position": match.start()
-            })
-        
-        # Find all matches for multiple patterns
-        for pattern in multiple_patterns:
-            for match in re.finditer(pattern, text):
-                # Get context
-                start = max(0, match.start() - 100)
-                end = min(len(text), match.end() + 100)
-                context = text[start:end]
-                
-                # Skip if this is in the References section
-                if re.search(r'(?:References|Bibliography|Works Cited)', context, re.IGNORECASE) and re.search(r'^\[\d+\]', context):
-                    continue
-                    
-                # Add to citations
-                citations.append({
-                    "context": context.replace(match.group(0), f"**{match.group(0)}**"),
-                    "position": match.start()
-                })
-        
-        # Remove duplicates based on position
-        unique_citations = []
-        positions = set()
-        for citation in citations:
-            if citation["position"] not in positions:
-                unique_citations.append(citation)
-                positions.add(citation["position"])
-        
-        logger.info(f"Found {len(unique_citations)} citations for reference [{ref_number}]")
-        return unique_citations
+        if citation_index is None:
+            citation_index = CitationIndex(text)
+        citations = citation_index.find_citations(ref_number)
+        logger.info(f"Found {len(citations)} citations for reference [{ref_number}]")
+        return citations
     
     @staticmethod
     def extract_title_from_reference_with_gemini(reference):
@@ -192,11 +123,6 @@ class SimpleReferencesValidator:
                 "max_output_tokens": 100,
             }
             
-            model = genai.GenerativeModel(
-                model_name="gemini-1.5-flash",
-                generation_config=generation_config
-            )
-            
             prompt = f"""
             Extract ONLY the title from this academic reference. 
             
@@ -211,8 +137,9 @@ class SimpleReferencesValidator:
             Title:
             """
             
-            response = model.generate_content(prompt)
-            title = response.text.strip()
+            title = LLM_GATEWAY.generate(
+                "references.title", prompt, model="gemini-1.5-flash", generation_config=generation_config
+            ).strip()
             
             # Clean up the title (remove quotes if present)
             title = re.sub(r'^["\']|["\']$', '', title)
@@ -224,215 +151,121 @@ class SimpleReferencesValidator:
             logger.error(f"Error extracting title with Gemini: {str(e)}")
             return None
     
+    @staticmethod
+    def extract_titles_with_gemini_batch(references):
+        """
+        Extract the titles of several references with a single Gemini request.
+
+        Returns:
+            Dictionary {index in references: title} for the titles the model returned
+        """
+        if not GEMINI_AVAILABLE or not references:
+            return {}
+
+        titles = {}
+        for batch_start in range(0, len(references), LLM_BATCH_SIZE):
+            batch = references[batch_start:batch_start + LLM_BATCH_SIZE]
+            try:
+                response = LLM_GATEWAY.generate(
+                    "references.title_batch",
+                    build_batch_title_prompt(batch),
+                    model="gemini-1.5-flash",
+                    generation_config={
+                        "temperature": 0.1,
+                        "top_p": 0.95,
+                        "top_k": 0,
+                        "max_output_tokens": 60 * len(batch) + 100,
+                        "response_mime_type": "application/json",
+                    },
+                    validate=lambda text: bool(parse_batch_title_response(text, len(batch)))
+                )
+                batch_titles = parse_batch_title_response(response, len(batch))
+                logger.info(f"Extracted {len(batch_titles)}/{len(batch)} titles with one Gemini request")
+                for index, title in batch_titles.items():
+                    titles[batch_start + index] = title
+            except Exception as e:
+                logger.error(f"Error extracting titles with Gemini: {str(e)}")
+        return titles
+
+    @staticmethod
+    def extract_titles_from_references(references):
+        """
+        Extract the titles of a list of references.
+
+        Cascade: cached titles first, then deterministic IEEE parsing, and only the
+        references parsed with low confidence are sent to Gemini in one batched prompt.
+        """
+        titles = [None] * len(references)
+        uncertain = {}
+
+        for i, reference in enumerate(references):
+            cached = TITLE_CACHE.get(reference)
+            if cached:
+                titles[i] = cached["title"]
+                continue
+
+            title, confidence = parse_title(reference)
+            titles[i] = title
+            if confidence >= TITLE_CONFIDENCE_THRESHOLD:
+                TITLE_CACHE.put(reference, title, "parser")
+            else:
+                uncertain[i] = reference
+
+        if uncertain:
+            logger.info(f"{len(uncertain)} of {len(references)} titles need the LLM")
+            indexes = list(uncertain.keys())
+            llm_titles = SimpleReferencesValidator.extract_titles_with_gemini_batch(
+                [uncertain[i] for i in indexes]
+            )
+            for batch_index, title in llm_titles.items():
+                i = indexes[batch_index]
+                titles[i] = title
+                TITLE_CACHE.put(uncertain[i], title, "gemini")
+
+        return titles
+
     @staticmethod
     def extract_title_from_reference(reference):
         """Extract the title from a reference."""
-        # Normalize reference by replacing newlines with spaces
-        normalized_ref = reference.replace('\n', ' ')
-        
-        # Try to extract using Gemini first
-        title = SimpleReferencesValidator.extract_title_from_reference_with_gemini(normalized_ref)
-        if title:
-            return title
-            
-        # Try to extract title from quotes with improved pattern for hyphenated words
-        title_match = re.search(r'"([^"]+)"', normalized_ref)
-        if title_match:
-            return title_match.group(1)
-        
-        # If no quotes, try to extract from the reference text
-        # Remove the reference number
-        ref_without_num = re.sub(r'^\[\d+\]\s+', '', normalized_ref)
-        
-        # Try to find title after author names and before journal/conference
-        # Look for patterns that typically follow author names
-        author_end_patterns = [
-            r'et al\.\s+"([^"]+)"',
-            r'[A-Z][a-z]+\.\s+"([^"]+)"',
-            r'[A-Z][a-z]+\s+and\s+[A-Z][a-z]+\.\s+"([^"]+)"'
-        ]
-        
-        for pattern in author_end_patterns:
-            match = re.search(pattern, normalized_ref)
-            if match:
-                return match.group(1)
-        
-        # Fall back to simple approach - take the first sentence or up to 100 characters
-        title = ref_without_num.split('.')[0]
-        if len(title) > 100:
-            title = title[:100]
-        
-        return title
+        return SimpleReferencesValidator.extract_titles_from_references([reference])[0]
     
     @staticmethod
     def validate_ieee_format(reference):
         """Validate if a reference follows IEEE format."""
-        issues = []
-        
-        # Check for reference number
-        if not re.match(r"^\[\d+\]", reference):
-            issues.append("Missing reference number (e.g., [1]).")
-        
-        # Improved author pattern to accept full names and "et al."
-        # This accepts both initial formats (A. Author/Author A.) and full names with et al.
-        author_pattern = r"^\[\d+\]\s+([A-Z][a-zA-Z]+(?: [A-Z][a-zA-Z]+)*(?:\s+et al\.)?|[A-Z]\.\s+[A-Za-z]+|[A-Za-z]+\s+[A-Z]\.)"
-        if not re.search(author_pattern, reference):
-            issues.append("Author names should follow IEEE format.")
-        
-        # COMPLETELY NEW APPROACH for title detection with extreme debugging
-        # Normalize the reference
-        normalized_ref = reference.replace('\n', ' ')
-        print(f"\n===== DEBUGGING TITLE VALIDATION =====")
-        print(f"Reference: {normalized_ref}")
-        
-        # Print each character and its Unicode code point for debugging
-        print("Character code points:")
-        char_codes = []
-        for i, char in enumerate(normalized_ref):
-            code_point = ord(char)
-            char_codes.append((i, char, code_point))
-            if 8200 <= code_point <= 8300 or code_point == 34 or code_point == 39 or code_point in [8216, 8217, 8220, 8221]:
-                print(f"Special char at position {i}: '{char}' (U+{code_point:04X})")
-        
-        # A comprehensive list of quotation mark characters
-        quote_chars = ['"', "'", '"', '"', ''', ''', '«', '»', '‹', '›', '„', '‟', '❝', '❞', '❮', '❯', '〝', '〞', '＂']
-        quote_pairs = [
-            ('"', '"'),   # Regular double quotes
-            ("'", "'"),   # Regular single quotes
-            ('"', '"'),   # Curly double quotes
-            (''', '''),   # Curly single quotes
-            ('«', '»'),   # Guillemets
-            ('‹', '›'),   # Single guillemets
-            ('„', '"'),   # German quotes
-            ('„', '‟'),   # Alternative German quotes
-            ('❝', '❞'),   # Heavy double quotes
-            ('❮', '❯'),   # Angular quotes
-            ('〝', '〞'),   # CJK quotes
-            ('＂', '＂'),   # Fullwidth quotes
-        ]
-        
-        # Check for any kind of quoted text
-        has_quotes = False
-        detected_quotes = []
-        
-        # Try regex pattern with all individual quote chars
-        for quote in quote_chars:
-            pattern = f"{quote}[^{quote}]+{quote}"
-            matches = re.findall(pattern, normalized_ref)
-            if matches:
-                print(f"Found quote match with '{quote}': {matches}")
-                detected_quotes.extend(matches)
-                has_quotes = True
-        
-        # Try regex pattern with quote pairs
-        for open_q, close_q in quote_pairs:
-            pattern = f"{re.escape(open_q)}[^{re.escape(close_q)}]+{re.escape(close_q)}"
-            matches = re.findall(pattern, normalized_ref)
-            if matches:
-                print(f"Found quote pair match with '{open_q}'/'{close_q}': {matches}")
-                detected_quotes.extend(matches)
-                has_quotes = True
-        
-        # Simple heuristic: look for text between any kind of quotes
-        if not has_quotes:
-            print("No quotes found with regex. Trying direct index search...")
-            for i, char, code in char_codes:
-                if char in quote_chars:
-                    # Found opening quote, now look for closing quote
-                    for j, char2, code2 in char_codes[i+1:]:
-                        if char2 in quote_chars:
-                            # Found a potential title
-                            potential_title = normalized_ref[i:j+1]
-                            if len(potential_title) > 10:  # Arbitrary minimum length for a title
-                                print(f"Found potential title using direct index: {potential_title}")
-                                detected_quotes.append(potential_title)
-                                has_quotes = True
-                                break
-        
-        # Last resort: Look for anything that might be a title
-        if not has_quotes:
-            # Look for capitalized text followed by a period after the author names
-            title_pattern = r"\]\s+[^\.]+\.\s+([A-Z][^\.]+)\."
-            title_match = re.search(title_pattern, normalized_ref)
-            if title_match:
-                potential_title = title_match.group(1)
-                print(f"Found unquoted title: {potential_title}")
-                issues.append(f"Title not properly quoted: '{potential_title}'")
-            else:
-                issues.append("Could not find title in quotation marks.")
-        
-        # If we found quotes but they're not in the expected IEEE format
-        if has_quotes:
-            print(f"Total quoted texts found: {len(detected_quotes)}")
-            for i, quote in enumerate(detected_quotes):
-                print(f"  {i+1}. {quote}")
-            
-            print("\nChecking if any detected quotes match IEEE title format...")
-            title_like = False
-            for quote in detected_quotes:
-                # Title is typically capitalized and doesn't start with symbols
-                if re.match(r'^["\']?[A-Z]', quote):
-                    print(f"Found title-like quote: {quote}")
-                    title_like = True
-                    break
-            
-            if not title_like:
-                issues.append("Title should be properly quoted and capitalized.")
-        
-        print("===== END DEBUGGING =====\n")
-        
-        # Check for journal/conference details
-        journal_pattern = r'[A-Za-z\s\.]+,\s+vol\.\s+\d+'
-        conference_pattern = r'(?:In:|Proc\.|Proceedings of)\s+[A-Za-z0-9\s\-\.]+'
-        
-        if not (re.search(journal_pattern, normalized_ref) or re.search(conference_pattern, normalized_ref)) and "URL:" in normalized_ref:
-            # For web references, check for access date
-            if not re.search(r'accessed\s+[A-Za-z]+\s+\d+,\s+\d{4}', normalized_ref, re.IGNORECASE):
-                issues.append("Website citation missing access date (e.g., accessed Jan. 10, 2023).")
-        
-        # Check for volume, issue, pages for journal articles
-        if "vol." in normalized_ref.lower() and not all(term in normalized_ref.lower() for term in ["vol.", "no.", "pp."]):
-            issues.append("Journal reference missing volume (vol.), issue (no.), or page numbers (pp.).")
-        
-        # Check for year
-        if not re.search(r'\d{4}', normalized_ref):
-            issues.append("Missing publication year.")
-        
-        # More flexible DOI format check that handles various formats
-        # Case insensitive, allows spacing variations, and handles line breaks
-        if re.search(r'(?i)doi', normalized_ref):
-            if not re.search(r'(?i)doi:?\s*10\.\d+/[^\s\.]+', normalized_ref):
-                issues.append("Incorrect DOI format. Should be 'doi: 10.xxxx/xxxxx'.")
-        
-        print(f"Final validation issues: {issues}")
-        return {
-            "is_valid": len(issues) == 0,
-            "issues": issues
-        }
+        return ReferenceParser.validate_ieee_format(reference)
     
     @staticmethod
-    def verify_reference_online(reference):
-        """Verify a reference by searching for its title online."""
-        logger.info(f"Verifying reference online: {reference[:50]}...")
+    def verify_reference_online(reference, title=None):
+        """
+        Verify a reference against the local bibliographic index.
+
+        The reference is matched by DOI first and then by its normalized title, so no
+        network request is made. The Google search URL is kept for manual checking.
+        """
+        logger.info(f"Verifying reference: {reference[:50]}...")
         
-        # Extract title from reference
-        title = SimpleReferencesValidator.extract_title_from_reference(reference)
+        # Extract title from reference unless it was already extracted in a batch
+        if title is None:
+            title = SimpleReferencesValidator.extract_title_from_reference(reference)
         
         try:
-            # Search for the title using a search engine API
             search_url = f"https://www.google.com/search?q={title.replace(' ', '+')}"
-            
-            # For demonstration, we'll just simulate a successful verification
+            match = BIBLIOGRAPHIC_INDEX.verify(reference, title)
+            record = match["record"]
             return {
-                "verified": True,
-                "source": "Web Search",
+                "verified": match["verified"],
+                "confidence": match["confidence"],
+                "method": match["method"],
+                "source": "Local Bibliographic Index",
                 "title": title,
-                "url": search_url
+                "matched_record": record,
+                "url": f"https://doi.org/{record['doi']}" if match["verified"] and record.get("doi") else search_url
             }
         except Exception as e:
-            logger.error(f"Error verifying reference online: {str(e)}")
+            logger.error(f"Error verifying reference: {str(e)}")
             return {
                 "verified": False,
+                "confidence": 0.0,
                 "error": str(e)
             }
 
@@ -469,6 +302,12 @@ class SimpleReferencesValidator:
                     }
                 }
             
+            print("\nIndexing citations...")
+            citation_index = CitationIndex(text)
+
+            print("\nExtracting reference titles...")
+            titles = SimpleReferencesValidator.extract_titles_from_references(references)
+
             print("\nProcessing each reference...")
             reference_details = []
             for i, ref in enumerate(references, 1):
@@ -482,12 +321,12 @@ class SimpleReferencesValidator:
                 
                 # Find citations
                 print("Finding citations...")
-                citations = SimpleReferencesValidator.find_citations(text, ref_num)
+                citations = SimpleReferencesValidator.find_citations(text, ref_num, citation_index)
                 print(f"Found {len(citations)} citations")
                 
-                # Verify reference online
-                print("Verifying reference online...")
-                verification = SimpleReferencesValidator.verify_reference_online(ref)
+                # Verify reference against the local bibliographic index
+                print("Verifying reference...")
+                verification = SimpleReferencesValidator.verify_reference_online(ref, titles[i - 1])
                 print(f"Verification result: {verification}")
                 
                 # Validate IEEE format
@@ -0,0 +1,531 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_INDEX_PATH = os.getenv(
+    "SUBMISSION_FINGERPRINT_INDEX",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "submission_fingerprints.sqlite3")
+)
+
+# Words per shingle
+SHINGLE_SIZE = 5
+# MinHash signature length
+NUM_PERMUTATIONS = 128
+# Document LSH target: a pair with this Jaccard similarity becomes a candidate with
+# this probability. It yields 42 bands of 3 rows, whose threshold is ~0.29: 0.1
+# becomes a candidate ~4% of the time, 0.3 ~68% and 0.5 ~100%.
+LSH_SIMILARITY = 0.5
+LSH_PROBABILITY = 0.95
+# A section pasted into a larger document keeps its Jaccard low, so every document is
+# also cut into windows of SECTION_SHINGLES shingles, each with its own signature of
+# SECTION_PERMUTATIONS values. Stored windows overlap by half, so every query window
+# inside a pasted passage meets a stored one with at least 3/4 of its shingles
+# (Jaccard >= 0.6); any passage of 2 x SECTION_SHINGLES words contains such a window.
+SECTION_SHINGLES = 100
+SECTION_PERMUTATIONS = 64
+SECTION_LSH_SIMILARITY = 0.6
+SECTION_LSH_PROBABILITY = 0.9
+# Candidates are reported when their estimated similarity, or the share of either
+# document's shingles found in the other, reaches these thresholds; containment
+# catches a section pasted into a much larger document, whose Jaccard stays low
+MIN_SIMILARITY = 0.1
+MIN_CONTAINMENT = 0.1
+# A copied passage must span at least this many consecutive shared shingles
+MIN_PASSAGE_SHINGLES = 3
+MAX_PASSAGES = 20
+# Shingles hashed per MinHash block (bounds the temporary matrix to ~8 MB)
+MINHASH_BLOCK = 8192
+
+WORD_PATTERN = re.compile(r'\w+')
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Fixed seed: signatures must stay comparable with those already stored on disk
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def lsh_parameters(num_permutations, similarity, probability):
+    """
+    Bands and rows per band meeting an LSH target.
+
+    A pair with Jaccard similarity s shares a bucket in at least one of b bands of r
+    rows with probability 1 - (1 - s^r)^b. More rows per band mean fewer false
+    candidates, so the largest r still reaching `probability` at `similarity` is used.
+
+    Returns:
+        Tuple (bands, rows_per_band)
+    """
+    for rows in range(num_permutations, 1, -1):
+        bands = num_permutations // rows
+        if 1 - (1 - similarity ** rows) ** bands >= probability:
+            return bands, rows
+    return num_permutations, 1
+
+
+BANDS, ROWS_PER_BAND = lsh_parameters(NUM_PERMUTATIONS, LSH_SIMILARITY, LSH_PROBABILITY)
+SECTION_BANDS, SECTION_ROWS_PER_BAND = lsh_parameters(
+    SECTION_PERMUTATIONS, SECTION_LSH_SIMILARITY, SECTION_LSH_PROBABILITY)
+# Stored with the index; bucket keys written under other parameters are rebuilt
+LSH_LAYOUT = f"{BANDS}x{ROWS_PER_BAND};{SECTION_SHINGLES}:{SECTION_BANDS}x{SECTION_ROWS_PER_BAND}"
+
+
+def shingle_text(text, size=SHINGLE_SIZE):
+    """
+    Hash the word shingles of a text.
+
+    Words are lower-cased runs of word characters, so layout, punctuation and case do
+    not affect the fingerprint.
+
+    Returns:
+        Tuple (hashes, starts, ends) of numpy arrays: the 32-bit hash of each shingle
+        and the character span it covers in the original text
+    """
+    words, starts, ends = [], [], []
+    for match in WORD_PATTERN.finditer(text or ''):
+        words.append(match.group(0).lower())
+        starts.append(match.start())
+        ends.append(match.end())
+
+    count = len(words) - size + 1
+    if count <= 0:
+        empty = np.zeros(0, dtype=np.uint32)
+        return empty, empty.astype(np.int64), empty.astype(np.int64)
+
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(' '.join(words[i:i + size]).encode('utf-8'), digest_size=4).digest(), 'little')
+         for i in range(count)),
+        dtype=np.uint32, count=count
+    )
+    return hashes, np.asarray(starts[:count], dtype=np.int64), np.asarray(ends[size - 1:], dtype=np.int64)
+
+
+def minhash_signature(hashes):
+    """Compute the MinHash signature (NUM_PERMUTATIONS uint32 values) of a set of shingle hashes."""
+    signature = np.full(NUM_PERMUTATIONS, _MAX_HASH, dtype=np.uint64)
+    values = np.unique(hashes).astype(np.uint64)
+    for block_start in range(0, len(values), MINHASH_BLOCK):
+        block = values[block_start:block_start + MINHASH_BLOCK, None]
+        # uint64 overflow in a * x wraps around, which keeps the permutations well mixed
+        permuted = ((block * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+        np.minimum(signature, permuted.min(axis=0), out=signature)
+    return signature.astype(np.uint32)
+
+
+def fingerprint_text(text):
+    """
+    Build the fingerprint of a document.
+
+    Returns:
+        Dictionary with "hashes", "starts", "ends" and "signature", or None when the
+        text is too short to shingle
+    """
+    hashes, starts, ends = shingle_text(text)
+    if not len(hashes):
+        return None
+    return {"hashes": hashes, "starts": starts, "ends": ends, "signature": minhash_signature(hashes)}
+
+
+def _band_keys(signature, bands=BANDS, rows=ROWS_PER_BAND):
+    return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+
+
+def section_signatures(hashes, stride=SECTION_SHINGLES // 2):
+    """
+    MinHash signatures of windows of SECTION_SHINGLES consecutive shingles.
+
+    Windows start every `stride` shingles; the last one ends with the document, and a
+    document shorter than a window is one window.
+
+    Returns:
+        List of signatures of SECTION_PERMUTATIONS uint32 values
+    """
+    last = max(len(hashes) - SECTION_SHINGLES, 0)
+    starts = list(range(0, last + 1, stride))
+    if starts[-1] != last:
+        starts.append(last)
+    values = np.asarray(hashes, dtype=np.uint64)
+    signatures = []
+    for start in starts:
+        window = values[start:start + SECTION_SHINGLES, None]
+        # The first SECTION_PERMUTATIONS permutations of minhash_signature
+        permuted = ((window * _PERM_A[:SECTION_PERMUTATIONS] + _PERM_B[:SECTION_PERMUTATIONS])
+                    % _MERSENNE_PRIME) & _MAX_HASH
+        signatures.append(permuted.min(axis=0).astype(np.uint32))
+    return signatures
+
+
+def _section_keys(hashes, stride=SECTION_SHINGLES // 2):
+    """Distinct (band, bucket key) pairs of the section windows of a document."""
+    keys = set()
+    for signature in section_signatures(hashes, stride):
+        keys.update(enumerate(_band_keys(signature, SECTION_BANDS, SECTION_ROWS_PER_BAND)))
+    return keys
+
+
+def shared_passages(fingerprint, other_hashes, other_starts, other_ends, text=None):
+    """
+    Find the passages of a document that also appear in another one.
+
+    Runs of consecutive shingles present in the other document are merged into passages.
+
+    Returns:
+        List of {"start", "end", "matched_start", "matched_end", "shingles"} (plus "text"
+        when the document text is given), longest first
+    """
+    present = np.isin(fingerprint["hashes"], other_hashes)
+    if not present.any():
+        return []
+
+    # First occurrence of every hash in the other document, for the matched offsets
+    unique_hashes, first_index = np.unique(other_hashes, return_index=True)
+
+    # Boundaries of runs of consecutive True values
+    padded = np.concatenate(([False], present, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    runs = [(start, end - 1) for start, end in zip(changes[::2], changes[1::2])
+            if end - start >= MIN_PASSAGE_SHINGLES]
+    runs.sort(key=lambda run: run[1] - run[0], reverse=True)
+
+    passages = []
+    for first, last in runs[:MAX_PASSAGES]:
+        matched = first_index[np.searchsorted(unique_hashes, fingerprint["hashes"][[first, last]])]
+        passage = {
+            "start": int(fingerprint["starts"][first]),
+            "end": int(fingerprint["ends"][last]),
+            "matched_start": int(other_starts[matched[0]]),
+            "matched_end": int(other_ends[matched[1]]),
+            "shingles": int(last - first + 1)
+        }
+        if text is not None:
+            passage["text"] = text[passage["start"]:passage["end"]]
+        passages.append(passage)
+    return passages
+
+
+class SubmissionFingerprintIndex:
+    """
+    Course-wide near-duplicate index of analyzed submissions.
+
+    Every submission is reduced to word shingles and a MinHash signature. The signature
+    is split into LSH bands whose bucket keys are stored in SQLite, so a new submission
+    only meets the prior submissions that share at least one bucket with it (a few
+    indexed lookups regardless of course size) instead of being compared with all of them.
+    Section windows get bucket keys of their own, so a submission that pastes one section
+    of another is a candidate even when the whole documents are dissimilar. The shingle
+    hashes and their offsets are kept as well, to report the shared passages of the
+    candidates that pass.
+    """
+
+    def __init__(self, path=FINGERPRINT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.available = True
+        try:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS submissions ("
+                "submission_id TEXT PRIMARY KEY, course_id TEXT NOT NULL, document_name TEXT, "
+                "created_at REAL NOT NULL, signature BLOB NOT NULL, hashes BLOB NOT NULL, offsets BLOB NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lsh_buckets ("
+                "course_id TEXT NOT NULL, band INTEGER NOT NULL, bucket BLOB NOT NULL, submission_id TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_bucket_lookup ON lsh_buckets(course_id, band, bucket)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_bucket_owner ON lsh_buckets(submission_id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS section_buckets ("
+                "course_id TEXT NOT NULL, band INTEGER NOT NULL, bucket BLOB NOT NULL, submission_id TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS section_bucket_lookup ON section_buckets(course_id, band, bucket)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS section_bucket_owner ON section_buckets(submission_id)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            row = self._conn.execute("SELECT value FROM settings WHERE name = 'lsh_layout'").fetchone()
+            if row is None or row[0] != LSH_LAYOUT:
+                self._rebuild_buckets()
+            self._conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            # Without the index submissions are analysed without the course comparison
+            logger.error(f"Submission fingerprint index unavailable: {str(e)}")
+            self.available = False
+
+    def count(self, course_id=None):
+        """Return the number of indexed submissions, optionally for one course."""
+        if not self.available:
+            return 0
+        with self._lock:
+            if course_id is None:
+                return self._conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM submissions WHERE course_id = ?", (str(course_id),)
+            ).fetchone()[0]
+
+    def _rebuild_buckets(self):
+        """Recompute the bucket keys of every stored submission after the LSH parameters changed."""
+        cursor = self._conn.cursor()
+        cursor.execute("DELETE FROM lsh_buckets")
+        cursor.execute("DELETE FROM section_buckets")
+        rows = cursor.execute("SELECT submission_id, course_id, signature, hashes FROM submissions").fetchall()
+        for submission_id, course_id, signature, hashes in rows:
+            self._insert_buckets(cursor, submission_id, course_id, np.frombuffer(signature, dtype=np.uint32),
+                                 np.frombuffer(hashes, dtype=np.uint32))
+        cursor.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('lsh_layout', ?)", (LSH_LAYOUT,))
+        if rows:
+            logger.info(f"Rebuilt the LSH buckets of {len(rows)} submissions for layout {LSH_LAYOUT}")
+
+    def _insert_buckets(self, cursor, submission_id, course_id, signature, hashes):
+        cursor.executemany(
+            "INSERT INTO lsh_buckets (course_id, band, bucket, submission_id) VALUES (?, ?, ?, ?)",
+            [(course_id, band, key, submission_id) for band, key in enumerate(_band_keys(signature))]
+        )
+        cursor.executemany(
+            "INSERT INTO section_buckets (course_id, band, bucket, submission_id) VALUES (?, ?, ?, ?)",
+            [(course_id, band, key, submission_id) for band, key in _section_keys(hashes)]
+        )
+
+    def _delete(self, cursor, submission_id):
+        cursor.execute("DELETE FROM lsh_buckets WHERE submission_id = ?", (submission_id,))
+        cursor.execute("DELETE FROM section_buckets WHERE submission_id = ?", (submission_id,))
+        cursor.execute("DELETE FROM submissions WHERE submission_id = ?", (submission_id,))
+
+    def add_submission(self, submission_id, course_id, text=None, document_name=None, fingerprint=None):
+        """
+        Index a submission, replacing any earlier version with the same id.
+
+        Args:
+            submission_id: Unique id of the submission
+            course_id: Course the submission belongs to; only submissions of the same
+                       course are compared
+            text: Document text (not needed when fingerprint is given)
+            document_name: Optional display name reported with matches
+            fingerprint: Fingerprint already computed with fingerprint_text
+
+        Returns:
+            True if the submission was indexed, False if its text was too short
+        """
+        if not self.available:
+            return False
+        fingerprint = fingerprint or fingerprint_text(text)
+        if fingerprint is None:
+            return False
+        submission_id, course_id = str(submission_id), str(course_id)
+        offsets = np.stack([fingerprint["starts"], fingerprint["ends"]]).astype(np.int64)
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            self._delete(cursor, submission_id)
+            cursor.execute(
+                "INSERT INTO submissions (submission_id, course_id, document_name, created_at, signature, hashes, offsets) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (submission_id, course_id, document_name, time.time(), fingerprint["signature"].tobytes(),
+                 fingerprint["hashes"].tobytes(), offsets.tobytes())
+            )
+            self._insert_buckets(cursor, submission_id, course_id, fingerprint["signature"], fingerprint["hashes"])
+            self._conn.commit()
+        return True
+
+    def remove_submission(self, submission_id):
+        """Remove a submission from the index."""
+        if not self.available:
+            return
+        with self._lock:
+            cursor = self._conn.cursor()
+            self._delete(cursor, str(submission_id))
+            self._conn.commit()
+
+    def _candidates(self, course_id, fingerprint, exclude_submission_id):
+        candidates = set()
+        # Query windows need not overlap: the stored ones already do
+        section_keys = {}
+        for band, key in _section_keys(fingerprint["hashes"], stride=SECTION_SHINGLES):
+            section_keys.setdefault(band, []).append(key)
+        with self._lock:
+            for band, key in enumerate(_band_keys(fingerprint["signature"])):
+                rows = self._conn.execute(
+                    "SELECT submission_id FROM lsh_buckets WHERE course_id = ? AND band = ? AND bucket = ?",
+                    (course_id, band, key)
+                ).fetchall()
+                candidates.update(row[0] for row in rows)
+            for band, keys in section_keys.items():
+                # Stay below SQLite's bound-parameter limit
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    rows = self._conn.execute(
+                        "SELECT DISTINCT submission_id FROM section_buckets WHERE course_id = ? AND band = ? "
+                        f"AND bucket IN ({','.join('?' * len(chunk))})",
+                        [course_id, band] + chunk
+                    ).fetchall()
+                    candidates.update(row[0] for row in rows)
+        candidates.discard(exclude_submission_id)
+        return candidates
+
+    def find_similar(self, course_id, text=None, exclude_submission_id=None, fingerprint=None):
+        """
+        Find the prior submissions of a course that share content with a document.
+
+        Args:
+            course_id: Course whose submissions are searched
+            text: Document text; also used to quote the shared passages
+            exclude_submission_id: Submission id to leave out (the document itself)
+            fingerprint: Fingerprint already computed with fingerprint_text
+
+        Returns:
+            List of matches, most contained first, each with "submission_id",
+            "document_name", "estimated_similarity" (MinHash Jaccard estimate),
+            "containment" (share of this document's shingles found in the match),
+            "matched_containment" (share of the match's shingles found in this
+            document) and "passages"
+        """
+        if not self.available:
+            return []
+        fingerprint = fingerprint or fingerprint_text(text)
+        if fingerprint is None:
+            return []
+        course_id = str(course_id)
+        exclude_submission_id = str(exclude_submission_id) if exclude_submission_id is not None else None
+
+        candidates = self._candidates(course_id, fingerprint, exclude_submission_id)
+        if not candidates:
+            return []
+
+        matches = []
+        for submission_id in candidates:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT document_name, signature, hashes, offsets FROM submissions WHERE submission_id = ?",
+                    (submission_id,)
+                ).fetchone()
+            if row is None:
+                continue
+            signature = np.frombuffer(row[1], dtype=np.uint32)
+            similarity = float(np.mean(signature == fingerprint["signature"]))
+            other_hashes = np.frombuffer(row[2], dtype=np.uint32)
+            containment = float(np.mean(np.isin(fingerprint["hashes"], other_hashes)))
+            matched_containment = float(np.mean(np.isin(other_hashes, fingerprint["hashes"])))
+            if (similarity < MIN_SIMILARITY and containment < MIN_CONTAINMENT and
+                    matched_containment < MIN_CONTAINMENT):
+                continue
+
+            other_offsets = np.frombuffer(row[3], dtype=np.int64).reshape(2, -1)
+            matches.append({
+                "submission_id": submission_id,
+                "document_name": row[0],
+                "estimated_similarity": round(similarity, 3),
+                "containment": round(containment, 3),
+                "matched_containment": round(matched_containment, 3),
+                "passages": shared_passages(fingerprint, other_hashes, other_offsets[0], other_offsets[1], text)
+            })
+
+        matches.sort(key=lambda match: (max(match["containment"], match["matched_containment"]),
+                                        match["estimated_similarity"]), reverse=True)
+        return matches
+
+    def check_submission(self, submission_id, course_id, text, document_name=None):
+        """
+        Compare a submission with the prior submissions of its course, then index it.
+
+        Returns:
+            Dictionary with "status", "course_id", "submission_id", "indexed_submissions"
+            (prior submissions in the course) and "matches" (see find_similar)
+        """
+        if not self.available:
+            return {
+                "status": "skipped",
+                "message": "Submission index unavailable",
+                "course_id": str(course_id),
+                "submission_id": str(submission_id),
+                "matches": []
+            }
+        fingerprint = fingerprint_text(text)
+        if fingerprint is None:
+            return {
+                "status": "skipped",
+                "message": "Document is too short to fingerprint",
+                "course_id": str(course_id),
+                "submission_id": str(submission_id),
+                "matches": []
+            }
+
+        matches = self.find_similar(course_id, text, exclude_submission_id=submission_id, fingerprint=fingerprint)
+        indexed = self.count(course_id)
+        self.add_submission(submission_id, course_id, document_name=document_name, fingerprint=fingerprint)
+        logger.info(f"Submission {submission_id} in course {course_id}: {len(matches)} similar "
+                    f"submissions among {indexed} indexed")
+        return {
+            "status": "success",
+            "course_id": str(course_id),
+            "submission_id": str(submission_id),
+            "indexed_submissions": indexed,
+            "matches": matches
+        }
+
+
+def benchmark(submission_count=2000, seed=5, trials=20):
+    """
+    Index synthetic submissions, time the near-duplicate check of a copied one, and
+    count how often a pasted section is found.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"word{n}" for n in range(3000)]
+
+    def essay(length=1500):
+        return " ".join(rng.choice(vocabulary) for _ in range(length))
+
+    index = SubmissionFingerprintIndex(":memory:")
+    start = time.perf_counter()
+    originals = []
+    for n in range(submission_count):
+        text = essay()
+        originals.append(text)
+        index.add_submission(f"s{n}", "course-1", text)
+    index_seconds = time.perf_counter() - start
+
+    # Half of an earlier submission pasted into otherwise new text
+    source = originals[submission_count // 2].split()
+    copied = " ".join(essay(750).split() + source[300:1050])
+
+    start = time.perf_counter()
+    report = index.check_submission("new", "course-1", copied)
+    query_seconds = time.perf_counter() - start
+
+    print(f"Indexed {submission_count} submissions in {index_seconds:.2f}s "
+          f"({submission_count / index_seconds:.0f} per second)")
+    print(f"Checked a new submission in {query_seconds * 1000:.1f} ms")
+    for match in report["matches"]:
+        print(f"  {match['submission_id']}: similarity {match['estimated_similarity']}, "
+              f"containment {match['containment']}/{match['matched_containment']}, {len(match['passages'])} passages, "
+              f"longest {match['passages'][0]['shingles'] if match['passages'] else 0} shingles")
+
+    # One 300-word section of an earlier submission pasted into a 3000-word document
+    found = document_bands = 0
+    for trial in range(trials):
+        source_id = rng.randrange(submission_count)
+        source = originals[source_id].split()
+        offset = rng.randrange(len(source) - 300)
+        words = essay(3000).split()
+        words[1000:1000] = source[offset:offset + 300]
+        fingerprint = fingerprint_text(" ".join(words))
+        source_signature = minhash_signature(shingle_text(originals[source_id])[0])
+        document_bands += any(key == other for key, other in
+                              zip(_band_keys(fingerprint["signature"]), _band_keys(source_signature)))
+        matches = index.find_similar("course-1", fingerprint=fingerprint)
+        found += any(match["submission_id"] == f"s{source_id}" for match in matches)
+    print(f"Pasted section found in {found} of {trials} trials "
+          f"(document bands alone: {document_bands} of {trials})")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -7,7 +7,7 @@ from PyPDF2 import PdfReader
 import logging
 from concurrent.futures import ThreadPoolExecutor
 import functools
-import openai
+import contextvars
 from business_value_evaluator import BusinessValueEvaluator
 from section_parser import SectionParser
 from contextlib import contextmanager
@@ -15,9 +15,10 @@ from functools import lru_cache
 from typing import List, Dict
 import fitz  # PyMuPDF for PDF processing
 import io
-import base64
 from PIL import Image
-import PyPDF2
+from llm_gateway import LLM_GATEWAY
+from caption_index import FigureCaptionIndex
+from diagram_extraction import DIAGRAM_EXTRACTION
 
 # Enable/disable spell checking
 SPELLCHECK_ENABLED = True  # Now enabled by default
@@ -29,16 +30,6 @@ CHUNK_SIZE = 5000
 CACHE_SIZE = 128
 MAX_WORKERS = 4
 
-# List of figure types to extract
-IMPORTANT_FIGURES = [
-    "system overview", 
-    "system context", 
-    "use case", 
-    "eerd", 
-    "entity relationship", 
-    "class diagram", 
-    "gantt chart"
-]
 
 # Common technical words to ignore in spell checking
 TECHNICAL_WORDS = {
@@ -62,7 +53,8 @@ def async_operation(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future = executor.submit(func, *args, **kwargs)
+            # Run in the caller's context so LLM calls stay attributed to its document
+            future = executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
             return future.result()
     return wrapper
 
@@ -270,19 +262,18 @@ class TextProcessor:
                 logger.debug("Text too short for summarization, returning original")
                 return text
             # Generate summary using updated OpenAI API
-            client = openai.OpenAI()
-            response = client.chat.completions.create(
-                model="gpt-4",
+            return LLM_GATEWAY.chat(
+                "content_analysis.section_scope",
                 messages=[
                     {
                         "role": "user",
                         "content": f"Summarize this text concisely, focusing on key points: {text}"
                     }
                 ],
+                model="gpt-4",
                 max_tokens=max_length * 4,
                 temperature=0.3
             )
-            return response.choices[0].message.content
         except Exception as e:
             logger.error(f"Error generating section scope: {e}")
             # Fallback: return truncated version of original text
@@ -345,72 +336,7 @@ class TextProcessor:
 
     def _find_figures_in_sections(self, sections_dict):
         """Find all figures mentioned in the text and their location."""
-        figures = {}
-        
-        # Regex patterns for figure captions - making this more robust
-        figure_patterns = [
-            r'Figure\s+\d+[\.:]?\s*([^\.]+)',  # Figure 1: Title
-            r'Fig\.\s*\d+[\.:]?\s*([^\.]+)',    # Fig. 1: Title
-            r'Figure\s+\d+[^a-zA-Z0-9]*([a-zA-Z].+?)\s*(?:\n|$)', # Figure 1 Title
-            r'(?:FIGURE|Fig)[^a-zA-Z0-9]*\d+[^a-zA-Z0-9]*([a-zA-Z].+?)\s*(?:\n|$)', # FIGURE 1 Title
-            r'\bEERD\b',   # Just "EERD" 
-            r'\bEntity\s+Relationship\b',  # Entity Relationship
-            r'\bUse\s+Case\b',  # Use Case
-            r'\bClass\s+Diagram\b',  # Class Diagram
-            r'\bGantt\s+Chart\b',  # Gantt Chart
-            r'\bSystem\s+Overview\b',  # System Overview
-            r'\bSystem\s+Context\b'  # System Context
-        ]
-        
-        for section_title, content in sections_dict.items():
-            # Store the section itself if it's a potential diagram section
-            section_lower = section_title.lower()
-            for important_term in IMPORTANT_FIGURES:
-                if important_term in section_lower:
-                    clean_title = self.strip_numbering(section_title)
-                    if clean_title not in figures:
-                        figures[clean_title] = {
-                            'sections': [section_title],
-                            'mentions': 1,
-                            'is_section_title': True
-                        }
-                    break
-            
-            # Look for figure captions in content
-            for pattern in figure_patterns:
-                # Special case for single-word patterns
-                if pattern.startswith(r'\b') and pattern.endswith(r'\b'):
-                    term = pattern[2:-2]  # Extract the term between \b markers
-                    if re.search(pattern, content, re.IGNORECASE):
-                        if term not in figures:
-                            figures[term] = {
-                                'sections': [section_title],
-                                'mentions': 1
-                            }
-                        else:
-                            figures[term]['mentions'] += 1
-                            if section_title not in figures[term]['sections']:
-                                figures[term]['sections'].append(section_title)
-                    continue
-                
-                # Regular pattern matching for multi-word patterns
-                matches = re.finditer(pattern, content, re.IGNORECASE)
-                for match in matches:
-                    if pattern.startswith(r'\b'):
-                        # For the special case patterns that don't have capture groups
-                        figure_caption = match.group(0).strip()
-                    else:
-                        figure_caption = match.group(1).strip() 
-                    
-                    if figure_caption not in figures:
-                        figures[figure_caption] = {
-                            'sections': [section_title],
-                            'mentions': 1
-                        }
-                    else:
-                        figures[figure_caption]['mentions'] += 1
-                        if section_title not in figures[figure_caption]['sections']:
-                            figures[figure_caption]['sections'].append(section_title)
+        figures = FigureCaptionIndex.from_sections(sections_dict, self.strip_numbering).figures
         
         # Log all figures found for debugging
         logger.info(f"Found {len(figures)} potential figures in document")
@@ -419,6 +345,19 @@ class TextProcessor:
         
         return figures
 
+    def extract_diagrams(self, pdf_path, sections_dict=None):
+        """
+        The diagrams of a PDF, from the diagram extraction stage shared by the analyses.
+
+        Args:
+            pdf_path: Path to the PDF file
+            sections_dict: Optional {section title: content} to find the figures in
+
+        Returns:
+            ExtractedDiagrams, extracted once per document
+        """
+        return DIAGRAM_EXTRACTION.extract(pdf_path, self, sections_dict)
+
     def extract_figure_texts_from_sections(self, sections_dict, pdf_path):
         """
         Extract text from specific figures in the document and create scopes for similarity analysis.
@@ -435,146 +374,10 @@ class TextProcessor:
         # Import ImageProcessor here to avoid circular dependency
         from image_processing import ImageProcessor
         
-        # Initialize image processor
-        image_processor = ImageProcessor()
-        figure_texts = {}
-        
-        # Map of standard figure names for better display
-        figure_name_map = {
-            "system overview": "System Overview",
-            "system context": "System Context Diagram",
-            "use case": "Use Case Diagram",
-            "eerd": "EERD",
-            "entity relationship": "Entity Relationship Diagram",
-            "class diagram": "Class Diagram",
-            "gantt chart": "Gantt Chart"
-        }
-        
         try:
-            # Find all figures mentioned in the document
-            all_figures = self._find_figures_in_sections(sections_dict)
-            
-            # Filter to only the figures we want to process - major optimization
-            important_figures = {}
-            for figure_name, figure_info in all_figures.items():
-                figure_name_lower = figure_name.lower()
-                is_important = any(
-                    important_term in figure_name_lower 
-                    for important_term in IMPORTANT_FIGURES
-                )
-                
-                if is_important:
-                    important_figures[figure_name] = figure_info
-                    logger.info(f"Will process figure: {figure_name}")
-            
-            # If no important figures found, log details and try a more general approach
-            if not important_figures:
-                logger.warning("No important figures found with exact matching, trying broader matching")
-                # Add generic figures by type
-                for important_term in IMPORTANT_FIGURES:
-                    important_figures[important_term] = {
-                        'sections': ["Generic Section"],
-                        'mentions': 1,
-                        'generic': True
-                    }
-                    logger.info(f"Added generic figure type: {important_term}")
-            
-            # Extract only the images we need based on section context
-            logger.info(f"Extracting images for {len(important_figures)} important diagrams")
-            target_names = list(important_figures.keys())
-            # Also include the important terms to ensure detection
-            target_names.extend(IMPORTANT_FIGURES)
-            logger.info(f"Target figure names: {target_names}")
-            
-            image_paths = image_processor.extract_images_from_pdf(pdf_path, 
-                                                               target_figures=target_names)
-            
-            # Match images to figures
-            for figure_name, figure_info in important_figures.items():
-                logger.info(f"Processing figure: {figure_name}")
-                
-                # Find relevant images for this figure
-                relevant_images = []
-                for image_path in image_paths:
-                    # Skip processing if we already have enough images for this figure
-                    if len(relevant_images) >= 2:
-                        break
-                    
-                    # Check if image belongs to a section that mentions this figure
-                    is_relevant = False
-                    
-                    # If this is a generic figure, be more lenient in matching
-                    if figure_info.get('generic', False):
-                        # Check if path contains any part of the figure name
-                        figure_parts = figure_name.split()
-                        is_relevant = any(part.lower() in image_path.lower() for part in figure_parts)
-                    else:
-                        # Use stricter matching for normal figures
-                        image_sections = figure_info.get('sections', [])
-                        is_relevant = any(
-                            section.lower() in image_path.lower() for section in image_sections
-                        )
-                    
-                    if is_relevant:
-                        relevant_images.append(image_path)
-                        logger.info(f"Found relevant image for {figure_name}: {image_path}")
-                
-                # If no relevant images found, try a broader approach
-                if not relevant_images:
-                    logger.warning(f"No relevant images found for {figure_name}, using broader matching")
-                    # Check for partial matches in image paths
-                    figure_parts = figure_name.lower().split()
-                    for image_path in image_paths:
-                        for part in figure_parts:
-                            if len(part) > 3 and part in image_path.lower():  # Only use parts with >3 chars
-                                relevant_images.append(image_path)
-                                logger.info(f"Found image with partial match for {figure_name}: {image_path}")
-                                break
-                        
-                        if len(relevant_images) >= 2:
-                            break
-                
-                # Only process the most relevant images for this figure
-                texts = []
-                for image_path in relevant_images:
-                    # Extract text from image
-                    image_text = image_processor.extract_text_from_image(image_path)
-                    
-                    if image_text.strip():
-                        texts.append(image_text)
-                
-                # Combine all texts for this figure type
-                if texts:
-                    combined_text = "\n".join(texts)
-                    
-                    # Generate scope from combined text
-                    figure_scope = self.generate_section_scope(combined_text)
-                    
-                    # Get a cleaner display name for this figure type
-                    display_name = None
-                    for key, mapped_name in figure_name_map.items():
-                        if key in figure_name.lower():
-                            display_name = mapped_name
-                            break
-                    
-                    # If no specific match found, use a generic cleaned version
-                    if not display_name:
-                        # Use the figure name map for the IMPORTANT_FIGURES terms
-                        for key, mapped_name in figure_name_map.items():
-                            if key in figure_name.lower():
-                                display_name = mapped_name
-                                break
-                        
-                        # If still no match, use the figure name directly
-                        if not display_name:
-                            display_name = f"Figure: {figure_name}"
-                    
-                    # Store the scope with the display name
-                    figure_texts[display_name] = figure_scope
-                    logger.info(f"Added figure scope for {display_name}")
-            
-            return figure_texts
-            
+            return self.extract_diagrams(pdf_path, sections_dict).figure_texts(
+                ImageProcessor.extract_text_from_image, self.generate_section_scope
+            )
         except Exception as e:
             logger.error(f"Error extracting figure texts: {str(e)}")
             return {}
@@ -601,9 +404,8 @@ class TextProcessor:
             
             Format the response as a clear, structured system scope."""
             
-            client = openai.OpenAI()
-            response = client.chat.completions.create(
-                model="gpt-4",
+            return LLM_GATEWAY.chat(
+                "content_analysis.system_scope",
                 messages=[
                     {
                         "role": "system",
@@ -614,12 +416,11 @@ class TextProcessor:
                         "content": prompt
                     }
                 ],
+                model="gpt-4",
                 max_tokens=500,
                 temperature=0.3
             )
             
-            return response.choices[0].message.content
-            
         except Exception as e:
             logger.error(f"Error creating system scope: {str(e)}")
             return text  # Return original text if processing fails
@@ -664,168 +465,17 @@ class TextProcessor:
 
     def extract_diagrams_from_pdf(self, pdf_path):
         """
-        Extract and analyze diagrams from the PDF using OpenAI's vision model.
+        Extract the diagrams of the PDF for the diagram convention checks.
         
         Args:
             pdf_path: Path to the PDF file
             
         Returns:
-            Dictionary of diagram scopes {diagram_name: system_scope}
+            Dictionary {diagram_name: {"figure": figure name, "image": PdfImage, "section": first
+            section title, "sections", "pages", "occurrences": every placement of the image}}
         """
-        logger.info("Extracting and analyzing diagrams from PDF")
-        
-        # Import ImageProcessor here to avoid circular dependency
-        from image_processing import ImageProcessor
-        
-        # Initialize image processor
-        image_processor = ImageProcessor()
-        diagram_scopes = {}
-        
-        # Map of standard figure names for better display
-        figure_name_map = {
-            "system overview": "System Overview",
-            "system context": "System Context Diagram",
-            "use case": "Use Case Diagram",
-            "eerd": "EERD",
-            "entity relationship": "Entity Relationship Diagram",
-            "class diagram": "Class Diagram",
-            "gantt chart": "Gantt Chart"
-        }
-        
-        try:
-            # First, find all figures mentioned in the document
-            sections_dict = {}
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text = page.extract_text()
-                    if text.strip():
-                        # Split text into sections based on headers
-                        lines = text.splitlines()
-                        current_section = None
-                        current_content = []
-                        
-                        for line in lines:
-                            if re.match(r'^\d+(\.\d+)*\s+[A-Z]', line):
-                                if current_section and current_content:
-                                    sections_dict[current_section] = '\n'.join(current_content)
-                                current_section = line.strip()
-                                current_content = []
-                            elif current_section:
-                                current_content.append(line)
-                        
-                        if current_section and current_content:
-                            sections_dict[current_section] = '\n'.join(current_content)
-            
-            # Find all figures mentioned in the document
-            all_figures = self._find_figures_in_sections(sections_dict)
-            
-            # Filter to only the figures we want to process
-            important_figures = {}
-            for figure_name, figure_info in all_figures.items():
-                figure_name_lower = figure_name.lower()
-                is_important = any(
-                    important_term in figure_name_lower 
-                    for important_term in IMPORTANT_FIGURES
-                )
-                
-                if is_important:
-                    important_figures[figure_name] = figure_info
-                    logger.info(f"Will process figure: {figure_name}")
-            
-            # If no important figures found, try a more general approach
-            if not important_figures:
-                logger.warning("No important figures found with exact matching, trying broader matching")
-                for important_term in IMPORTANT_FIGURES:
-                    important_figures[important_term] = {
-                        'sections': ["Generic Section"],
-                        'mentions': 1,
-                        'generic': True
-                    }
-                    logger.info(f"Added generic figure type: {important_term}")
-            
-            # Extract images based on section context
-            logger.info(f"Extracting images for {len(important_figures)} important diagrams")
-            target_names = list(important_figures.keys())
-            target_names.extend(IMPORTANT_FIGURES)
-            logger.info(f"Target figure names: {target_names}")
-            
-            image_paths = image_processor.extract_images_from_pdf(pdf_path, 
-                                                               target_figures=target_names)
-            
-            # Match images to figures
-            for figure_name, figure_info in important_figures.items():
-                logger.info(f"Processing figure: {figure_name}")
-                
-                # Find relevant images for this figure
-                relevant_images = []
-                for image_path in image_paths:
-                    # Skip processing if we already have enough images for this figure
-                    if len(relevant_images) >= 2:
-                        break
-                    
-                    # Check if image belongs to a section that mentions this figure
-                    is_relevant = False
-                    
-                    # If this is a generic figure, be more lenient in matching
-                    if figure_info.get('generic', False):
-                        # Check if path contains any part of the figure name
-                        figure_parts = figure_name.split()
-                        is_relevant = any(part.lower() in image_path.lower() for part in figure_parts)
-                    else:
-                        # Use stricter matching for normal figures
-                        image_sections = figure_info.get('sections', [])
-                        is_relevant = any(
-                            section.lower() in image_path.lower() for section in image_sections
-                        )
-                    
-                    if is_relevant:
-                        relevant_images.append(image_path)
-                        logger.info(f"Found relevant image for {figure_name}: {image_path}")
-                
-                # If no relevant images found, try a broader approach
-                if not relevant_images:
-                    logger.warning(f"No relevant images found for {figure_name}, using broader matching")
-                    # Check for partial matches in image paths
-                    figure_parts = figure_name.lower().split()
-                    for image_path in image_paths:
-                        for part in figure_parts:
-                            if len(part) > 3 and part in image_path.lower():  # Only use parts with >3 chars
-                                relevant_images.append(image_path)
-                                logger.info(f"Found image with partial match for {figure_name}: {image_path}")
-                                break
-                        
-                        if len(relevant_images) >= 2:
-                            break
-                
-                # Process the most relevant images with OpenAI vision model
-                for image_path in relevant_images:
-                    try:
-                        
-                        
-                        # Get a cleaner display name for this figure type
-                        display_name = None
-                        for key, mapped_name in figure_name_map.items():
-                            if key in figure_name.lower():
-                                display_name = mapped_name
-                                break
-                        
-                        # If no specific match found, use a generic name
-                        if not display_name:
-                            display_name = f"Diagram_{len(diagram_scopes) + 1}"
-                        
-
-                        logger.info(f"Added diagram scope for {display_name}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing image {image_path}: {str(e)}")
-                        continue
-            
-            return diagram_scopes
-            
-        except Exception as e:
-            logger.error(f"Error extracting diagrams: {str(e)}")
-            return {}
+        logger.info("Extracting diagrams from PDF")
+        return dict(self.extract_diagrams(pdf_path).diagrams)
 
     def extract_diagrams_from_pdf_cotentanalysis(self, pdf_path):
         """
@@ -838,201 +488,7 @@ class TextProcessor:
             Dictionary of diagram scopes {diagram_name: system_scope}
         """
         logger.info("Extracting and analyzing diagrams from PDF")
-        
-        # Import ImageProcessor here to avoid circular dependency
-        from image_processing import ImageProcessor
-        
-        # Initialize image processor
-        image_processor = ImageProcessor()
-        diagram_scopes = {}
-        
-        # Map of standard figure names for better display
-        figure_name_map = {
-            "system overview": "System Overview",
-            "system context": "System Context Diagram",
-            "use case": "Use Case Diagram",
-            "eerd": "EERD",
-            "entity relationship": "Entity Relationship Diagram",
-            "class diagram": "Class Diagram",
-            "gantt chart": "Gantt Chart"
-        }
-        
-        try:
-            # First, find all figures mentioned in the document
-            sections_dict = {}
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text = page.extract_text()
-                    if text.strip():
-                        # Split text into sections based on headers
-                        lines = text.splitlines()
-                        current_section = None
-                        current_content = []
-                        
-                        for line in lines:
-                            if re.match(r'^\d+(\.\d+)*\s+[A-Z]', line):
-                                if current_section and current_content:
-                                    sections_dict[current_section] = '\n'.join(current_content)
-                                current_section = line.strip()
-                                current_content = []
-                            elif current_section:
-                                current_content.append(line)
-                        
-                        if current_section and current_content:
-                            sections_dict[current_section] = '\n'.join(current_content)
-            
-            # Find all figures mentioned in the document
-            all_figures = self._find_figures_in_sections(sections_dict)
-            
-            # Filter to only the figures we want to process
-            important_figures = {}
-            for figure_name, figure_info in all_figures.items():
-                figure_name_lower = figure_name.lower()
-                is_important = any(
-                    important_term in figure_name_lower 
-                    for important_term in IMPORTANT_FIGURES
-                )
-                
-                if is_important:
-                    important_figures[figure_name] = figure_info
-                    logger.info(f"Will process figure: {figure_name}")
-            
-            # If no important figures found, try a more general approach
-            if not important_figures:
-                logger.warning("No important figures found with exact matching, trying broader matching")
-                for important_term in IMPORTANT_FIGURES:
-                    important_figures[important_term] = {
-                        'sections': ["Generic Section"],
-                        'mentions': 1,
-                        'generic': True
-                    }
-                    logger.info(f"Added generic figure type: {important_term}")
-            
-            # Extract images based on section context
-            logger.info(f"Extracting images for {len(important_figures)} important diagrams")
-            target_names = list(important_figures.keys())
-            target_names.extend(IMPORTANT_FIGURES)
-            logger.info(f"Target figure names: {target_names}")
-            
-            image_paths = image_processor.extract_images_from_pdf(pdf_path, 
-                                                               target_figures=target_names)
-            
-            # Match images to figures
-            for figure_name, figure_info in important_figures.items():
-                logger.info(f"Processing figure: {figure_name}")
-                
-                # Find relevant images for this figure
-                relevant_images = []
-                for image_path in image_paths:
-                    # Skip processing if we already have enough images for this figure
-                    if len(relevant_images) >= 2:
-                        break
-                    
-                    # Check if image belongs to a section that mentions this figure
-                    is_relevant = False
-                    
-                    # If this is a generic figure, be more lenient in matching
-                    if figure_info.get('generic', False):
-                        # Check if path contains any part of the figure name
-                        figure_parts = figure_name.split()
-                        is_relevant = any(part.lower() in image_path.lower() for part in figure_parts)
-                    else:
-                        # Use stricter matching for normal figures
-                        image_sections = figure_info.get('sections', [])
-                        is_relevant = any(
-                            section.lower() in image_path.lower() for section in image_sections
-                        )
-                    
-                    if is_relevant:
-                        relevant_images.append(image_path)
-                        logger.info(f"Found relevant image for {figure_name}: {image_path}")
-                
-                # If no relevant images found, try a broader approach
-                if not relevant_images:
-                    logger.warning(f"No relevant images found for {figure_name}, using broader matching")
-                    # Check for partial matches in image paths
-                    figure_parts = figure_name.lower().split()
-                    for image_path in image_paths:
-                        for part in figure_parts:
-                            if len(part) > 3 and part in image_path.lower():  # Only use parts with >3 chars
-                                relevant_images.append(image_path)
-                                logger.info(f"Found image with partial match for {figure_name}: {image_path}")
-                                break
-                        
-                        if len(relevant_images) >= 2:
-                            break
-                
-                # Process the most relevant images with OpenAI vision model
-                for image_path in relevant_images:
-                    try:
-                        # Convert image to base64
-                        with open(image_path, "rb") as image_file:
-                            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-                        
-                        # Create prompt for OpenAI vision model
-                        prompt = """
-                        Analyze this diagram and create a system scope that includes:
-                        1. Main system components and their roles
-                        2. Key relationships between components
-                        3. System boundaries and interfaces
-                        4. Critical interactions
-                        
-                        Format the scope as:
-                        System: [Main system name/description]
-                        Components: [List of main components and their roles]
-                        Relationships: [List of key relationships]
-                        Boundaries: [System boundaries and interfaces]
-                        """
-                        
-                        # Call OpenAI vision model with updated API
-                        client = openai.OpenAI()
-                        response = client.chat.completions.create(
-                            model="gpt-4o",
-                            messages=[
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {"type": "text", "text": prompt},
-                                        {
-                                            "type": "image_url",
-                                            "image_url": {
-                                                "url": f"data:image/jpeg;base64,{image_data}"
-                                            }
-                                        }
-                                    ]
-                                }
-                            ],
-                            max_tokens=500
-                        )
-                        
-                        # Get the analysis result
-                        analysis = response.choices[0].message.content
-                        
-                        # Get a cleaner display name for this figure type
-                        display_name = None
-                        for key, mapped_name in figure_name_map.items():
-                            if key in figure_name.lower():
-                                display_name = mapped_name
-                                break
-                        
-                        # If no specific match found, use a generic name
-                        if not display_name:
-                            display_name = f"Diagram_{len(diagram_scopes) + 1}"
-                        
-                        # Store the scope with the display name
-                        diagram_scopes[display_name] = analysis
-                        logger.info(f"Added diagram scope for {display_name}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing image {image_path}: {str(e)}")
-                        continue
-            
-            return diagram_scopes
-            
-        except Exception as e:
-            logger.error(f"Error extracting diagrams: {str(e)}")
-            return {}
+        return self.extract_diagrams(pdf_path).vision_scopes()
 
     def _extract_diagram_type(self, analysis: str) -> str:
         """Extract diagram type from analysis text."""
@@ -0,0 +1,154 @@
+import os
+import logging
+import threading
+from urllib.parse import urlsplit, quote_plus
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+# Search endpoint; "{query}" is replaced by the URL-encoded phrase. Point this at a
+# local stand-in server to exercise the plagiarism checker without hitting Google.
+SEARCH_URL_TEMPLATE = os.getenv("PLAGIARISM_SEARCH_URL", "https://www.google.com/search?q={query}")
+
+# Requests in flight across all hosts
+MAX_CONCURRENT_FETCHES = int(os.getenv("PLAGIARISM_MAX_CONCURRENCY", "16"))
+# Requests in flight to any single host
+PER_HOST_LIMIT = int(os.getenv("PLAGIARISM_PER_HOST_LIMIT", "2"))
+# (connect, read) timeouts in seconds
+FETCH_TIMEOUT = (3.05, 6)
+# Pages larger than this are truncated; the similarity check only needs the text
+MAX_RESPONSE_BYTES = 2 * 1024 * 1024
+# Search results kept per phrase
+MAX_SEARCH_RESULTS = 5
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+
+
+class WebFetcher:
+    """
+    Connection-pooled, concurrency-bounded HTTP fetcher for the plagiarism checker.
+
+    One requests.Session (and its keep-alive pool) is shared by every request. A thread
+    pool bounds the total number of requests in flight, a semaphore per host keeps the
+    checker polite towards any single site, and responses are streamed with a byte cap
+    so a huge page cannot stall a check.
+    """
+
+    def __init__(self, search_url_template=SEARCH_URL_TEMPLATE, max_workers=MAX_CONCURRENT_FETCHES,
+                 per_host_limit=PER_HOST_LIMIT, timeout=FETCH_TIMEOUT, max_bytes=MAX_RESPONSE_BYTES):
+        self.search_url_template = search_url_template
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT})
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="web-fetch")
+        self._host_limits = {}
+        self._host_lock = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._host_lock:
+            semaphore = self._host_limits.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_limits[host] = semaphore
+            return semaphore
+
+    def fetch(self, url):
+        """
+        Fetch a URL and return its decoded body.
+
+        Returns:
+            Dictionary with "url", "status" and "text" (None when the request failed
+            or the response is not text)
+        """
+        with self._host_semaphore(url):
+            try:
+                with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                    content_type = response.headers.get('Content-Type', '')
+                    if content_type and 'text' not in content_type and 'html' not in content_type:
+                        logger.debug(f"Skipping non-text response from {url}: {content_type}")
+                        return {"url": url, "status": response.status_code, "text": None}
+
+                    body = bytearray()
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        body.extend(chunk)
+                        if len(body) >= self.max_bytes:
+                            logger.debug(f"Truncated {url} at {self.max_bytes} bytes")
+                            del body[self.max_bytes:]
+                            break
+                    encoding = response.encoding or 'utf-8'
+                    return {
+                        "url": url,
+                        "status": response.status_code,
+                        "text": bytes(body).decode(encoding, errors='replace')
+                    }
+            except requests.RequestException as e:
+                logger.warning(f"Error fetching {url}: {str(e)}")
+                return {"url": url, "status": None, "text": None}
+
+    def fetch_many(self, urls):
+        """
+        Fetch several URLs concurrently.
+
+        Returns:
+            Dictionary {url: fetch result}; duplicate URLs are fetched once
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        return dict(zip(unique_urls, self._executor.map(self.fetch, unique_urls)))
+
+    def search_url(self, query):
+        """Return the search URL for a phrase."""
+        return self.search_url_template.replace("{query}", quote_plus(query))
+
+    @staticmethod
+    def parse_search_results(html, max_results=MAX_SEARCH_RESULTS):
+        """Extract {"title", "link"} results from a search results page."""
+        soup = BeautifulSoup(html or '', 'html.parser')
+        results = []
+        for result in soup.find_all('div', class_='g'):
+            title_elem = result.find('h3')
+            link_elem = result.find('a')
+            if not (title_elem and link_elem):
+                continue
+            link = link_elem.get('href')
+            # Skip the search engine's own links
+            if link and not link.startswith('/search?') and not link.startswith('https://www.google.com/'):
+                results.append({'title': title_elem.get_text(), 'link': link})
+                if len(results) >= max_results:
+                    break
+        return results
+
+    def search(self, query):
+        """Search for a phrase and return its top results."""
+        response = self.fetch(self.search_url(query))
+        if not response["text"]:
+            return []
+        return self.parse_search_results(response["text"])
+
+    def search_many(self, queries):
+        """
+        Search several phrases concurrently.
+
+        Returns:
+            List of result lists, in the order of the queries
+        """
+        return list(self._executor.map(self.search, queries))
+
+    @staticmethod
+    def page_text(html):
+        """Return the visible text of an HTML page with whitespace collapsed."""
+        soup = BeautifulSoup(html or '', 'html.parser')
+        for element in soup(['script', 'style', 'header', 'footer', 'nav', 'iframe']):
+            element.decompose()
+        return ' '.join(soup.get_text().split())
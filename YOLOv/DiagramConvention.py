@@ -9,8 +9,19 @@ from seqDiagramScript import process_sequence_diagram
 def process_diagrams(upload_base="Uploads", 
                     output_base="output_results", 
                     model_path="runs/detect/train/weights/best.pt", 
-                    document_type="SRS"):
-    """Process diagrams based on document type: use case and class for SRS, sequence and class for SDD."""
+                    document_type="SRS",
+                    images=None,
+                    url_prefix="output_results"):
+    """
+    Process diagrams based on document type: use case and class for SRS, sequence and class for SDD.
+
+    images, when given, maps "use_case", "class" and "sequence" to lists of
+    (name, image) pairs held in memory (see diagram_images.iter_images), which are
+    processed instead of the files under upload_base. Only the annotated outputs are
+    written to output_base, and the returned paths are url_prefix followed by the
+    path inside output_base (give each request its own output_base and url_prefix
+    so requests neither validate nor overwrite each other's outputs).
+    """
     if document_type == "SRS":
         use_case_folder = os.path.join(upload_base, "System Functions")
         class_folder = os.path.join(upload_base, "Preliminary Object-Oriented Domain Analysis")
@@ -23,6 +34,11 @@ def process_diagrams(upload_base="Uploads",
             "message": f"Invalid document type: {document_type}. Must be 'SRS' or 'SDD'."
         }
     
+    def has_diagrams(folder, kind):
+        if images is not None:
+            return bool(images.get(kind))
+        return os.path.exists(folder)
+
     results = {
         "status": "success",
         "use_case_diagrams": {},
@@ -44,9 +60,10 @@ def process_diagrams(upload_base="Uploads",
         }
     
     # Process use case diagrams (only for SRS)
-    if document_type == "SRS" and os.path.exists(use_case_folder):
+    if document_type == "SRS" and has_diagrams(use_case_folder, "use_case"):
         use_case_output = os.path.join(output_base, "use_case")
-        use_case_results = process_use_case_diagram(use_case_folder, use_case_output, model_path)
+        use_case_results = process_use_case_diagram(use_case_folder, use_case_output, model_path,
+                                                    images and images.get("use_case"))
         if "error" in use_case_results:
             results["issues"].append(use_case_results["error"])
         else:
@@ -67,14 +84,14 @@ def process_diagrams(upload_base="Uploads",
                 print(f"Derived image path: {image_path}")
                 print(f"Derived JSON path: {json_path}")
                 if os.path.exists(image_path):
-                    # Prefix path with /output_results
-                    relative_path = os.path.join("output_results", "use_case", os.path.basename(image_path)).replace('\\', '/')
+                    # Prefix path with the URL of output_base
+                    relative_path = os.path.join(url_prefix, "use_case", os.path.basename(image_path)).replace('\\', '/')
                     result_entry = {
                         "path": f"/{relative_path}",
                         "original_path": image_path.replace('\\', '/')
                     }
                     if json_path and os.path.exists(json_path):
-                        json_relative_path = os.path.join("output_results", "use_case", os.path.basename(json_path)).replace('\\', '/')
+                        json_relative_path = os.path.join(url_prefix, "use_case", os.path.basename(json_path)).replace('\\', '/')
                         result_entry["json_path"] = f"/{json_relative_path}"
                     sanitized_use_case_results[sanitized_key] = result_entry
                 else:
@@ -82,9 +99,10 @@ def process_diagrams(upload_base="Uploads",
             results["use_case_diagrams"] = sanitized_use_case_results
     
     # Process class diagrams (for both SRS and SDD)
-    if os.path.exists(class_folder):
+    if has_diagrams(class_folder, "class"):
         class_output = os.path.join(output_base, "class")
-        class_results = process_class_diagram(class_folder, class_output, model_path)
+        class_results = process_class_diagram(class_folder, class_output, model_path,
+                                              images and images.get("class"))
         if "error" in class_results:
             results["issues"].append(class_results["error"])
         else:
@@ -105,14 +123,14 @@ def process_diagrams(upload_base="Uploads",
                 print(f"Derived image path: {image_path}")
                 print(f"Derived JSON path: {json_path}")
                 if os.path.exists(image_path):
-                    # Prefix path with /output_results
-                    relative_path = os.path.join("output_results", "class", os.path.basename(image_path)).replace('\\', '/')
+                    # Prefix path with the URL of output_base
+                    relative_path = os.path.join(url_prefix, "class", os.path.basename(image_path)).replace('\\', '/')
                     result_entry = {
                         "path": f"/{relative_path}",
                         "original_path": image_path.replace('\\', '/')
                     }
                     if json_path and os.path.exists(json_path):
-                        json_relative_path = os.path.join("output_results", "class", os.path.basename(json_path)).replace('\\', '/')
+                        json_relative_path = os.path.join(url_prefix, "class", os.path.basename(json_path)).replace('\\', '/')
                         result_entry["json_path"] = f"/{json_relative_path}"
                     sanitized_class_results[sanitized_key] = result_entry
                 else:
@@ -120,9 +138,10 @@ def process_diagrams(upload_base="Uploads",
             results["class_diagrams"] = sanitized_class_results
     
     # Process sequence diagrams (only for SDD)
-    if document_type == "SDD" and os.path.exists(sequence_folder):
+    if document_type == "SDD" and has_diagrams(sequence_folder, "sequence"):
         sequence_output = os.path.join(output_base, "sequence")
-        sequence_results = process_sequence_diagram(sequence_folder, sequence_output, model_path)
+        sequence_results = process_sequence_diagram(sequence_folder, sequence_output, model_path,
+                                                    images and images.get("sequence"))
         if "error" in sequence_results:
             results["issues"].append(sequence_results["error"])
         else:
@@ -143,14 +162,14 @@ def process_diagrams(upload_base="Uploads",
                 print(f"Derived image path: {image_path}")
                 print(f"Derived JSON path: {json_path}")
                 if os.path.exists(image_path):
-                    # Prefix path with /output_results
-                    relative_path = os.path.join("output_results", "sequence", os.path.basename(image_path)).replace('\\', '/')
+                    # Prefix path with the URL of output_base
+                    relative_path = os.path.join(url_prefix, "sequence", os.path.basename(image_path)).replace('\\', '/')
                     result_entry = {
                         "path": f"/{relative_path}",
                         "original_path": image_path.replace('\\', '/')
                     }
                     if json_path and os.path.exists(json_path):
-                        json_relative_path = os.path.join("output_results", "sequence", os.path.basename(json_path)).replace('\\', '/')
+                        json_relative_path = os.path.join(url_prefix, "sequence", os.path.basename(json_path)).replace('\\', '/')
                         result_entry["json_path"] = f"/{json_relative_path}"
                     sanitized_sequence_results[sanitized_key] = result_entry
                 else:
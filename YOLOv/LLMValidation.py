@@ -3,6 +3,12 @@ import os
 import json
 import google.generativeai as genai
 
+# Route calls through the analyzer's cached LLM gateway when it is importable
+try:
+    from llm_gateway import LLM_GATEWAY
+except ImportError:
+    LLM_GATEWAY = None
+
 print("WELCOME TO GEMINIIIIIIIIIIIIIIIII")
 
 # 🔹 Step 1: Set up Gemini API Key
@@ -129,7 +135,6 @@ def generate_sequence_prompt(uml_json):
 # 🔹 Step 4: Validate UML with LLM
 def validate_uml(json_data, diagram_type):
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
         if diagram_type == "use_case":
             prompt = generate_use_case_prompt(json_data)
         elif diagram_type == "class":
@@ -139,6 +144,9 @@ def validate_uml(json_data, diagram_type):
         else:
             raise ValueError(f"Unsupported diagram type: {diagram_type}")
 
+        if LLM_GATEWAY is not None:
+            return LLM_GATEWAY.generate(f"llm_validation.{diagram_type}", prompt, model="gemini-1.5-flash")
+        model = genai.GenerativeModel("gemini-1.5-flash")
         response = model.generate_content(prompt)
         return response.text
     except Exception as e:
@@ -7,8 +7,9 @@ import json
 import numpy as np
 import os
 import platform
+from diagram_images import iter_images
 
-def process_use_case_diagram(image_folder, output_folder, model_path):
+def process_use_case_diagram(image_folder, output_folder, model_path, images=None):
     # Configure Tesseract path based on environment
     if platform.system() == "Windows":
         pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
@@ -31,12 +32,9 @@ def process_use_case_diagram(image_folder, output_folder, model_path):
     results = {}
     
     # Process each image in the folder
-    image_files = [f for f in os.listdir(image_folder) if f.lower().endswith((".png", ".jpg", ".jpeg"))]    
-    for image_name in image_files:
-        image_path = os.path.join(image_folder, image_name)
-        image = cv2.imread(image_path)
+    for image_name, image in iter_images(image_folder, images):
         if image is None:
-            print(f"Warning: Could not load image {image_path}")
+            print(f"Warning: Could not load image {image_name}")
             continue
             
         image_display = image.copy()
@@ -7,8 +7,9 @@ import json
 import numpy as np
 import os
 import platform
+from diagram_images import iter_images
 
-def process_class_diagram(image_folder, output_folder, model_path):
+def process_class_diagram(image_folder, output_folder, model_path, images=None):
     # Configure Tesseract path based on environment
     if platform.system() == "Windows":
         pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
@@ -25,14 +26,9 @@ def process_class_diagram(image_folder, output_folder, model_path):
     results = {}
     
     # Process each image in the folder
-    for image_name in os.listdir(image_folder):
-        if not image_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-            continue
-            
-        image_path = os.path.join(image_folder, image_name)
-        image = cv2.imread(image_path)
+    for image_name, image in iter_images(image_folder, images):
         if image is None:
-            print(f"Warning: Could not load image {image_path}")
+            print(f"Warning: Could not load image {image_name}")
             continue
             
         image_display = image.copy()
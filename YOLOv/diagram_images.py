@@ -0,0 +1,22 @@
+import os
+import cv2
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def iter_images(image_folder, images=None):
+    """
+    Yield (image_name, BGR array) for each diagram to process.
+
+    images, when given, is a list of (name, image) pairs held in memory, where image
+    is a decoded array or an object exposing one as `.array` (the analyzer's
+    PdfImage); nothing is read from disk then. Otherwise the image files of
+    image_folder are read. Images that cannot be decoded are yielded as None.
+    """
+    if images is not None:
+        for image_name, image in images:
+            yield image_name, getattr(image, "array", image)
+        return
+    for image_name in os.listdir(image_folder):
+        if image_name.lower().endswith(IMAGE_EXTENSIONS):
+            yield image_name, cv2.imread(os.path.join(image_folder, image_name))
@@ -2,8 +2,9 @@ import os
 import cv2
 import json
 from ultralytics import YOLO
+from diagram_images import iter_images
 
-def process_sequence_diagram(image_folder, output_folder, model_path):
+def process_sequence_diagram(image_folder, output_folder, model_path, images=None):
     """Process sequence diagrams to extract components using YOLO."""
     # Load YOLO model
     model = YOLO(model_path)
@@ -36,15 +37,13 @@ def process_sequence_diagram(image_folder, output_folder, model_path):
     }
 
     # Get image files
-    image_files = [f for f in os.listdir(image_folder) if f.endswith((".png", ".jpg", ".jpeg"))]
+    image_files = list(iter_images(image_folder, images))
     if not image_files:
         return {"error": f"No images found in {image_folder}"}
 
     results = {}
 
-    for image_name in image_files:
-        image_path = os.path.join(image_folder, image_name)
-        image = cv2.imread(image_path)
+    for image_name, image in image_files:
         if image is None:
             continue
 